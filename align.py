@@ -1,10 +1,16 @@
 import argparse
+import json
 import logging
 import multiprocessing
 import os
 import sys
 
 import gentle
+from gentle import batch
+from gentle import kaldi_queue
+from gentle import standard_kaldi
+from gentle.graph_cache import GraphCache
+from gentle.tracing import Tracer, NULL_TRACER
 
 parser = argparse.ArgumentParser(
         description='Align a transcript to audio by generating a new language model.  Outputs JSON')
@@ -22,19 +28,57 @@ parser.add_argument(
         '--disfluency', dest='disfluency', action='store_true',
         help='include disfluencies (uh, um) in alignment')
 parser.set_defaults(disfluency=False)
+parser.add_argument(
+        '--long-form', dest='long_form', action='store_true',
+        help='align long recordings segment by segment (see SegmentedAligner)')
+parser.set_defaults(long_form=False)
+parser.add_argument(
+        '--graph-cache', metavar='dir', type=str,
+        help='reuse alignment graphs stored in (and save new ones to) this directory')
+parser.add_argument(
+        '--k3-sessions', dest='k3_sessions', action='store_true',
+        help='run the k3 decoders as sessions of one process, which loads the model and graphs once')
+parser.set_defaults(k3_sessions=False)
+parser.add_argument(
+        '--k3-zygote', dest='k3_zygote', action='store_true',
+        help='fork the k3 decoders from a process that has the model loaded, so that they start at once')
+parser.set_defaults(k3_zygote=False)
+parser.add_argument(
+        '--previous', metavar='file', type=str,
+        help='the JSON output of an earlier alignment of an older version of the transcript to this audio; only the edits are aligned')
+parser.add_argument(
+        '--trace', metavar='file', type=str,
+        help='write a Chrome trace of the alignment to this file')
+parser.add_argument(
+        '--manifest', metavar='file', type=str,
+        help='align every item of a CSV or JSON lines manifest (with audio, transcript and output paths) instead, and output a summary')
+parser.add_argument(
+        '--results', metavar='file', type=str,
+        help='with --manifest, the JSON lines file results are added to, and a rerun resumes from (default: the manifest path + .results.jsonl)')
+parser.add_argument(
+        '--prefetch', default=2, type=int,
+        help='with --manifest, how many items to get ready while another is aligned')
+parser.add_argument(
+        '--retry-failed', dest='retry_failed', action='store_true',
+        help='with --manifest, try again the items that failed last time')
+parser.set_defaults(retry_failed=False)
 parser.add_argument(
         '--log', default="INFO",
         help='the log level (DEBUG, INFO, WARNING, ERROR, or CRITICAL)')
 parser.add_argument(
-        'audiofile', type=str,
+        'audiofile', type=str, nargs='?',
         help='audio file')
 parser.add_argument(
-        'txtfile', type=str,
+        'txtfile', type=str, nargs='?',
         help='transcript text file')
 args = parser.parse_args()
+if args.manifest is None and args.txtfile is None:
+    parser.error('an audio file and a transcript (or --manifest) are required')
 
 log_level = args.log.upper()
 logging.getLogger().setLevel(log_level)
+standard_kaldi.SESSIONS = args.k3_sessions
+standard_kaldi.ZYGOTE = args.k3_zygote
 
 disfluencies = set(['uh', 'um'])
 
@@ -43,16 +87,40 @@ def on_progress(p):
         logging.debug("%s: %s" % (k, v))
 
 
+resources = gentle.Resources()
+graph_cache = GraphCache(args.graph_cache) if args.graph_cache else None
+
+if args.manifest is not None:
+    # The model, the k3 workers and the graph cache serve every item
+    aligner = batch.BatchAligner(resources, args.results or args.manifest + '.results.jsonl', nthreads=args.nthreads, prefetch=args.prefetch, graph_cache=graph_cache, long_form=args.long_form, disfluency=args.disfluency, conservative=args.conservative, disfluencies=disfluencies)
+    summary = aligner.run(batch.read_manifest(args.manifest), retry_failed=args.retry_failed)
+    fh = open(args.output, 'w', encoding="utf-8") if args.output else sys.stdout
+    fh.write(json.dumps(summary, indent=2) + '\n')
+    logging.info("%d aligned, %d failed (of %d)" % (summary['aligned'], summary['failed'], summary['items']))
+    sys.exit(1 if summary['failed'] > 0 else 0)
+
 with open(args.txtfile, encoding="utf-8") as fh:
     transcript = fh.read()
 
-resources = gentle.Resources()
-logging.info("converting audio to 8K sampled wav")
+tracer = Tracer() if args.trace else NULL_TRACER
+# Start loading the acoustic model while the audio is converted
+pool = kaldi_queue.KaldiPool(resources, nworkers=args.nthreads)
+logging.info("decoding audio to 8K PCM")
 
-with gentle.resampled(args.audiofile) as wavfile:
+# Decoded straight into memory, without a temporary wav file
+with gentle.AudioSource.decode(args.audiofile) as source:
     logging.info("starting alignment")
-    aligner = gentle.ForcedAligner(resources, transcript, nthreads=args.nthreads, disfluency=args.disfluency, conservative=args.conservative, disfluencies=disfluencies)
-    result = aligner.transcribe(wavfile, progress_cb=on_progress, logging=logging)
+    kwargs = {'disfluency': args.disfluency, 'conservative': args.conservative, 'disfluencies': disfluencies}
+    if args.previous is not None:
+        previous = gentle.Transcription.from_jsonfile(args.previous)
+        aligner = gentle.IncrementalAligner(resources, previous, transcript, nthreads=args.nthreads, pool=pool, graph_cache=graph_cache, tracer=tracer, **kwargs)
+    else:
+        Aligner = gentle.SegmentedAligner if args.long_form else gentle.ForcedAligner
+        aligner = Aligner(resources, transcript, nthreads=args.nthreads, pool=pool, graph_cache=graph_cache, tracer=tracer, **kwargs)
+    result = aligner.transcribe(source, progress_cb=on_progress, logging=logging)
+pool.stop()
+if args.trace:
+    tracer.write(args.trace)
 
 fh = open(args.output, 'w', encoding="utf-8") if args.output else sys.stdout
 fh.write(result.to_json(indent=2))
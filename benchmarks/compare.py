@@ -0,0 +1,53 @@
+'''Compares two reports from benchmarks/pipeline.py.
+
+    python3 benchmarks/compare.py old.json new.json
+
+Prints, for each input in both, the old and new wall time, real-time
+factor and peak RSS, and the time of each stage, with the ratio new/old.
+'''
+import argparse
+import json
+
+def ratio(old, new):
+    if not old or new is None:
+        return ''
+    return '%.2fx' % (float(new) / old)
+
+def row(name, old, new, fmt):
+    show = lambda X: fmt % (X) if X is not None else '-'
+    return '  %-28s %14s %14s %8s' % (name, show(old), show(new), ratio(old, new))
+
+def compare(old, new):
+    lines = ['%s -> %s' % (old.get('revision'), new.get('revision'))]
+    if old.get('mode') != new.get('mode') or old.get('settings') != new.get('settings'):
+        lines.append('warning: the reports were made with different settings')
+    for name in old['results']:
+        if name not in new['results']:
+            continue
+        a = old['results'][name]
+        b = new['results'][name]
+        lines.append('')
+        lines.append('%s (%.0fs of audio, %d words)' % (name, b['audio_seconds'], b['words']))
+        lines.append(row('wall seconds', a['wall_seconds'], b['wall_seconds'], '%.3f'))
+        lines.append(row('realtime factor', a['realtime_factor'], b['realtime_factor'], '%.4f'))
+        lines.append(row('peak RSS (MB)', _mb(a['peak_rss_bytes']), _mb(b['peak_rss_bytes']), '%.1f'))
+        lines.append(row('aligned words', a['aligned'], b['aligned'], '%d'))
+        for stage in b['stages']:
+            if stage in a['stages']:
+                lines.append(row('%s seconds' % (stage), a['stages'][stage]['seconds'], b['stages'][stage]['seconds'], '%.3f'))
+    return '\n'.join(lines)
+
+def _mb(n_bytes):
+    return n_bytes / 1e6 if n_bytes is not None else None
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('old')
+    parser.add_argument('new')
+    args = parser.parse_args()
+
+    with open(args.old) as fh:
+        old = json.load(fh)
+    with open(args.new) as fh:
+        new = json.load(fh)
+    print(compare(old, new))
@@ -0,0 +1,109 @@
+'''Memory and start-up time of k3 decoders against the full-transcription
+graph, as they're added one at a time: as processes of their own, as
+sessions of one `k3 --sessions` process, and as processes forked from a
+`k3 --zygote`.
+
+Memory is the proportional set size of the k3 processes (so that pages
+forked processes share are only counted once), where Linux reports it,
+and otherwise their resident set size.
+
+    python3 benchmarks/k3_memory.py [-n 8] [--k3-startup 2] [-o results.json]
+    python3 benchmarks/k3_memory.py --real [-n 8]
+
+By default k3 is the scripted stand-in in benchmarks/fake, whose memory
+and start-up time say nothing about Kaldi's (it only exercises the
+protocols); with --real, the installed k3 and models are measured.
+Reports JSON.
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import pipeline
+
+# Audio pushed to each decoder, so that its buffers are allocated
+WARMUP_T = 1.0
+# For memory to settle after each decoder is added
+SETTLE_T = 0.2
+
+def process_memory(pid):
+    try:
+        with open('/proc/%d/smaps_rollup' % (pid)) as fh:
+            for line in fh:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    from gentle import metrics
+    return metrics.process_rss(pid) or 0
+
+def measure(resources, n, mode):
+    from gentle import audio, standard_kaldi
+
+    standard_kaldi.SESSIONS = mode == 'sessions'
+    standard_kaldi.ZYGOTE = mode == 'zygote'
+    silence = bytes(int(2 * WARMUP_T * audio.SAMPLE_RATE))
+    decoders = []
+    memory = []
+    start_seconds = []
+    try:
+        for i in range(n):
+            t0 = time.time()
+            k = standard_kaldi.new_decoder(resources.nnet_gpu_path, resources.full_hclg_path, resources.proto_langdir)
+            k.push_chunk(silence)
+            k.get_final()
+            start_seconds.append(time.time() - t0)
+            decoders.append(k)
+            time.sleep(SETTLE_T)
+            memory.append(sum([process_memory(X.pid) for X in standard_kaldi.live_processes()]))
+    finally:
+        for k in decoders:
+            k.stop()
+        standard_kaldi.SESSIONS = standard_kaldi.ZYGOTE = False
+    return {
+        'memory_bytes': memory,
+        'first_bytes': memory[0],
+        'per_added_bytes': (memory[-1] - memory[0]) / (n - 1) if n > 1 else None,
+        # Until the first result, for the first decoder and the rest
+        'first_start_seconds': start_seconds[0],
+        'added_start_seconds': sum(start_seconds[1:]) / (n - 1) if n > 1 else None,
+    }
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', help='write the results here as well as to stdout')
+    parser.add_argument('-n', '--decoders', default=8, type=int)
+    parser.add_argument('--real', action='store_true', help='run the installed k3, with the models')
+    parser.add_argument('--k3-startup', default=0.0, type=float, help='fake k3 model loading time')
+    args = parser.parse_args()
+
+    if not args.real:
+        tmpdir = tempfile.mkdtemp()
+        pipeline.make_resources(tmpdir, 1000)
+        os.environ['GENTLE_RESOURCES_ROOT'] = tmpdir
+        os.environ['GENTLE_FAKE_K3_STARTUP'] = str(args.k3_startup)
+
+    import gentle
+    from gentle import standard_kaldi
+    if not args.real:
+        standard_kaldi.EXECUTABLE_PATH = os.path.join(pipeline.FAKE_DIR, 'k3')
+    resources = gentle.Resources()
+
+    report = {
+        'revision': pipeline.git_revision(),
+        'mode': 'real' if args.real else 'fake',
+        'decoders': args.decoders,
+        'processes': measure(resources, args.decoders, 'processes'),
+        'sessions': measure(resources, args.decoders, 'sessions'),
+        'zygote': measure(resources, args.decoders, 'zygote'),
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    json.dump(report, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,66 @@
+'''Time and peak memory of building the bigram grammar for a long transcript.
+
+    python3 benchmarks/language_model.py [--words 50000] [--int-labels]
+
+The grammar is what `language_model` hands to m3; this measures only the
+Python side (m3 itself isn't run).  Reports JSON.
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from gentle import language_model
+
+def make_transcript(n_words, vocab_size, rng):
+    vocab = ['w%d' % (i) for i in range(vocab_size)]
+    weights = [1.0 / (rank + 1) for rank in range(vocab_size)]
+    return rng.choices(vocab, weights=weights, k=n_words)
+
+def run(kaldi_seq, word_ids, **kwargs):
+    if word_ids is not None:
+        kwargs['word_ids'] = word_ids
+    t0 = time.time()
+    txt_fst = language_model.make_bigram_lm_fst(kaldi_seq, **kwargs)
+    elapsed = time.time() - t0
+
+    # Separately, as tracing slows down every allocation
+    del txt_fst
+    tracemalloc.start()
+    txt_fst = language_model.make_bigram_lm_fst(kaldi_seq, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'seconds': elapsed,
+        'peak_bytes': peak,
+        'grammar_bytes': len(txt_fst),
+    }
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--words', default=50000, type=int)
+    parser.add_argument('--vocab', default=5000, type=int)
+    parser.add_argument('--int-labels', action='store_true')
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    kaldi_seq = make_transcript(args.words, args.vocab, random.Random(args.seed))
+    word_ids = None
+    if args.int_labels:
+        word_ids = {'w%d' % (i): i + 1 for i in range(args.vocab)}
+        for word in [language_model.OOV_TERM, 'uh', 'um']:
+            word_ids[word] = len(word_ids) + 1
+
+    results = {
+        'default': run(kaldi_seq, word_ids),
+        'disfluency': run(kaldi_seq, word_ids, disfluency=True, disfluencies={'uh', 'um'}),
+        'conservative': run(kaldi_seq, word_ids, conservative=True),
+    }
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,79 @@
+'''Time and memory taken to tokenize long synthetic transcripts.
+
+    python3 benchmarks/metasentence.py [--words 1000000] [--vocab 50000]
+
+Reports, as JSON, the time to construct a MetaSentence, to get its
+sequences (twice, as the aligners do), and to take the views of many
+short token ranges (as the second pass does for each gap), along with
+the peak memory allocated by each (from tracemalloc, in a second run).
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from gentle import metasentence
+
+def make_transcript(n_words, vocab_size, rng):
+    # Roughly Zipfian, like real text, with some punctuation and case
+    vocab = ['w%d' % (i) for i in range(vocab_size)]
+    weights = [1.0 / (rank + 1) for rank in range(vocab_size)]
+    words = rng.choices(vocab, weights=weights, k=n_words)
+    for idx in range(0, n_words, 12):
+        words[idx] = words[idx].capitalize() + ','
+    return ' '.join(words)
+
+def measure(fn):
+    # Timed apart from tracing, which slows allocation down
+    t0 = time.time()
+    ret = fn()
+    seconds = time.time() - t0
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return ret, {'seconds': seconds, 'peak_bytes': peak}
+
+def sequences(ms):
+    for i in range(2):
+        ks = ms.get_kaldi_sequence()
+        display = ms.get_display_sequence()
+        offsets = ms.get_text_offsets()
+    return len(ks) + len(display) + len(offsets)
+
+def gaps(ms, vocab, n_gaps, rng):
+    offsets = ms.get_text_offsets()
+    n = 0
+    for i in range(n_gaps):
+        start = rng.randrange(len(offsets) - 20)
+        end = start + rng.randrange(1, 20)
+        if hasattr(ms, 'span'):
+            view = ms.span(offsets[start][0], offsets[end - 1][1])
+        else:
+            view = metasentence.MetaSentence(ms.raw_sentence[offsets[start][0]:offsets[end - 1][1]].encode('utf-8'), vocab)
+        n += len(view.get_kaldi_sequence())
+    return n
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--words', default=1000000, type=int)
+    parser.add_argument('--vocab', default=50000, type=int)
+    parser.add_argument('--gaps', default=10000, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    transcript = make_transcript(args.words, args.vocab, rng)
+    # Most, but not all, of the words are in the vocabulary
+    vocab = set('w%d' % (i) for i in range(int(args.vocab * 0.9)))
+
+    ms, tokenize = measure(lambda: metasentence.MetaSentence(transcript, vocab))
+    _, seqs = measure(lambda: sequences(ms))
+    _, views = measure(lambda: gaps(ms, vocab, args.gaps, random.Random(args.seed)))
+    json.dump({'words': args.words, 'tokenize': tokenize, 'sequences': seqs, 'gaps': views}, sys.stdout, indent=2)
+    print()
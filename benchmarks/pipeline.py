@@ -0,0 +1,258 @@
+'''Wall time, real-time factor and peak memory of forced alignment, per
+stage of the pipeline, over a range of audio lengths and transcripts.
+
+    python3 benchmarks/pipeline.py [-o results.json] [--k3-rtf 0.05]
+    python3 benchmarks/pipeline.py --real [-o results.json]
+    python3 benchmarks/compare.py old.json new.json
+
+By default k3 and m3 are replaced by the scripted stand-ins in
+benchmarks/fake (with latencies set by --k3-* and --m3-*), decoding
+synthetic audio against a made-up vocabulary, so that the Python side
+can be measured deterministically without the models.  With --real, the
+installed binaries and models align examples/data/lucier.mp3, repeated
+to several lengths.
+
+Stage times are summed over spans (so stages that run on several threads,
+like `chunk`, can add up to more than the wall time); peak RSS is that of
+this process and its k3 processes together, sampled while each stage
+ran.  Reports JSON.
+'''
+import argparse
+import array
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+FAKE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake')
+EXAMPLES_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'examples', 'data')
+
+# Synthetic audio: each word is a run of samples equal to its id
+WORD_T = 0.3
+GAP_T = 0.1
+# Fractions of words that are silent in the audio, or replaced by another
+DROPPED = 0.03
+SUBSTITUTED = 0.02
+
+# (name, seconds of audio, transcript)
+FAKE_INPUTS = [
+    ('short', 30, 'random'),
+    ('medium', 300, 'random'),
+    ('long', 1800, 'random'),
+    ('repetitive', 600, 'repetitive'),
+]
+# (name, times lucier.mp3 is repeated)
+REAL_INPUTS = [
+    ('lucier', 1),
+    ('lucier_x4', 4),
+    ('lucier_x16', 16),
+]
+
+SAMPLE_INTERVAL = 0.05
+
+def make_resources(root, vocab_size):
+    '''A resource tree the fake binaries can run on, with words w0, w1...'''
+    words = ['<eps>', '<unk>'] + ['w%d' % (i) for i in range(vocab_size)]
+    graph_dir = os.path.join(root, 'exp', 'tdnn_7b_chain_online', 'graph_pp')
+    lang_dir = os.path.join(root, 'exp', 'langdir')
+    os.makedirs(graph_dir)
+    os.makedirs(lang_dir)
+    symbols = ''.join(['%s %d\n' % (word, idx) for idx, word in enumerate(words)])
+    for path in [os.path.join(graph_dir, 'words.txt'), os.path.join(lang_dir, 'words.txt')]:
+        with open(path, 'w') as fh:
+            fh.write(symbols)
+    with open(os.path.join(graph_dir, 'phones.txt'), 'w') as fh:
+        fh.write('<eps> 0\nsil 1\n')
+    with open(os.path.join(graph_dir, 'HCLG.fst'), 'w') as fh:
+        fh.write('*\n')
+    return words
+
+def make_fake_input(seconds, kind, vocab_size, rng):
+    '''Returns (transcript, pcm).'''
+    n_words = int(seconds / (WORD_T + GAP_T))
+    if kind == 'repetitive':
+        # A chorus, over and over
+        chorus = ['w%d' % (rng.randrange(vocab_size)) for i in range(12)]
+        tokens = [chorus[i % len(chorus)] for i in range(n_words)]
+    else:
+        weights = [1.0 / (rank + 1) for rank in range(vocab_size)]
+        tokens = rng.choices(['w%d' % (i) for i in range(vocab_size)], weights=weights, k=n_words)
+
+    from gentle import audio
+    word_n = int(WORD_T * audio.SAMPLE_RATE)
+    gap = array_of(0, int(GAP_T * audio.SAMPLE_RATE))
+    pcm = bytearray()
+    for token in tokens:
+        value = int(token[1:]) + 2
+        roll = rng.random()
+        if roll < DROPPED:
+            value = 0
+        elif roll < DROPPED + SUBSTITUTED:
+            value = rng.randrange(vocab_size) + 2
+        pcm += array_of(value, word_n)
+        pcm += gap
+    return ' '.join(tokens), bytes(pcm)
+
+def array_of(value, n):
+    return array.array('h', [value]).tobytes() * n
+
+def make_real_input(times):
+    from gentle import audio
+    with open(os.path.join(EXAMPLES_DIR, 'lucier.txt')) as fh:
+        transcript = fh.read()
+    source = audio.AudioSource.decode(os.path.join(EXAMPLES_DIR, 'lucier.mp3'))
+    return '\n'.join([transcript] * times), bytes(source.pcm) * times
+
+class RSSSampler():
+    '''Samples the RSS of this process and its k3 processes.'''
+
+    def __init__(self):
+        self.samples = []
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        from gentle import metrics, standard_kaldi
+        pid = os.getpid()
+        while not self._stopped.is_set():
+            rss = sum([metrics.process_rss(X) or 0 for X in [pid] + [K.pid for K in standard_kaldi.live_processes()]])
+            self.samples.append((time.time(), rss))
+            self._stopped.wait(SAMPLE_INTERVAL)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopped.set()
+        self._thread.join()
+
+    def peak(self, start=None, end=None):
+        values = [rss for t, rss in self.samples
+                  if (start is None or t >= start) and (end is None or t <= end)]
+        if len(values) == 0:
+            # Shorter than the sampling interval: the last sample before it
+            values = [rss for t, rss in self.samples if end is None or t <= end][-1:]
+        return max(values) if len(values) > 0 else None
+
+def run(resources, transcript, wav_path, duration, nthreads):
+    from gentle.forced_aligner import ForcedAligner
+    from gentle.tracing import Tracer
+
+    tracer = Tracer()
+    with RSSSampler() as sampler:
+        t0 = time.time()
+        aligner = ForcedAligner(resources, transcript, nthreads=nthreads, tracer=tracer)
+        result = aligner.transcribe(wav_path)
+        wall = time.time() - t0
+
+    stages = {}
+    for event in json.loads(tracer.to_json())['traceEvents']:
+        if event['ph'] != 'X':
+            continue
+        start = tracer.start + event['ts'] / 1e6
+        end = start + event['dur'] / 1e6
+        stage = stages.setdefault(event['name'], {'seconds': 0.0, 'count': 0, 'peak_rss_bytes': None})
+        stage['seconds'] += event['dur'] / 1e6
+        stage['count'] += 1
+        peak = sampler.peak(start, end)
+        if peak is not None:
+            stage['peak_rss_bytes'] = max(peak, stage['peak_rss_bytes'] or 0)
+
+    return {
+        'audio_seconds': duration,
+        'words': len(result.words),
+        'aligned': len([X for X in result.words if X.success()]),
+        'wall_seconds': wall,
+        'realtime_factor': wall / duration,
+        'peak_rss_bytes': sampler.peak(),
+        'stages': stages,
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', help='write the results here as well as to stdout')
+    parser.add_argument('--real', action='store_true', help='run the installed k3 and m3, on lucier.mp3')
+    parser.add_argument('--inputs', nargs='+', help='run only these inputs')
+    parser.add_argument('--nthreads', default=4, type=int)
+    parser.add_argument('--vocab', default=5000, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--k3-rtf', default=0.0, type=float, help='fake k3 decoding time per second of audio')
+    parser.add_argument('--k3-startup', default=0.0, type=float, help='fake k3 model loading time')
+    parser.add_argument('--k3-graph', default=0.0, type=float, help='fake k3 graph loading time')
+    parser.add_argument('--k3-sessions', action='store_true', help='run k3 decoders as sessions of one process')
+    parser.add_argument('--k3-zygote', action='store_true', help='fork k3 decoders from a zygote process')
+    parser.add_argument('--m3-seconds', default=0.0, type=float, help='fake m3 time per 1000 grammar arcs')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    if not args.real:
+        make_resources(tmpdir, args.vocab)
+        os.environ['GENTLE_RESOURCES_ROOT'] = tmpdir
+        os.environ['GENTLE_FAKE_K3_RTF'] = str(args.k3_rtf)
+        os.environ['GENTLE_FAKE_K3_STARTUP'] = str(args.k3_startup)
+        os.environ['GENTLE_FAKE_K3_GRAPH'] = str(args.k3_graph)
+        os.environ['GENTLE_FAKE_M3_SECONDS'] = str(args.m3_seconds)
+
+    import gentle
+    from gentle import audio, language_model, standard_kaldi
+    if not args.real:
+        standard_kaldi.EXECUTABLE_PATH = os.path.join(FAKE_DIR, 'k3')
+        language_model.MKGRAPH_PATH = os.path.join(FAKE_DIR, 'm3')
+    standard_kaldi.SESSIONS = args.k3_sessions
+    standard_kaldi.ZYGOTE = args.k3_zygote
+    resources = gentle.Resources()
+
+    if args.real:
+        inputs = [(name, lambda times=times: make_real_input(times)) for name, times in REAL_INPUTS]
+    else:
+        rng = random.Random(args.seed)
+        inputs = [(name, lambda seconds=seconds, kind=kind: make_fake_input(seconds, kind, args.vocab, rng))
+                  for name, seconds, kind in FAKE_INPUTS]
+
+    results = {}
+    for name, make_input in inputs:
+        # Inputs are made in order either way, so they don't depend on --inputs
+        transcript, pcm = make_input()
+        if args.inputs is not None and name not in args.inputs:
+            continue
+        wav_path = os.path.join(tmpdir, '%s.wav' % (name))
+        with open(wav_path, 'wb') as fh:
+            fh.write(audio.wav_header(len(pcm), audio.SAMPLE_RATE))
+            fh.write(pcm)
+        duration = len(pcm) / 2.0 / audio.SAMPLE_RATE
+        print('%s: %.0fs of audio, %d words' % (name, duration, len(transcript.split())), file=sys.stderr)
+        results[name] = run(resources, transcript, wav_path, duration, args.nthreads)
+        os.unlink(wav_path)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'mode': 'real' if args.real else 'fake',
+        'settings': {k: v for k, v in vars(args).items() if k not in ('output', 'inputs')},
+        # Of this process and its children, over the whole run
+        'max_rss_bytes': 1024 * max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                    resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss),
+        'results': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    json.dump(report, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,88 @@
+'''Cold-start time and memory of a fresh Python process using gentle.
+
+    python3 benchmarks/startup.py [--vocab 200000] [--runs 5] [-o results.json]
+    python3 benchmarks/startup.py --real
+
+Each measurement is taken in a process of its own: importing gentle;
+loading Resources and looking up a word; normalizing a transcript; and
+running `align.py --help`.  Memory is the resident set size of the
+process once the transcript is normalized.  By default the resources
+are made up (with a vocabulary of --vocab words); with --real, the
+installed ones are used.  Reports the median of --runs runs, as JSON.
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import pipeline
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+PROBE = r'''
+import json, os, sys, time
+sys.path.insert(0, %(root)r)
+t0 = time.time()
+import gentle
+t1 = time.time()
+resources = gentle.Resources()
+'w1' in resources.vocab
+t2 = time.time()
+from gentle import metasentence
+ms = metasentence.MetaSentence(%(transcript)r, resources.vocab)
+t3 = time.time()
+from gentle import metrics
+json.dump({'import_seconds': t1 - t0, 'resources_seconds': t2 - t1,
+           'normalize_seconds': t3 - t2, 'rss_bytes': metrics.process_rss(os.getpid())}, sys.stdout)
+'''
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def probe(transcript):
+    out = subprocess.check_output([sys.executable, '-c', PROBE % {'root': ROOT, 'transcript': transcript}])
+    return json.loads(out.decode())
+
+def cli_seconds():
+    import time
+    t0 = time.time()
+    subprocess.check_call([sys.executable, os.path.join(ROOT, 'align.py'), '--help'], stdout=subprocess.DEVNULL)
+    return time.time() - t0
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', help='write the results here as well as to stdout')
+    parser.add_argument('--real', action='store_true', help='use the installed resources')
+    parser.add_argument('--vocab', default=200000, type=int)
+    parser.add_argument('--words', default=10000, type=int, help='transcript length')
+    parser.add_argument('--runs', default=5, type=int)
+    args = parser.parse_args()
+
+    if args.real:
+        transcript = open(os.path.join(ROOT, 'examples', 'data', 'lucier.txt')).read()
+    else:
+        tmpdir = tempfile.mkdtemp()
+        pipeline.make_resources(tmpdir, args.vocab)
+        os.environ['GENTLE_RESOURCES_ROOT'] = tmpdir
+        transcript = ' '.join(['w%d' % (i * 7919 % (2 * args.vocab)) for i in range(args.words)])
+
+    # (The first run also builds anything that's cached on disk)
+    runs = [probe(transcript) for i in range(args.runs + 1)]
+    report = {
+        'revision': pipeline.git_revision(),
+        'mode': 'real' if args.real else 'fake',
+        'first_run': runs[0],
+        'cli_seconds': median([cli_seconds() for i in range(args.runs)]),
+    }
+    for key in runs[0]:
+        report[key] = median([X[key] for X in runs[1:]])
+    if args.output is not None:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    json.dump(report, sys.stdout, indent=2)
+    print()
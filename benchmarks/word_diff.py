@@ -0,0 +1,78 @@
+'''Compare the word_diff backends on long synthetic transcripts.
+
+    python3 benchmarks/word_diff.py [--words 100000] [--backends difflib,banded]
+
+For each input, a reference transcript is generated and a "hypothesis"
+is derived from it by deleting, inserting and substituting words (as
+recognition errors would).  Reports the time taken by each backend and
+the number of words it matched, as JSON.
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from gentle import diff_align
+
+def make_reference(n_words, vocab_size, rng):
+    # Roughly Zipfian, like real text
+    vocab = ['w%d' % (i) for i in range(vocab_size)]
+    weights = [1.0 / (rank + 1) for rank in range(vocab_size)]
+    return rng.choices(vocab, weights=weights, k=n_words)
+
+def make_repetitive(n_words, rng):
+    phrase = 'and i really really really really want to go'.split()
+    return [phrase[i % len(phrase)] for i in range(n_words)]
+
+def corrupt(reference, error_rate, rng):
+    hypothesis = []
+    for word in reference:
+        r = rng.random()
+        if r < error_rate / 3:
+            continue # deletion
+        elif r < 2 * error_rate / 3:
+            hypothesis.append('x%d' % rng.randrange(1000)) # substitution
+        else:
+            hypothesis.append(word)
+            if r < error_rate:
+                hypothesis.append('x%d' % rng.randrange(1000)) # insertion
+    return hypothesis
+
+def run(backend, hypothesis, reference):
+    t0 = time.time()
+    ops = list(diff_align.word_diff(hypothesis, reference, backend=backend))
+    elapsed = time.time() - t0
+    return {
+        'seconds': elapsed,
+        'matched': len([X for X in ops if X[0] == 'equal']),
+        'ops': len(ops),
+    }
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--words', default=100000, type=int)
+    parser.add_argument('--error-rate', default=0.1, type=float)
+    parser.add_argument('--backends', default=','.join(sorted(diff_align.BACKENDS)))
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    inputs = {
+        'text': make_reference(args.words, 5000, rng),
+        'repetitive': make_repetitive(args.words, rng),
+    }
+
+    results = {}
+    for name, reference in inputs.items():
+        hypothesis = corrupt(reference, args.error_rate, rng)
+        results[name] = {}
+        for backend in args.backends.split(','):
+            results[name][backend] = run(backend, hypothesis, reference)
+            print(name, backend, results[name][backend], file=sys.stderr)
+
+    json.dump(results, sys.stdout, indent=2)
+    print()
@@ -11,6 +11,23 @@
 #include "lat/word-align-lattice.h"
 #include "nnet3/decodable-simple-looped.h"
 
+#include <algorithm>
+#include <cerrno>
+#include <condition_variable>
+#include <cstdarg>
+#include <deque>
+#include <map>
+#include <memory>
+#include <mutex>
+#include <sstream>
+#include <thread>
+
+#include <poll.h>
+#include <signal.h>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <unistd.h>
+
 #ifdef HAVE_CUDA
 #include "cudamatrix/cu-device.h"
 #endif
@@ -70,8 +87,587 @@ void ConfigDecoding(kaldi::LatticeFasterDecoderConfig& config) {
 void ConfigEndpoint(kaldi::OnlineEndpointConfig& config) {
   config.silence_phones = "1:2:3:4:5:6:7:8:9:10:11:12:13:14:15:16:17:18:19:20";
 }
+
+// Everything that decoding sessions share. It's loaded once and only
+// read afterwards, so any number of sessions (on any number of threads)
+// can decode against one copy.
+struct Model {
+  kaldi::TransitionModel trans_model;
+  kaldi::nnet3::AmNnetSimple am_nnet;
+  kaldi::OnlineNnet2FeaturePipelineInfo feature_info;
+  kaldi::LatticeFasterDecoderConfig decoding_config;
+  kaldi::nnet3::NnetSimpleLoopedComputationOptions looped_opts;
+  kaldi::nnet3::DecodableNnetSimpleLoopedInfo *looped_info;
+  kaldi::WordBoundaryInfo *word_boundary_info;
+  fst::SymbolTable *word_syms;
+  fst::SymbolTable *phone_syms;
+  kaldi::BaseFloat frame_shift;
+
+  Model(const std::string &nnet_dir, const std::string &graph_dir) {
+    using namespace kaldi;
+
+    WordBoundaryInfoNewOpts opts; // use default opts
+    word_boundary_info = new WordBoundaryInfo(opts, graph_dir + "/phones/word_boundary.int");
+
+    ConfigFeatureInfo(feature_info, nnet_dir + "/ivector_extractor");
+    ConfigDecoding(decoding_config);
+    frame_shift = feature_info.FrameShiftInSeconds();
+
+    {
+      bool binary;
+      Input ki(nnet_dir + "/final.mdl", &binary);
+      trans_model.Read(ki.Stream(), binary);
+      am_nnet.Read(ki.Stream(), binary);
+    }
+
+    looped_opts.acoustic_scale = 1.0; // changed from 0.1?
+    looped_info = new nnet3::DecodableNnetSimpleLoopedInfo(looped_opts, &am_nnet);
+
+    word_syms = fst::SymbolTable::ReadText(graph_dir + "/words.txt");
+    phone_syms = fst::SymbolTable::ReadText(graph_dir + "/phones.txt");
+  }
+
+  ~Model() {
+    delete looped_info;
+    delete word_boundary_info;
+    delete word_syms;
+    delete phone_syms;
+  }
+};
+
+typedef fst::Fst<fst::StdArc> Graph;
+typedef std::shared_ptr<const Graph> GraphPtr;
+
+// Graphs loaded by path, shared by every session that has them loaded
+// (such as the full-transcription HCLG), and freed with the last one.
+class GraphStore {
+ public:
+  GraphPtr Load(const std::string &path) {
+    std::lock_guard<std::mutex> lock(mutex_);
+    GraphPtr graph = graphs_[path].lock();
+    if(!graph) {
+      graph.reset(fst::ReadFstKaldi(path));
+      graphs_[path] = graph;
+    }
+    return graph;
+  }
+
+ private:
+  std::mutex mutex_;
+  std::map<std::string, std::weak_ptr<const Graph> > graphs_;
+};
+
+void Appendf(std::string *out, const char *format, ...) {
+  char buf[4096];
+  va_list args;
+  va_start(args, format);
+  int n = vsnprintf(buf, sizeof(buf), format, args);
+  va_end(args);
+  out->append(buf, std::min<size_t>(n, sizeof(buf) - 1));
+}
+
+// Appends the result of `get-final-bin' as a single framed reply,
+//
+//   MSG_SIZE\n200\nBODY\n
+//
+// (see gentle/rpc.py) where BODY holds native-endian columns:
+//
+//   int32 n_words, int32 n_phones,
+//   int32 word_id[n_words], float start[n_words], float duration[n_words],
+//   int32 n_word_phones[n_words],
+//   int32 phone_id[n_phones], float phone_duration[n_phones]
+//
+// Ids refer to the graph's words.txt and phones.txt, which the client
+// loads once rather than having every reply spelled out.
+void AppendBinaryFinal(const std::vector<int32> &words,
+                       const std::vector<int32> &times,
+                       const std::vector<int32> &lengths,
+                       const std::vector<std::vector<int32> > &prons,
+                       const std::vector<std::vector<int32> > &phone_lengths,
+                       float frame_shift,
+                       std::string *reply) {
+  std::vector<int32> word_ids, word_phones, phone_ids;
+  std::vector<float> starts, durations, phone_durations;
+
+  for (size_t i = 0; i < words.size(); i++) {
+    if(words[i] == 0) {
+      // <eps> links - silence
+      continue;
+    }
+    word_ids.push_back(words[i]);
+    starts.push_back(times[i] * frame_shift);
+    durations.push_back(lengths[i] * frame_shift);
+    word_phones.push_back(phone_lengths[i].size());
+    for(size_t j=0; j<phone_lengths[i].size(); j++) {
+      phone_ids.push_back(prons[i][j]);
+      phone_durations.push_back(phone_lengths[i][j] * frame_shift);
+    }
+  }
+
+  std::string body;
+  int32 counts[2] = {(int32)word_ids.size(), (int32)phone_ids.size()};
+  body.append((const char*)counts, sizeof(counts));
+  body.append((const char*)word_ids.data(), word_ids.size() * sizeof(int32));
+  body.append((const char*)starts.data(), starts.size() * sizeof(float));
+  body.append((const char*)durations.data(), durations.size() * sizeof(float));
+  body.append((const char*)word_phones.data(), word_phones.size() * sizeof(int32));
+  body.append((const char*)phone_ids.data(), phone_ids.size() * sizeof(int32));
+  body.append((const char*)phone_durations.data(), phone_durations.size() * sizeof(float));
+
+  Appendf(reply, "%zu\n200\n", body.size() + 4);
+  reply->append(body);
+  reply->append("\n");
+}
+
+// Writes the result of `get-final-bin' to stdout (see AppendBinaryFinal).
+void WriteBinaryFinal(const std::vector<int32> &words,
+                      const std::vector<int32> &times,
+                      const std::vector<int32> &lengths,
+                      const std::vector<std::vector<int32> > &prons,
+                      const std::vector<std::vector<int32> > &phone_lengths,
+                      float frame_shift) {
+  std::string reply;
+  AppendBinaryFinal(words, times, lengths, prons, phone_lengths, frame_shift, &reply);
+  fwrite(reply.data(), 1, reply.size(), stdout);
+}
+
+// The decoding state of one stream of audio: a feature pipeline and a
+// decoder against the session's current graph.
+class Session {
+ public:
+  Session(const Model &model, GraphStore *graphs, GraphPtr graph)
+      : model_(model), graphs_(graphs), graph_(graph),
+        adaptation_state_(model.feature_info.ivector_extractor_info),
+        silence_weighting_(model.trans_model,
+                           model.feature_info.silence_weighting_config),
+        feature_pipeline_(NULL), decoder_(NULL) {
+    Reset();
+  }
+
+  ~Session() {
+    delete decoder_;
+    delete feature_pipeline_;
+  }
+
+  // Runs one command line (without its newline), with the data that
+  // followed it on stdin, and appends its reply (if it has one).
+  void Handle(const std::string &cmd, const std::string &data, std::string *reply);
+
+ private:
+  // (Re)creates the per-utterance decoding state against `graph_'.
+  // The acoustic model and feature configuration are left untouched,
+  // so switching graphs does not require reloading them.
+  void Reset() {
+    delete decoder_;
+    delete feature_pipeline_;
+    decoder_ = NULL;
+    feature_pipeline_ = NULL;
+    if(!graph_) {
+      return;
+    }
+    feature_pipeline_ = new kaldi::OnlineNnet2FeaturePipeline(model_.feature_info);
+    feature_pipeline_->SetAdaptationState(adaptation_state_);
+    decoder_ = new kaldi::SingleUtteranceNnet3Decoder(model_.decoding_config,
+                                                      model_.trans_model,
+                                                      *model_.looped_info,
+                                                      *graph_,
+                                                      feature_pipeline_);
+  }
+
+  // Replaces `graph_', replying "ok" or "error" (leaving the old graph
+  // in place).
+  void SwapGraph(GraphPtr graph, std::string *reply) {
+    if(!graph) {
+      reply->append("error\n");
+      return;
+    }
+    // The decoder refers to the old graph, so tear it down first
+    delete decoder_;
+    decoder_ = NULL;
+    graph_ = graph;
+    Reset();
+    reply->append("ok\n");
+  }
+
+  const Model &model_;
+  GraphStore *graphs_;
+  GraphPtr graph_;
+  kaldi::OnlineIvectorExtractorAdaptationState adaptation_state_;
+  kaldi::OnlineSilenceWeighting silence_weighting_;
+  kaldi::OnlineNnet2FeaturePipeline *feature_pipeline_;
+  kaldi::SingleUtteranceNnet3Decoder *decoder_;
+};
+
+void Session::Handle(const std::string &cmd, const std::string &data, std::string *reply) {
+  using namespace kaldi;
+
+  if(cmd == "reset") {
+    Reset();
+  }
+  else if(cmd.compare(0, 11, "load-graph ") == 0) {
+    // Swap in a new HCLG without reloading the acoustic model
+    const std::string path = cmd.substr(11);
+    GraphPtr graph;
+    try {
+      graph = graphs_->Load(path);
+    } catch(const std::exception &e) {
+      fprintf(stderr, "unable to load graph %s: %s\n", path.c_str(), e.what());
+    }
+    SwapGraph(graph, reply);
+  }
+  else if(cmd.compare(0, 16, "load-graph-data ") == 0) {
+    // As `load-graph', but the binary FST followed on stdin, so that
+    // the client never has to write it to disk
+    std::istringstream graph_stream(data);
+    GraphPtr graph(fst::Fst<fst::StdArc>::Read(
+        graph_stream, fst::FstReadOptions("<stdin>")));
+    if(!graph) {
+      fprintf(stderr, "unable to load graph from stdin\n");
+    }
+    SwapGraph(graph, reply);
+  }
+  else if(cmd == "push-chunk") {
+    if(decoder_ == NULL) {
+      // Nothing to decode against until a graph is loaded
+      reply->append("error\n");
+      return;
+    }
+
+    // We need to copy this into the `wave_part' Vector<BaseFloat> thing.
+    // From `gst-audio-source.cc' in gst-kaldi-nnet2
+    const int16_t *audio_chunk = (const int16_t*)data.data();
+    const int chunk_len = data.size() / 2;
+    Vector<BaseFloat> wave_part(chunk_len);
+    for (int i = 0; i < chunk_len ; ++i) {
+      wave_part(i) = static_cast<BaseFloat>(audio_chunk[i]);
+    }
+
+    feature_pipeline_->AcceptWaveform(arate, wave_part);
+
+    std::vector<std::pair<int32, BaseFloat> > delta_weights;
+    if (silence_weighting_.Active()) {
+      silence_weighting_.ComputeCurrentTraceback(decoder_->Decoder());
+      silence_weighting_.GetDeltaWeights(feature_pipeline_->NumFramesReady(),
+                                         &delta_weights);
+      feature_pipeline_->IvectorFeature()->UpdateFrameWeights(delta_weights);
+    }
+
+    decoder_->AdvanceDecoding();
+
+    reply->append("ok\n");
+  }
+  else if(cmd == "get-final" || cmd == "get-final-bin") {
+    std::vector<int32> words, times, lengths;
+    std::vector<std::vector<int32> > prons;
+    std::vector<std::vector<int32> > phone_lengths;
+
+    if(decoder_ != NULL) {
+      feature_pipeline_->InputFinished(); // Computes last few frames of input
+      decoder_->AdvanceDecoding();        // Decodes remaining frames
+      decoder_->FinalizeDecoding();
+
+      Lattice final_lat;
+      decoder_->GetBestPath(true, &final_lat);
+      CompactLattice clat;
+      ConvertLattice(final_lat, &clat);
+
+      // Compute prons alignment (see: kaldi/latbin/nbest-to-prons.cc)
+      CompactLattice aligned_clat;
+
+      WordAlignLattice(clat, model_.trans_model, *model_.word_boundary_info,
+                       0, &aligned_clat);
+
+      CompactLatticeToWordProns(model_.trans_model, aligned_clat, &words, &times,
+                                &lengths, &prons, &phone_lengths);
+    }
+
+    if(cmd == "get-final-bin") {
+      AppendBinaryFinal(words, times, lengths, prons, phone_lengths,
+                        model_.frame_shift, reply);
+      return;
+    }
+
+    for (int i = 0; i < words.size(); i++) {
+      if(words[i] == 0) {
+        // <eps> links - silence
+        continue;
+      }
+      Appendf(reply, "word: %s / start: %f / duration: %f\n",
+              model_.word_syms->Find(words[i]).c_str(),
+              times[i] * model_.frame_shift,
+              lengths[i] * model_.frame_shift);
+      // Print out the phonemes for this word
+      for(size_t j=0; j<phone_lengths[i].size(); j++) {
+        Appendf(reply, "phone: %s / duration: %f\n",
+                model_.phone_syms->Find(prons[i][j]).c_str(),
+                phone_lengths[i][j] * model_.frame_shift);
+      }
+    }
+
+    reply->append("done with words\n");
+  }
+  else {
+    fprintf(stderr, "unknown command %s\n", cmd.c_str());
+  }
+}
+
+// Reads a command line from stdin (without its newline) and the data
+// that follows some commands: the samples of a `push-chunk', and the
+// FST of a `load-graph-data'.  Returns false once stdin is closed.
+bool ReadCommand(std::string *cmd, std::string *data) {
+  char line[1024];
+  if(fgets(line, sizeof(line), stdin) == NULL) {
+    // Our client went away
+    return false;
+  }
+  *cmd = line;
+  if(!cmd->empty() && (*cmd)[cmd->size() - 1] == '\n') {
+    cmd->erase(cmd->size() - 1);
+  }
+
+  // (In --sessions mode, the command follows a session id)
+  const size_t space = cmd->find(' ');
+  const std::string name = (space != std::string::npos && isdigit((*cmd)[0]))
+      ? cmd->substr(space + 1) : *cmd;
+
+  size_t data_len = 0;
+  if(name == "push-chunk") {
+    // Get chunk length from python
+    int chunk_len = 0;
+    if(fgets(line, sizeof(line), stdin) == NULL) {
+      return false;
+    }
+    sscanf(line, "%d\n", &chunk_len);
+    data_len = 2 * chunk_len;
+  }
+  else if(name.compare(0, 16, "load-graph-data ") == 0) {
+    sscanf(name.c_str() + 16, "%zu", &data_len);
+  }
+
+  data->resize(data_len);
+  if(data_len > 0 && fread(&(*data)[0], 1, data_len, stdin) != data_len) {
+    return false;
+  }
+  return true;
+}
+
+// Replies of every session in --sessions mode go out on stdout, each as
+//
+//   SESSION_ID REPLY_SIZE\nREPLY
+//
+// written whole, so that they can be told apart.
+class Output {
+ public:
+  void Write(int session_id, const std::string &reply) {
+    std::lock_guard<std::mutex> lock(mutex_);
+    fprintf(stdout, "%d %zu\n", session_id, reply.size());
+    fwrite(reply.data(), 1, reply.size(), stdout);
+    fflush(stdout);
+  }
+
+ private:
+  std::mutex mutex_;
+};
+
+// A session in --sessions mode, which runs its commands in order on a
+// thread of its own, so that sessions decode in parallel.
+class SessionThread {
+ public:
+  SessionThread(int id, const Model &model, GraphStore *graphs, GraphPtr graph, Output *out)
+      : id_(id), session_(model, graphs, graph), out_(out),
+        thread_(&SessionThread::Run, this) {}
+
+  ~SessionThread() {
+    Push("close", "");
+    thread_.join();
+  }
+
+  void Push(const std::string &cmd, const std::string &data) {
+    std::lock_guard<std::mutex> lock(mutex_);
+    queue_.push_back(std::make_pair(cmd, data));
+    cond_.notify_one();
+  }
+
+ private:
+  void Run() {
+    while(true) {
+      std::pair<std::string, std::string> next;
+      {
+        std::unique_lock<std::mutex> lock(mutex_);
+        while(queue_.empty()) {
+          cond_.wait(lock);
+        }
+        next = std::move(queue_.front());
+        queue_.pop_front();
+      }
+      if(next.first == "close") {
+        return;
+      }
+      std::string reply;
+      session_.Handle(next.first, next.second, &reply);
+      if(!reply.empty()) {
+        out_->Write(id_, reply);
+      }
+    }
+  }
+
+  int id_;
+  Session session_;
+  Output *out_;
+  std::mutex mutex_;
+  std::condition_variable cond_;
+  std::deque<std::pair<std::string, std::string> > queue_;
+  std::thread thread_;
+};
+
+// Decodes the one stream of commands on stdin, replying on stdout, in a
+// child forked by RunZygote.
+int RunSession(const Model &model, GraphStore *graphs, GraphPtr graph) {
+  Session session(model, graphs, graph);
+  graph.reset();
+
+  std::string cmd, data;
+  while(ReadCommand(&cmd, &data)) {
+    // Let the client decide what we should do...
+    if(cmd == "stop") {
+      break;
+    }
+    std::string reply;
+    session.Handle(cmd, data, &reply);
+    fwrite(reply.data(), 1, reply.size(), stdout);
+  }
+  return 0;
+}
+
+// Listens on a Unix socket at `path', and forks a decoder for each
+// connection, with the connection as its stdin and stdout.  The model
+// and graph loaded here are shared with every child copy-on-write, so
+// a child is ready as soon as it's forked; it says so with
+//
+//   ready PID\n
+//
+// The zygote itself stops when its stdin is closed.
+int RunZygote(const std::string &path, const Model &model, GraphStore *graphs, GraphPtr graph) {
+  int listener = socket(AF_UNIX, SOCK_STREAM, 0);
+  struct sockaddr_un addr;
+  memset(&addr, 0, sizeof(addr));
+  addr.sun_family = AF_UNIX;
+  if(listener < 0 || path.size() >= sizeof(addr.sun_path)) {
+    fprintf(stderr, "unable to listen at %s\n", path.c_str());
+    return EXIT_FAILURE;
+  }
+  strncpy(addr.sun_path, path.c_str(), sizeof(addr.sun_path) - 1);
+  unlink(path.c_str());
+  if(bind(listener, (struct sockaddr*)&addr, sizeof(addr)) != 0 ||
+     listen(listener, 64) != 0) {
+    fprintf(stderr, "unable to listen at %s: %s\n", path.c_str(), strerror(errno));
+    return EXIT_FAILURE;
+  }
+
+  // Children are reaped by the system
+  signal(SIGCHLD, SIG_IGN);
+  fprintf(stdout, "ready\n");
+
+  while(true) {
+    struct pollfd fds[2] = {{listener, POLLIN, 0}, {STDIN_FILENO, POLLIN, 0}};
+    if(poll(fds, 2, -1) < 0) {
+      if(errno == EINTR) {
+        continue;
+      }
+      break;
+    }
+    if(fds[1].revents != 0) {
+      // Our client went away
+      break;
+    }
+    if((fds[0].revents & POLLIN) == 0) {
+      continue;
+    }
+
+    int conn = accept(listener, NULL, NULL);
+    if(conn < 0) {
+      continue;
+    }
+    pid_t pid = fork();
+    if(pid == 0) {
+      close(listener);
+      signal(SIGCHLD, SIG_DFL);
+      dup2(conn, STDIN_FILENO);
+      dup2(conn, STDOUT_FILENO);
+      close(conn);
+      fprintf(stdout, "ready %d\n", (int)getpid());
+      exit(RunSession(model, graphs, graph));
+    }
+    if(pid < 0) {
+      fprintf(stderr, "unable to fork: %s\n", strerror(errno));
+    }
+    close(conn);
+  }
+
+  close(listener);
+  unlink(path.c_str());
+  return 0;
+}
+
+// Runs --sessions or --zygote mode, where the model is loaded once, as
+// a Model, and shared by every session.
+int RunShared(const std::string &nnet_dir, const std::string &graph_dir,
+              const std::string &fst_rxfilename,
+              const std::string &zygote_path) {
+  Model model(nnet_dir, graph_dir);
+  GraphStore graphs;
+
+  // Every session starts out with the graph given on the command line
+  GraphPtr initial_graph;
+  if(!fst_rxfilename.empty()) {
+    initial_graph = graphs.Load(fst_rxfilename);
+  }
+
+  if(!zygote_path.empty()) {
+    return RunZygote(zygote_path, model, &graphs, initial_graph);
+  }
+
+  std::string cmd, data;
+  Output out;
+  std::map<int, SessionThread*> threads;
+
+  while(ReadCommand(&cmd, &data)) {
+    if(cmd == "stop") {
+      break;
+    }
+
+    int session_id = -1;
+    int name_offset = 0;
+    if(sscanf(cmd.c_str(), "%d %n", &session_id, &name_offset) != 1 || name_offset == 0) {
+      fprintf(stderr, "no session for command %s\n", cmd.c_str());
+      continue;
+    }
+    const std::string name = cmd.substr(name_offset);
+
+    std::map<int, SessionThread*>::iterator it = threads.find(session_id);
+    if(name == "close") {
+      if(it != threads.end()) {
+        // (Finishes the session's queued commands first)
+        delete it->second;
+        threads.erase(it);
+      }
+      continue;
+    }
+    if(it == threads.end()) {
+      it = threads.insert(std::make_pair(session_id, new SessionThread(
+          session_id, model, &graphs, initial_graph, &out))).first;
+    }
+    it->second->Push(name, data);
+  }
+
+  for(std::map<int, SessionThread*>::iterator it = threads.begin(); it != threads.end(); ++it) {
+    delete it->second;
+  }
+  return 0;
+}
+
 void usage() {
-  fprintf(stderr, "usage: k3 [nnet_dir hclg_path]\n");
+  fprintf(stderr, "usage: k3 [--sessions | --zygote socket_path] [nnet_dir [hclg_path]]\n");
 }
 
 int main(int argc, char *argv[]) {
@@ -80,14 +676,34 @@ int main(int argc, char *argv[]) {
 
     setbuf(stdout, NULL);
 
+    // With --sessions, one process decodes any number of streams, each
+    // in a session of its own: commands are prefixed with the session
+    // id (sessions start on first use and end with `close'), and so are
+    // replies (see Output).  The model and graphs are loaded only once.
+    bool sessions = false;
+    if(argc > 1 && strcmp(argv[1], "--sessions") == 0) {
+      sessions = true;
+      argc--;
+      argv++;
+    }
+    // With --zygote, decoders are forked from this process instead (see
+    // RunZygote)
+    std::string zygote_path;
+    if(argc > 2 && strcmp(argv[1], "--zygote") == 0) {
+      zygote_path = argv[2];
+      argc -= 2;
+      argv += 2;
+    }
+
     std::string nnet_dir = "exp/tdnn_7b_chain_online";
     std::string graph_dir = nnet_dir + "/graph_pp";
     std::string fst_rxfilename = graph_dir + "/HCLG.fst";
 
-    if(argc == 3) {
+    if(argc == 2 || argc == 3) {
       nnet_dir = argv[1];
       graph_dir = nnet_dir + "/graph_pp";
-      fst_rxfilename = argv[2];
+      // Without an explicit graph, wait for a `load-graph' command
+      fst_rxfilename = (argc == 3) ? argv[2] : "";
     }
     else if(argc != 1) {
       usage();
@@ -95,12 +711,21 @@ int main(int argc, char *argv[]) {
     }
 
 #ifdef HAVE_CUDA
-    fprintf(stdout, "Cuda enabled\n");
+    if(!zygote_path.empty()) {
+      // (A CUDA context doesn't survive fork)
+      fprintf(stderr, "--zygote can't be used with CUDA\n");
+      return EXIT_FAILURE;
+    }
+    fprintf(stderr, "Cuda enabled\n");
     CuDevice &cu_device = CuDevice::Instantiate();
     cu_device.SetVerbose(true);
     cu_device.SelectGpuId("yes");
-    fprintf(stdout, "active gpu: %d\n", cu_device.ActiveGpuId());
+    fprintf(stderr, "active gpu: %d\n", cu_device.ActiveGpuId());
 #endif
+
+    if(sessions || !zygote_path.empty()) {
+      return RunShared(nnet_dir, graph_dir, fst_rxfilename, zygote_path);
+    }
     const std::string ivector_model_dir = nnet_dir + "/ivector_extractor";
     const std::string nnet3_rxfilename = nnet_dir + "/final.mdl";
 
@@ -135,7 +760,10 @@ int main(int argc, char *argv[]) {
 
     nnet3::DecodableNnetSimpleLoopedInfo de_nnet_simple_looped_info(nnet_simple_looped_opts, &am_nnet);
 
-    fst::Fst<fst::StdArc> *decode_fst = ReadFstKaldi(fst_rxfilename);
+    fst::Fst<fst::StdArc> *decode_fst = NULL;
+    if(!fst_rxfilename.empty()) {
+      decode_fst = ReadFstKaldi(fst_rxfilename);
+    }
 
     fst::SymbolTable *word_syms =
       fst::SymbolTable::ReadText(word_syms_rxfilename);
@@ -146,41 +774,103 @@ int main(int argc, char *argv[]) {
 
     OnlineIvectorExtractorAdaptationState adaptation_state(feature_info.ivector_extractor_info);
 
-    OnlineNnet2FeaturePipeline feature_pipeline(feature_info);
-    feature_pipeline.SetAdaptationState(adaptation_state);
+    OnlineNnet2FeaturePipeline *feature_pipeline = NULL;
+    SingleUtteranceNnet3Decoder *decoder = NULL;
 
     OnlineSilenceWeighting silence_weighting(
                                              trans_model,
                                              feature_info.silence_weighting_config);
 
-    SingleUtteranceNnet3Decoder decoder(nnet3_decoding_config,
-                                        trans_model,
-					de_nnet_simple_looped_info,
-                                        //am_nnet, // kaldi::nnet3::DecodableNnetSimpleLoopedInfo
-                                        *decode_fst,
-                                        &feature_pipeline);
+    // (Re)creates the per-utterance decoding state against `decode_fst'.
+    // The acoustic model and feature configuration above are left untouched,
+    // so switching graphs does not require reloading them.
+    auto reset = [&]() {
+      delete decoder;
+      delete feature_pipeline;
+      decoder = NULL;
+      feature_pipeline = NULL;
+      if(decode_fst == NULL) {
+        return;
+      }
+      feature_pipeline = new OnlineNnet2FeaturePipeline(feature_info);
+      feature_pipeline->SetAdaptationState(adaptation_state);
+      decoder = new SingleUtteranceNnet3Decoder(nnet3_decoding_config,
+                                                trans_model,
+                                                de_nnet_simple_looped_info,
+                                                //am_nnet, // kaldi::nnet3::DecodableNnetSimpleLoopedInfo
+                                                *decode_fst,
+                                                feature_pipeline);
+    };
+    reset();
+
+    // Replaces `decode_fst', replying "ok" or "error" (leaving the old
+    // graph in place) to the client.
+    auto swap_graph = [&](fst::Fst<fst::StdArc> *new_fst) {
+      if(new_fst == NULL) {
+        fprintf(stdout, "error\n");
+        return;
+      }
+
+      // The decoder refers to the old graph, so tear it down first
+      delete decoder;
+      decoder = NULL;
+      delete decode_fst;
+      decode_fst = new_fst;
+      reset();
+
+      fprintf(stdout, "ok\n");
+    };
 
 
   char cmd[1024];
 
   while(true) {
     // Let the client decide what we should do...
-    fgets(cmd, sizeof(cmd), stdin);
+    if(fgets(cmd, sizeof(cmd), stdin) == NULL) {
+      // Our client went away
+      break;
+    }
 
     if(strcmp(cmd,"stop\n") == 0) {
       break;
     }
     else if(strcmp(cmd,"reset\n") == 0) {
-      feature_pipeline.~OnlineNnet2FeaturePipeline();
-      new (&feature_pipeline) OnlineNnet2FeaturePipeline(feature_info);
+      reset();
+    }
+    else if(strncmp(cmd, "load-graph ", 11) == 0) {
+      // Swap in a new HCLG without reloading the acoustic model
+      std::string path(cmd + 11);
+      if(!path.empty() && path[path.size() - 1] == '\n') {
+        path.erase(path.size() - 1);
+      }
 
-      decoder.~SingleUtteranceNnet3Decoder();
-      new (&decoder) SingleUtteranceNnet3Decoder(nnet3_decoding_config,
-                                                 trans_model,
-						 de_nnet_simple_looped_info,
-                                                 //am_nnet,
-                                                 *decode_fst,
-                                                 &feature_pipeline);
+      fst::Fst<fst::StdArc> *new_fst = NULL;
+      try {
+        new_fst = ReadFstKaldi(path);
+      } catch(const std::exception &e) {
+        fprintf(stderr, "unable to load graph %s: %s\n", path.c_str(), e.what());
+      }
+      swap_graph(new_fst);
+    }
+    else if(strncmp(cmd, "load-graph-data ", 16) == 0) {
+      // As `load-graph', but the binary FST follows on stdin, so that
+      // the client never has to write it to disk
+      size_t graph_len = 0;
+      sscanf(cmd + 16, "%zu", &graph_len);
+
+      std::string graph_data(graph_len, '\0');
+      if(fread(&graph_data[0], 1, graph_len, stdin) != graph_len) {
+        fprintf(stdout, "error\n");
+        break;
+      }
+
+      std::istringstream graph_stream(graph_data);
+      fst::Fst<fst::StdArc> *new_fst = fst::Fst<fst::StdArc>::Read(
+          graph_stream, fst::FstReadOptions("<stdin>"));
+      if(new_fst == NULL) {
+        fprintf(stderr, "unable to load graph from stdin\n");
+      }
+      swap_graph(new_fst);
     }
     else if(strcmp(cmd,"push-chunk\n") == 0) {
 
@@ -194,48 +884,65 @@ int main(int argc, char *argv[]) {
 
       fread(&audio_chunk, 2, chunk_len, stdin);
 
+      if(decoder == NULL) {
+        // Nothing to decode against until a graph is loaded
+        fprintf(stdout, "error\n");
+        continue;
+      }
+
       // We need to copy this into the `wave_part' Vector<BaseFloat> thing.
       // From `gst-audio-source.cc' in gst-kaldi-nnet2
       for (int i = 0; i < chunk_len ; ++i) {
         (wave_part)(i) = static_cast<BaseFloat>(audio_chunk[i]);
       }
 
-      feature_pipeline.AcceptWaveform(arate, wave_part);
+      feature_pipeline->AcceptWaveform(arate, wave_part);
 
       std::vector<std::pair<int32, BaseFloat> > delta_weights;
       if (silence_weighting.Active()) {
-        silence_weighting.ComputeCurrentTraceback(decoder.Decoder());
-        silence_weighting.GetDeltaWeights(feature_pipeline.NumFramesReady(),
+        silence_weighting.ComputeCurrentTraceback(decoder->Decoder());
+        silence_weighting.GetDeltaWeights(feature_pipeline->NumFramesReady(),
                                           &delta_weights);
-        feature_pipeline.IvectorFeature()->UpdateFrameWeights(delta_weights);
+        feature_pipeline->IvectorFeature()->UpdateFrameWeights(delta_weights);
       }
 
-      decoder.AdvanceDecoding();
+      decoder->AdvanceDecoding();
 
       fprintf(stdout, "ok\n");
     }
-    else if(strcmp(cmd, "get-final\n") == 0) {
-      feature_pipeline.InputFinished(); // Computes last few frames of input
-      decoder.AdvanceDecoding();        // Decodes remaining frames
-      decoder.FinalizeDecoding();
-
-      Lattice final_lat;
-      decoder.GetBestPath(true, &final_lat);
-      CompactLattice clat;
-      ConvertLattice(final_lat, &clat);
-
-      // Compute prons alignment (see: kaldi/latbin/nbest-to-prons.cc)
-      CompactLattice aligned_clat;
+    else if(strcmp(cmd, "get-final\n") == 0 ||
+            strcmp(cmd, "get-final-bin\n") == 0) {
+      const bool binary = strcmp(cmd, "get-final-bin\n") == 0;
 
       std::vector<int32> words, times, lengths;
       std::vector<std::vector<int32> > prons;
       std::vector<std::vector<int32> > phone_lengths;
 
-      WordAlignLattice(clat, trans_model, word_boundary_info,
-                       0, &aligned_clat);
+      if(decoder != NULL) {
+        feature_pipeline->InputFinished(); // Computes last few frames of input
+        decoder->AdvanceDecoding();        // Decodes remaining frames
+        decoder->FinalizeDecoding();
 
-      CompactLatticeToWordProns(trans_model, aligned_clat, &words, &times,
-                                &lengths, &prons, &phone_lengths);
+        Lattice final_lat;
+        decoder->GetBestPath(true, &final_lat);
+        CompactLattice clat;
+        ConvertLattice(final_lat, &clat);
+
+        // Compute prons alignment (see: kaldi/latbin/nbest-to-prons.cc)
+        CompactLattice aligned_clat;
+
+        WordAlignLattice(clat, trans_model, word_boundary_info,
+                         0, &aligned_clat);
+
+        CompactLatticeToWordProns(trans_model, aligned_clat, &words, &times,
+                                  &lengths, &prons, &phone_lengths);
+      }
+
+      if(binary) {
+        WriteBinaryFinal(words, times, lengths, prons, phone_lengths,
+                         frame_shift);
+        continue;
+      }
 
       for (int i = 0; i < words.size(); i++) {
         if(words[i] == 0) {
@@ -263,4 +970,8 @@ int main(int argc, char *argv[]) {
 
     }
   }
+
+  delete decoder;
+  delete feature_pipeline;
+  delete decode_fst;
 }
@@ -15,9 +15,13 @@ int main(int argc, char *argv[]) {
 	using namespace fst;
 	using fst::script::ArcSort;
 	try {
-		const char *usage = "Usage: ./mkgraph [options] <proto-dir> <grammar-fst> <out-fst>\n";
+		const char *usage = "Usage: ./mkgraph [options] <proto-dir> <grammar-fst> <out-fst>\n"
+			"<grammar-fst> and <out-fst> may be - for stdin/stdout\n";
 
 		ParseOptions po(usage);
+		bool int_labels = false;
+		po.Register("int-labels", &int_labels,
+			"Grammar arcs are labelled with word ids rather than words");
 		po.Read(argc, argv);
 		if (po.NumArgs() != 3) {
 			po.PrintUsage();
@@ -47,7 +51,8 @@ int main(int argc, char *argv[]) {
 			std::cerr << "expected " << lang_disambig_fst_filename << " to exist" << std::endl;
 			return 1;
 		}
-		if (!std::ifstream(grammar_fst_filename.c_str())) {
+		if (grammar_fst_filename != "-" &&
+			!std::ifstream(grammar_fst_filename.c_str())) {
 			std::cerr << "expected " << grammar_fst_filename << " to exist" << std::endl;
 			return 1;
 		}
@@ -65,19 +70,29 @@ int main(int argc, char *argv[]) {
 		}
 
 		// fstcompile
-		const SymbolTable *ssyms = 0;
-		fst::SymbolTableTextOptions opts;
-		const SymbolTable *isyms = SymbolTable::ReadText(words_filename, opts);
-		if (!isyms) { return 1; }
-		const SymbolTable *osyms = SymbolTable::ReadText(words_filename, opts);
-		if (!osyms) { return 1; }
-		std::ifstream grammar_fst_file(grammar_fst_filename.c_str());
-		FstCompiler<StdArc> fstcompiler(grammar_fst_file, "", isyms,
-			osyms, ssyms,
+		// (with --int-labels there is no need to parse words.txt)
+		const SymbolTable *ssyms = 0, *isyms = 0, *osyms = 0;
+		if (!int_labels) {
+			fst::SymbolTableTextOptions opts;
+			isyms = SymbolTable::ReadText(words_filename, opts);
+			if (!isyms) { return 1; }
+			osyms = SymbolTable::ReadText(words_filename, opts);
+			if (!osyms) { return 1; }
+		}
+		std::ifstream grammar_fst_file;
+		if (grammar_fst_filename != "-") {
+			grammar_fst_file.open(grammar_fst_filename.c_str());
+		}
+		std::istream &grammar_fst_stream = grammar_fst_filename == "-" ?
+			std::cin : grammar_fst_file;
+		FstCompiler<StdArc> fstcompiler(grammar_fst_stream, grammar_fst_filename,
+			isyms, osyms, ssyms,
 			false, false,
 			false, false,
 			false);
 		VectorFst<StdArc> grammar_fst = fstcompiler.Fst();
+		delete isyms;
+		delete osyms;
 
 		// fsttablecompose
 		VectorFst<StdArc> *lang_disambig_fst = ReadFstKaldi(lang_disambig_fst_filename);
@@ -182,7 +197,12 @@ int main(int argc, char *argv[]) {
 			std::cerr << "[info]: final HCLG is not stochastic." << std::endl;
 		}
 
-	    if (!hclg_fst.Write(out_filename)) {
+	    if (out_filename == "-") {
+			if (!hclg_fst.Write(std::cout, FstWriteOptions("<stdout>"))) {
+				KALDI_ERR << "error writing FST to stdout";
+			}
+			std::cout.flush();
+	    } else if (!hclg_fst.Write(out_filename)) {
 			KALDI_ERR << "error writing FST to " << out_filename;
 	    }
 	} catch(const std::exception &e) {
@@ -1,6 +1,29 @@
 from .__version__ import __version__
-from .resources import Resources
-from .forced_aligner import ForcedAligner
-from .full_transcriber import FullTranscriber
-from .resample import resample, resampled
-from .transcription import Transcription
+
+# Submodules are imported when first used, so that `import gentle` (and
+# tools that only need part of it) start quickly
+_LAZY = {
+    'Resources': '.resources',
+    'ForcedAligner': '.forced_aligner',
+    'FullTranscriber': '.full_transcriber',
+    'StreamingAligner': '.streaming_aligner',
+    'SegmentedAligner': '.segmented_aligner',
+    'IncrementalAligner': '.incremental_aligner',
+    'resample': '.resample',
+    'resampled': '.resample',
+    'AudioSource': '.audio',
+    'Transcription': '.transcription',
+}
+
+__all__ = ['__version__'] + list(_LAZY)
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    import importlib
+    value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
@@ -0,0 +1,151 @@
+import mmap
+import os
+import struct
+import subprocess
+
+from contextlib import contextmanager
+
+from . import metrics
+from .resample import pcm_command
+
+SAMPLE_RATE = 8000
+
+# WAVE_FORMAT_PCM and WAVE_FORMAT_EXTENSIBLE
+PCM_FORMATS = (0x0001, 0xFFFE)
+
+class AudioSource():
+    '''8K 16-bit mono PCM, shared read-only by every worker decoding it.
+
+    The samples are held once (memory-mapped from a wav file, or decoded
+    straight into a buffer) and `frames`/`slice` hand out memoryviews
+    into them, so reading a chunk neither opens a file nor copies.
+    '''
+
+    def __init__(self, pcm, rate=SAMPLE_RATE, mapping=None):
+        self.rate = rate
+        self._mmap = mapping
+        self.pcm = memoryview(pcm)
+        # Ignore a trailing partial sample
+        if len(self.pcm) % 2 != 0:
+            self.pcm = self.pcm[:-1]
+
+    @classmethod
+    def from_wav(cls, path):
+        '''Memory-maps a 16-bit mono wav file (as written by `resample`).'''
+        with open(path, 'rb') as fh:
+            mapping = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            rate, offset, size = parse_wav_header(mapping)
+        except Exception:
+            mapping.close()
+            raise
+        return cls(memoryview(mapping)[offset:offset + size], rate=rate, mapping=mapping)
+
+    @classmethod
+    @metrics.stage('resample')
+    def decode(cls, infile, offset=None, duration=None):
+        '''Decodes any media file with FFMPEG (or SoX), reading the PCM
+        from its stdout straight into memory, with no intermediate file.'''
+        if not os.path.isfile(infile):
+            raise IOError("Not a file: %s" % infile)
+        proc = subprocess.Popen(pcm_command(infile, offset, duration),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        buf = bytearray(1 << 20)
+        n_bytes = 0
+        while True:
+            if n_bytes == len(buf):
+                buf.extend(bytes(len(buf)))
+            with memoryview(buf) as view:
+                n_read = proc.stdout.readinto(view[n_bytes:])
+            if not n_read:
+                break
+            n_bytes += n_read
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise RuntimeError("Unable to resample/encode '%s'" % infile)
+        del buf[n_bytes:]
+        return cls(buf)
+
+    @property
+    def nframes(self):
+        return len(self.pcm) // 2
+
+    @property
+    def duration(self):
+        return self.nframes / float(self.rate)
+
+    def frames(self, start, count):
+        '''PCM for `count` frames from frame `start`, as a memoryview.'''
+        start = max(0, min(start, self.nframes))
+        end = max(start, min(start + count, self.nframes))
+        return self.pcm[2*start:2*end]
+
+    def slice(self, start_t, duration):
+        '''PCM for `duration` seconds from `start_t`, as a memoryview.'''
+        return self.frames(int(start_t * self.rate), int(duration * self.rate))
+
+    def write_wav(self, path):
+        '''Writes the PCM to a wav file.'''
+        with open(path, 'wb') as fh:
+            fh.write(wav_header(len(self.pcm), self.rate))
+            fh.write(self.pcm)
+
+    def close(self):
+        self.pcm.release()
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass # slices are still held; unmapped once they're freed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+@contextmanager
+def opened(audio):
+    '''Yields `audio` as an AudioSource; if it's a path to a wav file,
+    it's mapped for the duration.'''
+    if isinstance(audio, AudioSource):
+        yield audio
+        return
+    source = AudioSource.from_wav(audio)
+    try:
+        yield source
+    finally:
+        source.close()
+
+def parse_wav_header(buf):
+    '''Finds the PCM in a RIFF/WAVE file. Returns the sample rate and the
+    offset and size of the data chunk.'''
+    if buf[0:4] != b'RIFF' or buf[8:12] != b'WAVE':
+        raise ValueError('not a wav file')
+
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(buf):
+        chunk_id = buf[pos:pos+4]
+        chunk_size, = struct.unpack('<I', buf[pos+4:pos+8])
+        body = pos + 8
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', buf[body:body+16])
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError('wav data before format')
+            tag, channels, rate, _, _, bits = fmt
+            if tag not in PCM_FORMATS or channels != 1 or bits != 16:
+                raise ValueError('expected 16-bit mono PCM')
+            # Streamed wavs may not know their size
+            return rate, body, min(chunk_size, len(buf) - body)
+        pos = body + chunk_size + (chunk_size & 1)
+
+    raise ValueError('no data in wav file')
+
+def wav_header(n_bytes, rate=SAMPLE_RATE):
+    '''A 44-byte header for `n_bytes` of 16-bit mono PCM.'''
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+                       b'RIFF', 36 + n_bytes, b'WAVE',
+                       b'fmt ', 16, 1, 1, rate, rate * 2, 2, 16,
+                       b'data', n_bytes)
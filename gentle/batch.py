@@ -0,0 +1,165 @@
+'''Aligns a manifest of (audio, transcript, output) items in one process,
+sharing the model, the warm k3 workers and the graph cache between them.
+
+While one item decodes, the next few are decoded to PCM and have their
+graphs built on other threads.  Each finished item adds a line to a JSON
+lines results file; a batch that's run again skips the items already in
+it, and an item that was cut short carries on from its checkpoint.'''
+import collections
+import concurrent.futures
+import csv
+import hashlib
+import json
+import logging
+import os
+import time
+
+from gentle import kaldi_queue
+from gentle.audio import AudioSource
+from gentle.checkpoint import Checkpoint
+from gentle.forced_aligner import ForcedAligner
+from gentle.segmented_aligner import SegmentedAligner
+
+FIELDS = ('audio', 'transcript', 'output')
+
+def read_manifest(path):
+    '''Reads the items of a CSV (with a header row) or JSON lines
+    manifest, each with the paths of its `audio`, `transcript` (a text
+    file) and `output`.  Relative paths are taken from the manifest's
+    directory.'''
+    with open(path, encoding='utf-8', newline='') as fh:
+        if path.endswith('.jsonl') or path.endswith('.json'):
+            rows = [json.loads(X) for X in fh if X.strip()]
+        else:
+            rows = list(csv.DictReader(fh))
+
+    base = os.path.dirname(os.path.abspath(path))
+    items = []
+    outputs = set()
+    for idx, row in enumerate(rows):
+        missing = [X for X in FIELDS if not row.get(X)]
+        if missing:
+            raise ValueError('%s: item %d has no %s' % (path, idx + 1, ', '.join(missing)))
+        item = {X: os.path.join(base, row[X]) for X in FIELDS}
+        # Results are kept by output
+        if item['output'] in outputs:
+            raise ValueError('%s: item %d has the same output as an earlier one' % (path, idx + 1))
+        outputs.add(item['output'])
+        items.append(item)
+    return items
+
+def read_results(path):
+    '''The results recorded so far, by output path.'''
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    if not data.endswith(b'\n'):
+        # Drop a partly written last line, so appends start afresh
+        data = data[:data.rfind(b'\n') + 1]
+        with open(path, 'r+b') as fh:
+            fh.truncate(len(data))
+    for line in data.splitlines():
+        result = json.loads(line.decode())
+        results[result['output']] = result
+    return results
+
+class BatchAligner():
+    '''Aligns the items of a manifest (see `read_manifest`), appending a
+    result for each to `results_path`.
+
+    Up to `prefetch` items are made ready (decoded, with graphs built)
+    ahead of the one decoding.  The other keyword arguments are passed
+    to the aligner.'''
+
+    def __init__(self, resources, results_path, nthreads=4, prefetch=2, graph_cache=None, long_form=False, **kwargs):
+        self.resources = resources
+        self.results_path = results_path
+        self.nthreads = nthreads
+        self.prefetch = prefetch
+        self.graph_cache = graph_cache
+        self.long_form = long_form
+        self.kwargs = kwargs
+        self.checkpoint_dir = results_path + '.checkpoints'
+
+    def _prepare(self, item):
+        with open(item['transcript'], encoding='utf-8') as fh:
+            transcript = fh.read()
+        source = AudioSource.decode(item['audio'])
+        Aligner = SegmentedAligner if self.long_form else ForcedAligner
+        return source, Aligner(self.resources, transcript, nthreads=self.nthreads, pool=self.pool, graph_cache=self.graph_cache, **self.kwargs)
+
+    def _align(self, item, prepared):
+        source, aligner = prepared.result()
+        kwargs = {}
+        if not self.long_form:
+            # (Keyed by output, which is unique in a batch)
+            kwargs['checkpoint'] = Checkpoint(os.path.join(
+                self.checkpoint_dir, hashlib.sha1(item['output'].encode()).hexdigest()))
+        with source:
+            result = aligner.transcribe(source, logging=logging, **kwargs)
+            duration = source.duration
+
+        if os.path.dirname(item['output']):
+            os.makedirs(os.path.dirname(item['output']), exist_ok=True)
+        tmp_path = item['output'] + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            result.write_json(fh, indent=2)
+        os.replace(tmp_path, item['output'])
+        if 'checkpoint' in kwargs:
+            kwargs['checkpoint'].clear()
+
+        return {'duration': duration,
+                'words': len(result.words),
+                'aligned': len([X for X in result.words if X.success()])}
+
+    def _record(self, result):
+        with open(self.results_path, 'a', encoding='utf-8') as fh:
+            fh.write(json.dumps(result) + '\n')
+            fh.flush()
+            os.fsync(fh.fileno())
+
+    def run(self, items, retry_failed=False):
+        '''Aligns the items that don't have results yet (or, with
+        `retry_failed`, whose last attempt failed).  Returns a summary.'''
+        done = read_results(self.results_path)
+        todo = [X for X in items if X['output'] not in done
+                or (retry_failed and done[X['output']]['status'] != 'OK')]
+        logging.info('%d of %d items to align' % (len(todo), len(items)))
+
+        self.pool = kaldi_queue.KaldiPool(self.resources, nworkers=self.nthreads)
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.prefetch))
+        ahead = collections.deque()
+        try:
+            for idx, item in enumerate(todo):
+                while len(ahead) <= self.prefetch and idx + len(ahead) < len(todo):
+                    upcoming = todo[idx + len(ahead)]
+                    ahead.append(executor.submit(self._prepare, upcoming))
+
+                logging.info('[%d/%d] %s' % (idx + 1, len(todo), item['audio']))
+                t0 = time.time()
+                result = dict(item)
+                try:
+                    result.update(self._align(item, ahead.popleft()))
+                    result['status'] = 'OK'
+                except Exception as e:
+                    logging.error('%s: %s' % (item['audio'], e))
+                    result['status'] = 'ERROR'
+                    result['error'] = str(e) or type(e).__name__
+                result['seconds'] = round(time.time() - t0, 3)
+                self._record(result)
+                done[item['output']] = result
+        finally:
+            for future in ahead:
+                future.cancel()
+            executor.shutdown(wait=True)
+            self.pool.stop()
+
+        results = [done[X['output']] for X in items if X['output'] in done]
+        failures = [X for X in results if X['status'] != 'OK']
+        return {'items': len(items),
+                'aligned': len(results) - len(failures),
+                'failed': len(failures),
+                'pending': len(items) - len(results),
+                'failures': [{'audio': X['audio'], 'output': X['output'], 'error': X.get('error')} for X in failures]}
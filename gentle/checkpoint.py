@@ -0,0 +1,66 @@
+import json
+import os
+import shutil
+import threading
+
+class Checkpoint():
+    '''Keeps the raw k3 output of each part of a job that's been decoded
+    (first-pass chunks and second-pass gaps) in a directory, so that a job
+    that's interrupted can pick up where it left off.
+
+    Each kind of result is appended to its own JSON-lines file, so a
+    write cut short by a crash loses at most that one result.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def _file(self, kind):
+        return os.path.join(self.path, '%s.jsonl' % (kind))
+
+    def _load(self, kind):
+        if kind in self._entries:
+            return self._entries[kind]
+        entries = {}
+        path = self._file(kind)
+        if os.path.exists(path):
+            with open(path, 'rb') as fh:
+                data = fh.read()
+            if not data.endswith(b'\n'):
+                # Drop a partly written last line, so appends start afresh
+                data = data[:data.rfind(b'\n') + 1]
+                with open(path, 'r+b') as fh:
+                    fh.truncate(len(data))
+            for line in data.splitlines():
+                entry = json.loads(line.decode())
+                entries[entry['key']] = entry['value']
+        self._entries[kind] = entries
+        return entries
+
+    def get(self, kind, key):
+        '''The saved result, or None.'''
+        with self._lock:
+            return self._load(kind).get(key)
+
+    def put(self, kind, key, value):
+        with self._lock:
+            self._load(kind)[key] = value
+            with open(self._file(kind), 'a') as fh:
+                fh.write(json.dumps({'key': key, 'value': value}) + '\n')
+                fh.flush()
+                os.fsync(fh.fileno())
+
+    def count(self, kind):
+        with self._lock:
+            return len(self._load(kind))
+
+    def clear(self):
+        '''Removes the saved results, and their directory (once the job
+        is done).'''
+        with self._lock:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self._entries = {}
@@ -0,0 +1,414 @@
+import collections
+import hashlib
+import hmac
+import ipaddress
+import itertools
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+
+from concurrent.futures import Future
+
+from gentle import audio
+from gentle.transcription import Transcription
+
+# Each frame is a JSON message and a (possibly empty) binary payload,
+# prefixed by their lengths
+FRAME_HEADER = struct.Struct('!II')
+# Largest frames accepted (a message holds a transcript; a payload, a
+# wav or an alignment), and before a worker has authenticated
+MAX_MESSAGE = 64 * 1024 * 1024
+MAX_PAYLOAD = 1024 * 1024 * 1024
+MAX_HELLO = 64 * 1024
+
+# Workers a job may be sent to before it's given up on (as it's likely
+# what brought the others down)
+MAX_ATTEMPTS = 3
+
+# The only progress a worker may report on a job's status
+PROGRESS_KEYS = ('message', 'percent', 'status')
+
+# Seconds a worker waits before reconnecting to the dispatcher
+RECONNECT_DELAY = 1.0
+
+def parse_address(address):
+    '''"host:port" for TCP, otherwise the path of a Unix socket (which
+    may be given as "unix:path"). Returns (family, address).'''
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[5:]
+    if '/' not in address and ':' in address:
+        host, port = address.rsplit(':', 1)
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+def is_local(address):
+    '''Whether only this machine can connect to `address` (a Unix
+    socket, or a loopback interface).'''
+    family, addr = parse_address(address)
+    if family == socket.AF_UNIX:
+        return True
+    if addr[0] == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(addr[0]).is_loopback
+    except ValueError:
+        return False
+
+def read_secret(path):
+    '''The shared secret workers authenticate with, from a file.'''
+    with open(path, 'rb') as fh:
+        secret = fh.read().strip()
+    if len(secret) == 0:
+        raise ValueError('%s is empty' % (path))
+    return secret
+
+def _auth(secret, nonce):
+    return hmac.new(secret, nonce.encode(), hashlib.sha256).hexdigest()
+
+def send_frame(sock, msg, payload=b''):
+    data = json.dumps(msg).encode()
+    sock.sendall(FRAME_HEADER.pack(len(data), len(payload)) + data)
+    if len(payload) > 0:
+        sock.sendall(payload)
+
+def _recv_exact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    n_read = 0
+    while n_read < size:
+        n = sock.recv_into(view[n_read:])
+        if n == 0:
+            raise ConnectionError("connection closed")
+        n_read += n
+    return buf
+
+def recv_frame(sock, max_message=MAX_MESSAGE, max_payload=MAX_PAYLOAD):
+    '''Returns the next (message, payload) from `sock`.  Raises
+    ValueError for frames over the limits.'''
+    msg_len, payload_len = FRAME_HEADER.unpack(_recv_exact(sock, FRAME_HEADER.size))
+    if msg_len > max_message or payload_len > max_payload:
+        raise ValueError("frame too large (%d + %d bytes)" % (msg_len, payload_len))
+    msg = json.loads(_recv_exact(sock, msg_len).decode())
+    payload = _recv_exact(sock, payload_len) if payload_len > 0 else b''
+    return msg, payload
+
+class RemoteJob():
+    def __init__(self, job_id, job_class, transcript, wav, kwargs, progress_cb):
+        self.id = job_id
+        self.job_class = job_class
+        self.transcript = transcript
+        self.wav = wav
+        self.kwargs = kwargs
+        self.progress_cb = progress_cb
+        self.future = Future()
+        # Workers it's been sent to
+        self.attempts = 0
+
+class Dispatcher():
+    '''The front end's side of the worker protocol.
+
+    Workers connect to `address`, which sends a "challenge" with a
+    random nonce, and introduce themselves with a "hello" (naming the
+    job classes they take, and with the HMAC of the nonce under the
+    shared `secret`, if there is one); each connection then
+    asks for one job at a time with "ready".  A job is sent as a "job"
+    message with the audio (as a wav) for its payload, and the worker
+    replies with any number of "progress" messages, then a "result"
+    (with the alignment JSON as payload) or an "error".  Jobs that were
+    running on a worker that goes away are queued again, up to
+    MAX_ATTEMPTS times in all.
+
+    Without a `secret`, `address` must be one that only this machine can
+    reach (see `is_local`), as workers are given users' audio and their
+    results are trusted.
+    '''
+
+    def __init__(self, address, secret=None):
+        if secret is None and not is_local(address):
+            raise ValueError("workers at %s would need a secret to authenticate with" % (address))
+        self.secret = secret
+        family, addr = parse_address(address)
+        self._sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(addr)
+        self._sock.listen(16)
+        self.address = self._sock.getsockname()
+
+        self._cond = threading.Condition()
+        self._jobs = collections.deque()
+        self._ids = itertools.count()
+        self._workers = {}
+        self._stopped = False
+
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def submit(self, job_class, transcript, wav, progress_cb=None, **kwargs):
+        '''Queues a job for the next free worker that takes `job_class`.
+        `wav` is the audio, as the bytes of a wav file.  Returns a
+        RemoteJob, whose `future` has the Transcription.'''
+        job = RemoteJob(next(self._ids), job_class, transcript, wav, kwargs, progress_cb)
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Dispatcher has been stopped")
+            self._jobs.append(job)
+            self._cond.notify_all()
+        return job
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': len(self._workers),
+                'queued': len(self._jobs),
+            }
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            jobs, self._jobs = self._jobs, collections.deque()
+            self._cond.notify_all()
+        for job in jobs:
+            job.future.cancel()
+        self._sock.close()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return # stopped
+            threading.Thread(target=self._serve_worker, args=(conn,), daemon=True).start()
+
+    def _take(self, classes):
+        with self._cond:
+            while not self._stopped:
+                for job in self._jobs:
+                    if job.job_class in classes:
+                        self._jobs.remove(job)
+                        if job.future.set_running_or_notify_cancel():
+                            return job
+                        break
+                else:
+                    self._cond.wait()
+        return None
+
+    def _serve_worker(self, conn):
+        job = None
+        try:
+            nonce = os.urandom(16).hex()
+            send_frame(conn, {'type': 'challenge', 'nonce': nonce})
+            hello, _ = recv_frame(conn, max_message=MAX_HELLO, max_payload=0)
+            if self.secret is not None and not hmac.compare_digest(
+                    str(hello.get('auth')), _auth(self.secret, nonce)):
+                raise ValueError("worker failed to authenticate")
+            name = hello.get('name', 'worker')
+            classes = hello.get('classes', ['align'])
+            with self._cond:
+                self._workers[conn] = name
+            logging.info("worker %s connected" % (name))
+
+            while True:
+                msg, _ = recv_frame(conn)
+                if msg['type'] != 'ready':
+                    raise ValueError("unexpected %s from worker" % (msg['type']))
+
+                job = self._take(classes)
+                if job is None:
+                    return
+                job.attempts += 1
+                send_frame(conn, {'type': 'job',
+                                  'id': job.id,
+                                  'class': job.job_class,
+                                  'transcript': job.transcript,
+                                  'kwargs': job.kwargs}, job.wav)
+
+                while job is not None:
+                    msg, payload = recv_frame(conn)
+                    if msg['type'] == 'progress':
+                        progress = msg['progress']
+                        if job.progress_cb is not None and isinstance(progress, dict):
+                            job.progress_cb({k: v for k, v in progress.items() if k in PROGRESS_KEYS})
+                    elif msg['type'] == 'result':
+                        try:
+                            job.future.set_result(Transcription.from_json(payload.decode()))
+                        except (ValueError, KeyError) as e:
+                            job.future.set_exception(e)
+                        job = None
+                    elif msg['type'] == 'error':
+                        job.future.set_exception(RuntimeError(msg['error']))
+                        job = None
+        except (OSError, ValueError, KeyError) as e:
+            logging.info("worker connection closed: %s" % (e))
+        finally:
+            with self._cond:
+                self._workers.pop(conn, None)
+                if job is not None and not self._stopped:
+                    # Give it to someone else
+                    logging.warning("worker lost job %d (attempt %d)" % (job.id, job.attempts))
+                    self._requeue(job)
+                elif job is not None:
+                    job.future.set_exception(RuntimeError("Dispatcher has been stopped"))
+            conn.close()
+
+    def _requeue(self, job):
+        if job.attempts >= MAX_ATTEMPTS:
+            job.future.set_exception(RuntimeError(
+                "job %d was lost by %d workers" % (job.id, job.attempts)))
+            return
+        # The job's Future is already running and can't go back to
+        # pending, so the queued copy gets a new one that's passed on
+        retry = RemoteJob(job.id, job.job_class, job.transcript, job.wav, job.kwargs, job.progress_cb)
+        retry.attempts = job.attempts
+        outer = job.future
+        def done(inner):
+            if inner.cancelled():
+                outer.set_exception(RuntimeError("job %d was cancelled" % (job.id)))
+            elif inner.exception() is not None:
+                outer.set_exception(inner.exception())
+            else:
+                outer.set_result(inner.result())
+        retry.future.add_done_callback(done)
+        self._jobs.appendleft(retry)
+        self._cond.notify_all()
+
+class RemoteAligner():
+    '''Stands in for a ForcedAligner (or FullTranscriber, for the
+    "transcribe" class) but runs the job on a worker.'''
+
+    def __init__(self, dispatcher, job_class, transcript, **kwargs):
+        self.dispatcher = dispatcher
+        self.job_class = job_class
+        self.transcript = transcript
+        # Sets don't survive JSON
+        self.kwargs = {k: sorted(v) if isinstance(v, set) else v for k, v in kwargs.items()}
+
+    def transcribe(self, wavfile, progress_cb=None, logging=None, partial_cb=None, checkpoint=None):
+        # Workers only send back the finished alignment, so `partial_cb`
+        # is never called, and nothing is checkpointed
+        with audio.opened(wavfile) as source:
+            wav = audio.wav_header(len(source.pcm), source.rate) + source.pcm
+        job = self.dispatcher.submit(self.job_class, self.transcript, wav, progress_cb=progress_cb, **self.kwargs)
+        return job.future.result()
+
+class AlignmentHandler():
+    '''Runs jobs for a Worker: forced alignment on a warm KaldiPool, and
+    full transcription if `ntranscriptionthreads` is set.'''
+
+    def __init__(self, resources, nthreads=4, ntranscriptionthreads=0, graph_cache=None):
+        from gentle import kaldi_queue
+        from gentle.full_transcriber import FullTranscriber
+
+        self.resources = resources
+        self.nthreads = nthreads
+        self.graph_cache = graph_cache
+        self.pool = kaldi_queue.KaldiPool(resources, nworkers=nthreads)
+        self.full_transcriber = FullTranscriber(resources, nthreads=ntranscriptionthreads)
+
+    @property
+    def classes(self):
+        return ['align', 'transcribe'] if self.full_transcriber.available else ['align']
+
+    def __call__(self, job_class, transcript, source, progress_cb, **kwargs):
+        from gentle.forced_aligner import ForcedAligner
+
+        if job_class == 'transcribe':
+            trans = self.full_transcriber
+        else:
+            trans = ForcedAligner(self.resources, transcript, nthreads=self.nthreads, pool=self.pool, graph_cache=self.graph_cache, **kwargs)
+        return trans.transcribe(source, progress_cb=progress_cb, logging=logging)
+
+    def stop(self):
+        self.pool.stop()
+
+class Worker():
+    '''Connects to a Dispatcher and runs its jobs with `handler`, which is
+    called as `handler(job_class, transcript, source, progress_cb,
+    **kwargs)` and returns a Transcription.  `capacity` jobs may run at
+    once, each on its own connection.  `secret` is the Dispatcher's.'''
+
+    def __init__(self, address, handler, classes=None, capacity=1, name=None, secret=None):
+        self.address = address
+        self.secret = secret
+        self.handler = handler
+        self.classes = classes if classes is not None else getattr(handler, 'classes', ['align'])
+        self.capacity = capacity
+        self.name = name if name is not None else '%s:%d' % (socket.gethostname(), id(self))
+        self._stopped = threading.Event()
+        self._threads = []
+        self._socks = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.capacity):
+            t = threading.Thread(target=self._run, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def join(self):
+        for t in self._threads:
+            t.join()
+
+    def stop(self):
+        '''Disconnects, abandoning any running jobs (the dispatcher will
+        give them to other workers).'''
+        self._stopped.set()
+        with self._lock:
+            for sock in self._socks:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def _run(self):
+        family, addr = parse_address(self.address)
+        while not self._stopped.is_set():
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            with self._lock:
+                self._socks.add(sock)
+            try:
+                sock.connect(addr)
+                self._session(sock)
+            except (OSError, ValueError, KeyError) as e:
+                logging.info("lost dispatcher at %s: %s" % (self.address, e))
+            finally:
+                with self._lock:
+                    self._socks.discard(sock)
+                sock.close()
+            self._stopped.wait(RECONNECT_DELAY)
+
+    def _session(self, sock):
+        challenge, _ = recv_frame(sock)
+        hello = {'type': 'hello', 'name': self.name, 'classes': self.classes}
+        if self.secret is not None:
+            hello['auth'] = _auth(self.secret, challenge['nonce'])
+        send_frame(sock, hello)
+        send_lock = threading.Lock()
+
+        while not self._stopped.is_set():
+            send_frame(sock, {'type': 'ready'})
+            msg, payload = recv_frame(sock)
+            job_id = msg['id']
+
+            def on_progress(p):
+                with send_lock:
+                    send_frame(sock, {'type': 'progress', 'id': job_id, 'progress': p})
+
+            kwargs = msg['kwargs']
+            if 'disfluencies' in kwargs:
+                kwargs['disfluencies'] = set(kwargs['disfluencies'])
+
+            try:
+                rate, offset, size = audio.parse_wav_header(payload)
+                source = audio.AudioSource(memoryview(payload)[offset:offset + size], rate=rate)
+                result = self.handler(msg['class'], msg['transcript'], source, on_progress, **kwargs)
+            except Exception as e:
+                logging.exception("job %d failed" % (job_id))
+                with send_lock:
+                    send_frame(sock, {'type': 'error', 'id': job_id, 'error': str(e)})
+                continue
+
+            with send_lock:
+                send_frame(sock, {'type': 'result', 'id': job_id}, result.to_json().encode())
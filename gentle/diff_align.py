@@ -5,14 +5,25 @@ import sys
 
 from gentle import metasentence
 from gentle import language_model
+from gentle import metrics
 from gentle import standard_kaldi
 from gentle import transcription
 from gentle.resources import Resources
+from gentle.sequence_matcher import BandedMatcher
+
+# Sequence matchers that `word_diff` can use. Each is constructed as
+# Matcher(a=..., b=...) and must provide get_opcodes().
+BACKENDS = {
+    'difflib': difflib.SequenceMatcher,
+    'banded': BandedMatcher,
+}
+DEFAULT_BACKEND = 'banded'
 
 
 # TODO(maxhawkins): try using the (apparently-superior) time-mediated dynamic
 # programming algorithm used in sclite's alignment process:
 # http://www1.icsi.berkeley.edu/Speech/docs/sctk-1.2/sclite.htm#time-mediated
+@metrics.stage('diff_align')
 def align(alignment, ms, **kwargs):
     '''Use the diff algorithm to align the raw tokens recognized by Kaldi
     to the words in the transcript (tokenized by MetaSentence).
@@ -23,6 +34,7 @@ def align(alignment, ms, **kwargs):
     '''
     disfluency = kwargs['disfluency'] if 'disfluency' in kwargs else False
     disfluencies = kwargs['disfluencies'] if 'disfluencies' in kwargs else []
+    backend = kwargs['diff_backend'] if 'diff_backend' in kwargs else None
 
     hypothesis = [X.word for X in alignment]
     reference = ms.get_kaldi_sequence()
@@ -31,7 +43,7 @@ def align(alignment, ms, **kwargs):
     txt_offsets = ms.get_text_offsets()
 
     out = []
-    for op, a, b in word_diff(hypothesis, reference):
+    for op, a, b in word_diff(hypothesis, reference, backend=backend):
 
         if op == 'delete':
             word = hypothesis[a]
@@ -73,11 +85,13 @@ def align(alignment, ms, **kwargs):
                 word=display_word))
     return out
 
-def word_diff(a, b):
+def word_diff(a, b, backend=None):
     '''Like difflib.SequenceMatcher but it only compares one word
     at a time. Returns an iterator whose elements are like
-    (operation, index in a, index in b)'''
-    matcher = difflib.SequenceMatcher(a=a, b=b)
+    (operation, index in a, index in b)
+
+    `backend` names one of BACKENDS (default: DEFAULT_BACKEND)'''
+    matcher = BACKENDS[backend or DEFAULT_BACKEND](a=a, b=b)
     for op, a_idx, _, b_idx, _ in by_word(matcher.get_opcodes()):
         yield (op, a_idx, b_idx)
 
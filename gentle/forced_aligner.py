@@ -1,34 +1,63 @@
+from gentle import audio
 from gentle import diff_align
 from gentle import kaldi_queue
 from gentle import language_model
 from gentle import metasentence
+from gentle import metrics
 from gentle import multipass
+from gentle import transcriber
 from gentle.transcriber import MultiThreadedTranscriber
 from gentle.transcription import Transcription
+from gentle.tracing import NULL_TRACER
 
 class ForcedAligner():
 
-    def __init__(self, resources, transcript, nthreads=4, **kwargs):
+    def __init__(self, resources, transcript, nthreads=4, pool=None, graph_cache=None, tracer=NULL_TRACER, **kwargs):
         self.kwargs = kwargs
+        self.tracer = tracer
         self.nthreads = nthreads
+        self.pool = pool
+        self.graph_cache = graph_cache
         self.transcript = transcript
         self.resources = resources
         self.ms = metasentence.MetaSentence(transcript, resources.vocab)
         ks = self.ms.get_kaldi_sequence()
-        gen_hclg_filename = language_model.make_bigram_language_model(ks, resources.proto_langdir, **kwargs)
-        self.queue = kaldi_queue.build(resources, hclg_path=gen_hclg_filename, nthreads=nthreads)
+        with tracer.span('graph', words=len(ks)):
+            graph = language_model.make_graph(ks, resources.proto_langdir, cache=graph_cache, **kwargs)
+        if pool is not None:
+            # Borrow warm workers instead of starting our own
+            self.queue = pool.lease(graph)
+        else:
+            self.queue = kaldi_queue.build(resources, graph=graph, nthreads=nthreads)
         self.mtt = MultiThreadedTranscriber(self.queue, nthreads=nthreads)
 
-    def transcribe(self, wavfile, progress_cb=None, logging=None):
-        words, duration = self.mtt.transcribe(wavfile, progress_cb=progress_cb)
+    def transcribe(self, wavfile, progress_cb=None, logging=None, partial_cb=None, checkpoint=None):
+        '''Aligns the transcript to `wavfile`.  During the first pass,
+        `partial_cb` is given a Transcription of what's been aligned so
+        far every few seconds.  Decoding results are saved to (and, when
+        resuming, taken from) `checkpoint`.'''
+        # Both passes read from the one mapping
+        with audio.opened(wavfile) as source:
+            return self._transcribe(source, progress_cb, logging, partial_cb, checkpoint)
+
+    def _transcribe(self, wavfile, progress_cb, logging, partial_cb, checkpoint):
+        tracer = self.tracer
+        with tracer.span('first_pass'):
+            on_partial = None
+            if partial_cb is not None:
+                on_partial = lambda words: partial_cb(self._partial(words))
+            words = transcriber.collect(self.mtt.iter_words(wavfile, progress_cb=progress_cb, tracer=tracer, checkpoint=checkpoint), on_partial)
+            duration = wavfile.duration
 
         # Clear queue (would this be gc'ed?)
-        for i in range(self.nthreads):
-            k = self.queue.get()
-            k.stop()
+        if self.pool is None:
+            for i in range(self.nthreads):
+                k = self.queue.get()
+                k.stop()
 
         # Align words
-        words = diff_align.align(words, self.ms, **self.kwargs)
+        with tracer.span('diff_align'):
+            words = diff_align.align(words, self.ms, **self.kwargs)
 
         # Perform a second-pass with unaligned words
         if logging is not None:
@@ -37,15 +66,23 @@ class ForcedAligner():
         if progress_cb is not None:
             progress_cb({'status': 'ALIGNING'})
 
-        words = multipass.realign(wavfile, words, self.ms, resources=self.resources, nthreads=self.nthreads, progress_cb=progress_cb)
+        with tracer.span('realign'):
+            words = multipass.realign(wavfile, words, self.ms, resources=self.resources, nthreads=self.nthreads, progress_cb=progress_cb, pool=self.pool, graph_cache=self.graph_cache, tracer=tracer, checkpoint=checkpoint)
 
         if logging is not None:
             logging.info("after 2nd pass: %d unaligned words (of %d)" % (len([X for X in words if X.not_found_in_audio()]), len(words)))
 
-        words = AdjacencyOptimizer(words, duration).optimize()
+        with tracer.span('adjacency'):
+            words = AdjacencyOptimizer(words, duration).optimize()
 
         return Transcription(words=words, transcript=self.transcript)
 
+    def _partial(self, words):
+        words = diff_align.align(words, self.ms, **self.kwargs)
+        # The rest of the transcript hasn't been reached yet
+        heard = [idx for idx, X in enumerate(words) if X.success()]
+        return Transcription(words=words[:heard[-1] + 1] if heard else [], transcript=self.transcript)
+
 
 class AdjacencyOptimizer():
 
@@ -153,6 +190,7 @@ class AdjacencyOptimizer():
             if self.swap_adjacent_if_better(i, j, n, "left"): return True
             if self.swap_adjacent_if_better(i, j, n, "right"): return True
 
+    @metrics.stage('adjacency')
     def optimize(self):
         i = 0
         while i < len(self.words):
@@ -1,6 +1,7 @@
 import os
 
 from gentle import kaldi_queue
+from gentle import transcriber
 from gentle import transcription
 from gentle.transcriber import MultiThreadedTranscriber
 from gentle.transcription import Transcription
@@ -16,8 +17,11 @@ class FullTranscriber():
         self.mtt = MultiThreadedTranscriber(queue, nthreads=nthreads)
         self.available = True
 
-    def transcribe(self, wavfile, progress_cb=None, logging=None):
-        words, duration = self.mtt.transcribe(wavfile, progress_cb=progress_cb)
+    def transcribe(self, wavfile, progress_cb=None, logging=None, partial_cb=None, checkpoint=None):
+        on_partial = None
+        if partial_cb is not None:
+            on_partial = lambda words: partial_cb(self.make_transcription_alignment(words))
+        words = transcriber.collect(self.mtt.iter_words(wavfile, progress_cb=progress_cb, checkpoint=checkpoint), on_partial)
         return self.make_transcription_alignment(words)
 
     @staticmethod
@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+# Files read by ext/m3 when building a graph; if any of these change,
+# previously-built graphs are no longer valid.
+MODEL_FILES = [
+    'langdir/L.fst',
+    'langdir/L_disambig.fst',
+    'langdir/phones/disambig.int',
+    'tdnn_7b_chain_online/final.mdl',
+    'tdnn_7b_chain_online/tree',
+    'tdnn_7b_chain_online/graph_pp/words.txt',
+]
+
+_model_ids = {}
+
+def model_identity(proto_langdir):
+    '''Returns a string identifying the model files in `proto_langdir`
+    (by path, size and modification time).'''
+    if proto_langdir not in _model_ids:
+        h = hashlib.sha1(os.path.abspath(proto_langdir).encode())
+        for name in MODEL_FILES:
+            path = os.path.join(proto_langdir, name)
+            try:
+                st = os.stat(path)
+                h.update(('%s %d %d\n' % (name, st.st_size, st.st_mtime_ns)).encode())
+            except OSError:
+                h.update(('%s missing\n' % (name)).encode())
+        _model_ids[proto_langdir] = h.hexdigest()
+    return _model_ids[proto_langdir]
+
+class FileCache():
+    '''Content-addressed on-disk store of files, named by key.
+
+    Entries are published atomically (so several processes may share a
+    directory) and the least-recently used ones are removed once the
+    directory grows past `max_bytes`.
+    '''
+
+    SUFFIX = ''
+
+    def __init__(self, cache_dir, max_bytes=2*1024**3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + self.SUFFIX)
+
+    def get(self, key):
+        '''Returns the path of the cached file, or None.'''
+        path = self.path(key)
+        try:
+            # Touch, so that eviction is least-recently-used
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def mkstemp(self):
+        '''Returns a temporary filename inside the cache directory, to be
+        passed to `publish` once it's been written.'''
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        os.close(fd)
+        return tmp_path
+
+    def publish(self, key, tmp_path):
+        '''Atomically moves `tmp_path` into the cache under `key`.'''
+        path = self.path(key)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def add(self, key, src):
+        '''Publishes a copy of the file at `src` (a hard link, where
+        possible) under `key`.'''
+        tmp_path = self.mkstemp()
+        os.unlink(tmp_path)
+        _link_or_copy(src, tmp_path)
+        return self.publish(key, tmp_path)
+
+    def copy_to(self, key, dst):
+        '''Puts the cached file for `key` at `dst` (as a hard link, where
+        possible). Returns False if there isn't one.'''
+        path = self.get(key)
+        if path is None:
+            return False
+        try:
+            _link_or_copy(path, dst)
+        except FileNotFoundError:
+            return False # evicted meanwhile
+        return True
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(self.SUFFIX) or name.endswith('.tmp'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue # evicted by someone else
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+
+        entries.sort()
+        # Always keep the most recent entry, even if it's over budget alone
+        for mtime, size, name in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.cache_dir, name))
+                logging.debug("evicted %s", name)
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        # (Another filesystem, or one without hard links)
+        shutil.copyfile(src, dst)
+
+class GraphCache(FileCache):
+    '''HCLG graphs built by m3, keyed by the kaldi sequence, the language
+    model options and the identity of the model they were built from.'''
+
+    SUFFIX = '_HCLG.fst'
+
+    def key(self, kaldi_seq, proto_langdir, **kwargs):
+        conservative = kwargs['conservative'] if 'conservative' in kwargs else False
+        disfluency = kwargs['disfluency'] if 'disfluency' in kwargs else False
+        disfluencies = kwargs['disfluencies'] if 'disfluencies' in kwargs else []
+
+        if len(kaldi_seq) == 0 or type(kaldi_seq[0]) != list:
+            kaldi_seq = [kaldi_seq]
+
+        h = hashlib.sha1()
+        h.update(model_identity(proto_langdir).encode())
+        h.update(('conservative=%d disfluency=%d\n' % (conservative, disfluency)).encode())
+        h.update((' '.join(sorted(disfluencies)) + '\n').encode())
+        for word_sequence in kaldi_seq:
+            h.update((' '.join(word_sequence) + '\n').encode())
+        return h.hexdigest()
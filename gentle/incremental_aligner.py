@@ -0,0 +1,150 @@
+import collections
+
+from gentle import audio
+from gentle import diff_align
+from gentle import metasentence
+from gentle import multipass
+from gentle import transcription
+from gentle.forced_aligner import AdjacencyOptimizer
+from gentle.transcription import Transcription
+from gentle.tracing import NULL_TRACER
+
+# Words either side of an edit that are realigned along with it
+MARGIN = 2
+
+def _key(word):
+    # Edits that don't change how a word is said don't need realigning
+    return word.lower().replace("’", "'")
+
+def carry_over(previous, ms, margin=MARGIN):
+    '''Maps the alignment of an earlier transcript (`previous`, a
+    Transcription) onto the tokens of an edited one (`ms`, its
+    MetaSentence).
+
+    Returns the words of the edited transcript, in order, and the list
+    of those that need realigning: each word that was changed or added,
+    and `margin` words either side of it, which are left unaligned
+    (NOT_FOUND_IN_AUDIO).  The rest keep their previous alignment, as do
+    words that were heard but not in the transcript, if they lie between
+    two kept words.'''
+    old = [X for X in previous.words if X.startOffset is not None]
+    old_keys = [_key(previous.transcript[X.startOffset:X.endOffset]) for X in old]
+    display_seq = ms.get_display_sequence()
+    offsets = ms.get_text_offsets()
+    new_keys = [_key(X) for X in display_seq]
+
+    old_to_new = {}
+    edited = bytearray(len(new_keys))
+    for op, a, b in diff_align.word_diff(old_keys, new_keys):
+        if op == 'equal':
+            old_to_new[a] = b
+        elif op in ('replace', 'insert'):
+            for i in range(max(0, b - margin), min(len(edited), b + margin + 1)):
+                edited[i] = 1
+        # (A removed word leaves its neighbours' alignment as it was)
+
+    words = [None] * len(new_keys)
+    for a, b in old_to_new.items():
+        if not edited[b]:
+            wd = old[a]
+            words[b] = transcription.Word(
+                case=wd.case, startOffset=offsets[b][0], endOffset=offsets[b][1],
+                word=display_seq[b], alignedWord=wd.alignedWord, phones=wd.phones,
+                start=wd.start, duration=wd.duration)
+    to_realign = []
+    for b, wd in enumerate(words):
+        if wd is None:
+            words[b] = transcription.Word(
+                case=transcription.Word.NOT_FOUND_IN_AUDIO,
+                startOffset=offsets[b][0], endOffset=offsets[b][1],
+                word=display_seq[b])
+            to_realign.append(words[b])
+
+    # Words out of the transcript, by the new index of the word before
+    extras = collections.defaultdict(list)
+    a = -1
+    for wd in previous.words:
+        if wd.startOffset is not None:
+            a += 1
+        elif a == -1 or a in old_to_new:
+            extras[old_to_new.get(a, -1)].append(wd)
+
+    def kept(b):
+        return b < 0 or b >= len(words) or not edited[b]
+
+    out = []
+    for b in range(-1, len(words)):
+        if b >= 0:
+            out.append(words[b])
+        if kept(b) and kept(b + 1):
+            out.extend(extras.get(b, []))
+    return out, to_realign
+
+class IncrementalAligner():
+    '''Aligns an edited transcript to audio that an earlier version of
+    it was aligned to (`previous`, a Transcription), redoing only what
+    was edited.
+
+    The two transcripts are diffed word by word, and words that weren't
+    changed keep their alignment (see `carry_over`).  The rest are
+    realigned as the second pass of ForcedAligner does (see
+    `multipass.realign`), against the audio between the aligned words
+    around them, so the work done grows with the size of the edits
+    rather than the length of the recording.'''
+
+    def __init__(self, resources, previous, transcript, nthreads=4, pool=None, graph_cache=None, margin=MARGIN, tracer=NULL_TRACER, **kwargs):
+        self.resources = resources
+        self.transcript = transcript
+        self.nthreads = nthreads
+        self.pool = pool
+        self.graph_cache = graph_cache
+        self.tracer = tracer
+        self.kwargs = kwargs
+        self.ms = metasentence.MetaSentence(transcript, resources.vocab)
+        self.words, self.to_realign = carry_over(previous, self.ms, margin=margin)
+
+    def transcribe(self, wavfile, progress_cb=None, logging=None, partial_cb=None, checkpoint=None):
+        '''Like ForcedAligner.transcribe (there's no first pass, so
+        `partial_cb` isn't called).'''
+        with audio.opened(wavfile) as source:
+            return self._transcribe(source, progress_cb, logging, checkpoint)
+
+    def _transcribe(self, source, progress_cb, logging, checkpoint):
+        if logging is not None:
+            logging.info("%d of %d words to realign" % (len(self.to_realign), len(self.ms)))
+
+        if progress_cb is not None:
+            progress_cb({'status': 'ALIGNING'})
+
+        words = self.words
+        if len(self.to_realign) > 0:
+            with self.tracer.span('realign', words=len(self.to_realign)):
+                words = multipass.realign(source, words, self.ms, resources=self.resources, nthreads=self.nthreads, progress_cb=progress_cb, pool=self.pool, graph_cache=self.graph_cache, tracer=self.tracer, checkpoint=checkpoint, only=self.to_realign)
+
+        if logging is not None:
+            logging.info("%d unaligned words (of %d)" % (len([X for X in words if X.not_found_in_audio()]), len(words)))
+
+        with self.tracer.span('adjacency'):
+            self._optimize(words, source.duration)
+
+        return Transcription(words=words, transcript=self.transcript)
+
+    def _optimize(self, words, duration):
+        '''Runs the AdjacencyOptimizer over just the realigned parts, each
+        with the aligned words around it.'''
+        kept = set(id(X) for X in self.words) - set(id(X) for X in self.to_realign)
+        idx = 0
+        while idx < len(words):
+            if id(words[idx]) in kept:
+                idx += 1
+                continue
+            start = idx
+            while idx < len(words) and id(words[idx]) not in kept:
+                idx += 1
+            end = idx
+            while start > 0 and not words[start - 1].success():
+                start -= 1
+            while end < len(words) and not words[end].success():
+                end += 1
+            # (Swaps are made on the Words themselves)
+            AdjacencyOptimizer(words[max(0, start - 1):end + 1], duration).optimize()
@@ -1,15 +1,168 @@
+import threading
+
 from queue import Queue
 from gentle import standard_kaldi
 
-def build(resources, nthreads=4, hclg_path=None):
+def build(resources, nthreads=4, hclg_path=None, graph=None):
+    '''`graph` (a path or the FST as bytes) is loaded into each worker after
+    it starts, in place of `hclg_path`.'''
+
+    if hclg_path is None and graph is None: hclg_path = resources.full_hclg_path
 
-    if hclg_path is None: hclg_path = resources.full_hclg_path
+    if graph is not None:
+        key = standard_kaldi.graph_key(graph)
+        graph = _read_graph(graph)
 
     kaldi_queue = Queue()
     for i in range(nthreads):
-        kaldi_queue.put(standard_kaldi.Kaldi(
+        k = standard_kaldi.new_decoder(
             resources.nnet_gpu_path,
             hclg_path,
             resources.proto_langdir)
-        )
+        if graph is not None and not k.load_graph(graph, key=key):
+            raise RuntimeError("k3 could not load graph")
+        kaldi_queue.put(k)
     return kaldi_queue
+
+def _read_graph(graph):
+    # A graph in a GraphCache may be evicted (by any job's publish)
+    # before a worker gets round to loading it, so it's read up front and
+    # piped to k3 with `load-graph-data`
+    if isinstance(graph, bytes):
+        return graph
+    with open(graph, 'rb') as fh:
+        return fh.read()
+
+class KaldiPool():
+    '''A fixed-size set of warm k3 processes that outlives any single job.
+
+    Workers are started without a decoding graph; `get` switches a
+    worker to the requested HCLG with `load-graph-data`, which is much
+    cheaper than starting a new process (the acoustic model, ivector
+    extractor and symbol tables stay loaded).  Idle workers that
+    already have the requested graph are preferred (and then the graph
+    isn't read at all).
+    '''
+
+    def __init__(self, resources, nworkers=4):
+        self.resources = resources
+        self.nworkers = nworkers
+
+        self._cond = threading.Condition()
+        self._idle = []
+        self._nlive = 0
+        self._stopped = False
+
+        for i in range(nworkers):
+            self._idle.append(self._spawn())
+            self._nlive += 1
+
+    def _spawn(self):
+        return standard_kaldi.new_decoder(
+            self.resources.nnet_gpu_path,
+            None,
+            self.resources.proto_langdir)
+
+    def _take_idle(self, key):
+        for idx, k in enumerate(self._idle):
+            if k.graph_key == key:
+                return self._idle.pop(idx)
+        # Otherwise take the least-recently used worker
+        return self._idle.pop(0)
+
+    def get(self, graph, key=None):
+        '''Borrow a worker with `graph` (a path, or the FST as bytes) loaded,
+        blocking until one is free.'''
+        if key is None:
+            key = standard_kaldi.graph_key(graph)
+        with self._cond:
+            loaded = any(X.graph_key == key for X in self._idle)
+        if not loaded:
+            # (Before waiting, in case it's evicted in the meantime)
+            graph = _read_graph(graph)
+        with self._cond:
+            while True:
+                if self._stopped:
+                    raise RuntimeError("KaldiPool has been stopped")
+                if len(self._idle) > 0:
+                    k = self._take_idle(key)
+                    break
+                if self._nlive < self.nworkers:
+                    # Replace a worker that died
+                    self._nlive += 1
+                    k = None
+                    break
+                self._cond.wait()
+
+        if k is not None and k.graph_key != key and not isinstance(graph, bytes):
+            # Another job took the worker that had it loaded
+            try:
+                graph = _read_graph(graph)
+            except OSError:
+                self.put(k)
+                raise
+        try:
+            if k is None:
+                k = self._spawn()
+            if not k.load_graph(graph, key=key):
+                raise RuntimeError("k3 could not load graph %s" % (key))
+        except Exception:
+            if k is not None:
+                k.stop()
+            self._release_slot()
+            raise
+        return k
+
+    def put(self, k):
+        '''Return a borrowed worker to the pool.'''
+        if k.finished or not k.alive():
+            self._release_slot()
+            return
+        with self._cond:
+            self._idle.append(k)
+            self._cond.notify()
+
+    def _release_slot(self):
+        with self._cond:
+            self._nlive -= 1
+            self._cond.notify()
+
+    def lease(self, graph):
+        '''Returns a queue-like object (as returned by `build`) that borrows
+        workers from this pool with `graph` loaded.'''
+        return PoolLease(self, graph)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for k in idle:
+            k.stop()
+
+class PoolLease():
+    '''Stands in for the `Queue` of workers returned by `build`, but hands
+    out (and takes back) shared workers from a KaldiPool.'''
+
+    def __init__(self, pool, graph):
+        self.pool = pool
+        # (Still keyed by path, for workers that have it loaded already)
+        self.key = standard_kaldi.graph_key(graph)
+        self.graph = _read_graph(graph)
+
+    def get(self):
+        return self.pool.get(self.graph, key=self.key)
+
+    def put(self, k):
+        self.pool.put(k)
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+def shared_pool(resources, nworkers=4):
+    '''Returns the process-wide KaldiPool, starting it on first use.'''
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = KaldiPool(resources, nworkers=nworkers)
+        return _shared_pool
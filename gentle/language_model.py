@@ -1,3 +1,4 @@
+import array
 import logging
 import math
 import os
@@ -5,7 +6,10 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import threading
 
+from . import metrics
+from . import standard_kaldi
 from .util.paths import get_binary
 from .metasentence import MetaSentence
 from .resources import Resources
@@ -15,11 +19,14 @@ MKGRAPH_PATH = get_binary("ext/m3")
 # [oov] no longer in words.txt
 OOV_TERM = '<unk>'
 
-def make_bigram_lm_fst(word_sequences, **kwargs):
+def make_bigram_lm_fst(word_sequences, word_ids=None, **kwargs):
     '''
     Use the given token sequence to make a bigram language model
     in OpenFST plain text format.
 
+    If `word_ids` (a dict from word to symbol id) is given, arcs are
+    labelled with ids rather than words.
+
     When the "conservative" flag is set, an [oov] is interleaved
     between successive words.
 
@@ -36,96 +43,175 @@ def make_bigram_lm_fst(word_sequences, **kwargs):
     disfluency = kwargs['disfluency'] if 'disfluency' in kwargs else False
     disfluencies = kwargs['disfluencies'] if 'disfluencies' in kwargs else []
 
-    bigrams = {OOV_TERM: set([OOV_TERM])}
+    # Number the vocabulary in sorted order, so that sorting the integer
+    # bigrams below orders them as sorting the words would
+    symbols = set([OOV_TERM])
+    for word_sequence in word_sequences:
+        symbols.update(word_sequence)
+    if disfluency:
+        symbols.update(disfluencies)
+    symbols = sorted(symbols)
+    index = {word: idx for idx, word in enumerate(symbols)}
+
+    # Each bigram is packed into a single int, as from * N + to
+    N = len(symbols)
+    unk = index[OOV_TERM]
+    dis_ids = [index[X] for X in disfluencies] if disfluency else []
+
+    bigrams = set([unk * N + unk])
 
     for word_sequence in word_sequences:
         if len(word_sequence) == 0:
             continue
 
-        prev_word = word_sequence[0]
-        bigrams[OOV_TERM].add(prev_word) # valid start (?)
+        ids = [index[X] for X in word_sequence]
 
-        if disfluency:
-            bigrams[OOV_TERM].update(disfluencies)
+        prev_word = ids[0]
+        bigrams.add(unk * N + prev_word) # valid start (?)
 
-            for dis in disfluencies:
-                bigrams.setdefault(dis, set()).add(prev_word)
-                bigrams[dis].add(OOV_TERM)
+        for dis in dis_ids:
+            bigrams.add(unk * N + dis)
+            bigrams.add(dis * N + prev_word)
+            bigrams.add(dis * N + unk)
 
-        for word in word_sequence[1:]:
-            bigrams.setdefault(prev_word, set()).add(word)
+        for word in ids[1:]:
+            bigrams.add(prev_word * N + word)
 
             if conservative:
-                bigrams[prev_word].add(OOV_TERM)
+                bigrams.add(prev_word * N + unk)
 
-            if disfluency:
-                bigrams[prev_word].update(disfluencies)
-
-                for dis in disfluencies:
-                    bigrams[dis].add(word)
+            for dis in dis_ids:
+                bigrams.add(prev_word * N + dis)
+                bigrams.add(dis * N + word)
 
             prev_word = word
 
         # ...valid end
-        bigrams.setdefault(prev_word, set()).add(OOV_TERM)
-
-    node_ids = {}
-    def get_node_id(word):
-        node_id = node_ids.get(word, len(node_ids) + 1)
-        node_ids[word] = node_id
-        return node_id
-
-    output = ""
-    for from_word in sorted(bigrams.keys()):
-        from_id = get_node_id(from_word)
-
-        successors = bigrams[from_word]
-        if len(successors) > 0:
-            weight = -math.log(1.0 / len(successors))
-        else:
-            weight = 0
-
-        for to_word in sorted(successors):
-            to_id = get_node_id(to_word)
-            output += '%d    %d    %s    %s    %f' % (from_id, to_id, to_word, to_word, weight)
-            output += "\n"
-
-    output += "%d    0\n" % (len(node_ids))
-
-    return output.encode()
+        bigrams.add(prev_word * N + unk)
+
+    if word_ids is None:
+        labels = [X.encode() for X in symbols]
+    else:
+        labels = [b'%d' % (word_ids[X]) for X in symbols]
+
+    node_ids = [0] * N
+    n_nodes = 0
+
+    # Written straight into one buffer, rather than built up as a list
+    # of lines (or a str that then needs encoding)
+    bigrams = array.array('q', sorted(bigrams))
+    output = bytearray()
+    start = 0
+    while start < len(bigrams):
+        from_word = bigrams[start] // N
+        end = start + 1
+        while end < len(bigrams) and bigrams[end] // N == from_word:
+            end += 1
+
+        if node_ids[from_word] == 0:
+            n_nodes += 1
+            node_ids[from_word] = n_nodes
+        from_id = node_ids[from_word]
+
+        weight = -math.log(1.0 / (end - start))
+
+        for idx in range(start, end):
+            to_word = bigrams[idx] % N
+            if node_ids[to_word] == 0:
+                n_nodes += 1
+                node_ids[to_word] = n_nodes
+            label = labels[to_word]
+            output += b'%d    %d    %s    %s    %f\n' % (from_id, node_ids[to_word], label, label, weight)
+
+        start = end
+
+    output += b'%d    0\n' % (n_nodes)
+
+    return bytes(output)
+
+_word_ids = {}
+_word_ids_lock = threading.Lock()
+
+def load_word_ids(proto_langdir):
+    '''Map from word to symbol id in the graph's words.txt (as used by m3
+    with --int-labels), loaded once per process.'''
+    path = os.path.join(proto_langdir, 'tdnn_7b_chain_online', 'graph_pp', 'words.txt')
+    with _word_ids_lock:
+        if path not in _word_ids:
+            symbols = standard_kaldi.load_symbol_table(path)
+            _word_ids[path] = {word: idx for idx, word in enumerate(symbols)
+                               if word is not None}
+        return _word_ids[path]
+
+def compile_graph(kaldi_seq, proto_langdir, out_path=None, **kwargs):
+    '''Compile a bigram language model for `kaldi_seq` into an HCLG.
+
+    The grammar is piped to m3 rather than written to disk.  The HCLG is
+    written to `out_path` if given, and otherwise returned as bytes.
+    '''
+    txt_fst = make_bigram_lm_fst(kaldi_seq, word_ids=load_word_ids(proto_langdir), **kwargs)
+
+    proc = subprocess.Popen([MKGRAPH_PATH,
+                             '--int-labels',
+                             proto_langdir,
+                             '-',
+                             out_path if out_path is not None else '-'],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    hclg, _ = proc.communicate(txt_fst)
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, MKGRAPH_PATH)
+
+    metrics.GRAPH_BYTES.observe(len(hclg) if out_path is None else os.path.getsize(out_path))
+    if out_path is None:
+        return hclg
+
+def make_graph(kaldi_seq, proto_langdir, cache=None, **kwargs):
+    '''Generates a decoding graph to fit the text, to be handed to
+    `Kaldi.load_graph` (or a KaldiPool).
+
+    With a `cache` (a GraphCache), returns the path of the cached HCLG;
+    otherwise the HCLG itself is returned, as bytes, and never touches
+    the disk.
+    '''
+    if cache is not None:
+        return make_bigram_language_model(kaldi_seq, proto_langdir, cache=cache, **kwargs)
+    with metrics.stage('language_model'):
+        return compile_graph(kaldi_seq, proto_langdir, **kwargs)
 
-def make_bigram_language_model(kaldi_seq, proto_langdir, **kwargs):
+@metrics.stage('language_model')
+def make_bigram_language_model(kaldi_seq, proto_langdir, cache=None, **kwargs):
     """Generates a language model to fit the text.
 
     Returns the filename of the generated language model FST.
-    The caller is resposible for removing the generated file.
+    The caller is resposible for removing the generated file, unless
+    it came from `cache` (a GraphCache), which owns its files.
 
     `proto_langdir` is a path to a directory containing prototype model data
     `kaldi_seq` is a list of words within kaldi's vocabulary.
     """
 
-    # Generate a textual FST
-    txt_fst = make_bigram_lm_fst(kaldi_seq, **kwargs)
-    txt_fst_file = tempfile.NamedTemporaryFile(delete=False)
-    txt_fst_file.write(txt_fst)
-    txt_fst_file.close()
+    if cache is not None:
+        key = cache.key(kaldi_seq, proto_langdir, **kwargs)
+        hclg_filename = cache.get(key)
+        if hclg_filename is not None:
+            return hclg_filename
 
-    hclg_filename = tempfile.mktemp(suffix='_HCLG.fst')
+    if cache is not None:
+        hclg_filename = cache.mkstemp()
+    else:
+        hclg_filename = tempfile.mktemp(suffix='_HCLG.fst')
     try:
-        devnull = open(os.devnull, 'wb')
-        subprocess.check_output([MKGRAPH_PATH,
-                        proto_langdir,
-                        txt_fst_file.name,
-                        hclg_filename],
-                        stderr=devnull)
+        compile_graph(kaldi_seq, proto_langdir, out_path=hclg_filename, **kwargs)
     except Exception as e:
         try:
             os.unlink(hclg_filename)
         except:
             pass
         raise e
-    finally:
-        os.unlink(txt_fst_file.name)
+
+    if cache is not None:
+        hclg_filename = cache.publish(key, hclg_filename)
 
     return hclg_filename
 
@@ -1,9 +1,14 @@
 # coding=utf-8
+import array
+import bisect
 import re
+from collections.abc import Sequence
 
 # [oov] no longer in words.txt
 OOV_TERM = '<unk>'
 
+TOKEN_RE = re.compile(r'(\w|\’\w|\'\w)+', re.UNICODE)
+
 def load_vocabulary(words_file):
     '''Load vocabulary words from an OpenFST SymbolTable formatted text file'''
     return set(x.split(' ')[0] for x in words_file if x != '')
@@ -25,6 +30,10 @@ def kaldi_normalize(word, vocab):
 class MetaSentence:
     """Maintain two parallel representations of a sentence: one for
     Kaldi's benefit, and the other in human-legible form.
+
+    Tokens are kept as parallel arrays of their start and end offsets
+    (as unicode codepoint offsets) and the index of their Kaldi form in
+    `kaldi_words`, which are normalized once per distinct word.
     """
 
     def __init__(self, sentence, vocab):
@@ -37,27 +46,96 @@ class MetaSentence:
         self._tokenize()
 
     def _tokenize(self):
-        self._seq = []
-        for m in re.finditer(r'(\w|\’\w|\'\w)+', self.raw_sentence, re.UNICODE):
-            start, end = m.span()
+        self._starts = array.array('l')
+        self._ends = array.array('l')
+        self._ids = array.array('l')
+        self.kaldi_words = []
+        ids = {}
+        for m in TOKEN_RE.finditer(self.raw_sentence):
             word = m.group()
-            token = kaldi_normalize(word, self.vocab)
-            self._seq.append({
-                "start": start, # as unicode codepoint offset
-                "end": end, # as unicode codepoint offset
-                "token": token,
-            })
+            word_id = ids.get(word)
+            if word_id is None:
+                token = kaldi_normalize(word, self.vocab)
+                # Spellings that normalize alike share an id
+                word_id = ids.setdefault(token, len(self.kaldi_words))
+                if word_id == len(self.kaldi_words):
+                    self.kaldi_words.append(token)
+                ids[word] = word_id
+            start, end = m.span()
+            self._starts.append(start)
+            self._ends.append(end)
+            self._ids.append(word_id)
+        self._kaldi_seq = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def get_kaldi_sequence(self):
+        if self._kaldi_seq is None:
+            self._kaldi_seq = [self.kaldi_words[X] for X in self._ids]
+        return self._kaldi_seq
+
+    def get_display_sequence(self):
+        return self.view(0, len(self)).get_display_sequence()
+
+    def get_text_offsets(self):
+        return self.view(0, len(self)).get_text_offsets()
+
+    def view(self, start, end):
+        """Tokens [start, end), without copying or re-tokenizing."""
+        return MetaSentenceView(self, start, end)
+
+    def span(self, start_offset, end_offset):
+        """A view of the tokens that lie within the given text offsets."""
+        return self.view(bisect.bisect_left(self._starts, start_offset),
+                         bisect.bisect_right(self._ends, end_offset))
+
+class MetaSentenceView:
+    """Tokens [start, end) of a MetaSentence, with the same interface.
+    Offsets still refer to the full transcript."""
+
+    def __init__(self, ms, start, end):
+        self.ms = ms
+        self.raw_sentence = ms.raw_sentence
+        self.start = start
+        self.end = max(start, end)
+
+    def __len__(self):
+        return self.end - self.start
 
     def get_kaldi_sequence(self):
-        return [x["token"] for x in self._seq]
+        return self.ms.get_kaldi_sequence()[self.start:self.end]
 
     def get_display_sequence(self):
-        display_sequence = []
-        for x in self._seq:
-            start, end = x["start"], x["end"]
-            word = self.raw_sentence[start:end]
-            display_sequence.append(word)
-        return display_sequence
+        raw, starts, ends = self.ms.raw_sentence, self.ms._starts, self.ms._ends
+        return _Column(lambda i: raw[starts[i]:ends[i]], self.start, self.end)
 
     def get_text_offsets(self):
-        return [(x["start"], x["end"]) for x in self._seq]
+        starts, ends = self.ms._starts, self.ms._ends
+        return _Column(lambda i: (starts[i], ends[i]), self.start, self.end)
+
+    def view(self, start, end):
+        return MetaSentenceView(self.ms, self.start + start, min(self.start + end, self.end))
+
+class _Column(Sequence):
+    """A read-only sequence of per-token values, computed on access."""
+
+    def __init__(self, get, start, end):
+        self._get = get
+        self._start = start
+        self._end = end
+
+    def __len__(self):
+        return self._end - self._start
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._get(self._start + X) for X in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('token index out of range')
+        return self._get(self._start + idx)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
@@ -0,0 +1,222 @@
+import bisect
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+# Seconds; from a short decode up to a long job
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120, 300)
+
+class Metric():
+    '''A family of time series, one per combination of label values.'''
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            # Reported (as zero) before anything is recorded
+            self._children[()] = self._new_child()
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[X] for X in self.labelnames)
+        values = tuple(str(X) for X in values)
+        with self._lock:
+            if values not in self._children:
+                self._children[values] = self._new_child()
+            return self._children[values]
+
+    def _default(self):
+        return self._children[()]
+
+    def samples(self):
+        '''Yields (suffix, labels, value) for the current values.'''
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in sorted(children):
+            labels = list(zip(self.labelnames, values))
+            for suffix, extra, value in child.samples():
+                yield suffix, labels + extra, value
+
+class _Value():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = float(value)
+
+    def samples(self):
+        return [('', [], self.value)]
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default().inc(amount)
+
+class Gauge(Metric):
+    '''A value that may go up and down.  With `callback`, it's computed at
+    scrape time from a function returning either a number or, for a
+    labelled gauge, a dict from label values (a tuple) to numbers.'''
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        Metric.__init__(self, name, documentation, labelnames)
+        self.callback = callback
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self._default().set(value)
+
+    def samples(self):
+        if self.callback is None:
+            for sample in Metric.samples(self):
+                yield sample
+            return
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            if not isinstance(key, tuple):
+                key = (key,)
+            yield '', list(zip(self.labelnames, [str(X) for X in key])), value
+
+class _Buckets():
+    def __init__(self, bounds):
+        self._lock = threading.Lock()
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        idx = bisect.bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[idx] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - t0)
+
+    def samples(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        ret = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (float('inf'),), counts):
+            cumulative += count
+            ret.append(('_bucket', [('le', _format(bound))], cumulative))
+        ret.append(('_sum', [], total))
+        ret.append(('_count', [], cumulative))
+        return ret
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        Metric.__init__(self, name, documentation, labelnames)
+
+    def _new_child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value):
+        self._default().observe(value)
+
+    def time(self):
+        return self._default().time()
+
+class Registry():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError("duplicate metric %s" % (metric.name))
+            self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def render(self):
+        '''All the metrics, in the Prometheus text exposition format.'''
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda X: X.name)
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.documentation.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for suffix, labels, value in metric.samples():
+                if labels:
+                    label_str = '{%s}' % (','.join(['%s="%s"' % (k, _escape(v)) for k, v in labels]))
+                else:
+                    label_str = ''
+                lines.append('%s%s%s %s' % (metric.name, suffix, label_str, _format(value)))
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return '%d' % (value)
+    return repr(float(value))
+
+def process_rss(pid):
+    '''Resident set size of a process, in bytes (Linux only; None if it
+    can't be read).'''
+    try:
+        with open('/proc/%d/statm' % (pid)) as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'gentle_stage_seconds',
+    'Time spent in each stage of the alignment pipeline',
+    ['stage']))
+
+GRAPH_BYTES = REGISTRY.register(Histogram(
+    'gentle_graph_bytes',
+    'Size of the decoding graphs built for transcripts',
+    buckets=[2**X for X in range(16, 32, 2)]))
+
+REALTIME_FACTOR = REGISTRY.register(Histogram(
+    'gentle_realtime_factor',
+    'Time taken by each job, as a multiple of its audio duration',
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 5)))
+
+def stage(name):
+    '''Context manager timing a stage of the pipeline, as in
+    `with metrics.stage('diff_align'): ...`'''
+    return STAGE_SECONDS.labels(stage=name).time()
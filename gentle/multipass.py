@@ -1,13 +1,22 @@
 import logging
 from multiprocessing.pool import ThreadPool as Pool
 import os
-import wave
+import threading
+import time
 
-from gentle import standard_kaldi
-from gentle import metasentence
+from gentle import audio
+from gentle import kaldi_queue
 from gentle import language_model
+from gentle import metrics
 from gentle import diff_align
 from gentle import transcription
+from gentle.tracing import NULL_TRACER
+
+# Gaps outside this range (in seconds) aren't realigned on their own
+MIN_DURATION = 0.75
+MAX_DURATION = 60
+# Most aligned words that may separate two gaps that are merged
+MAX_BRIDGE = 3
 
 def prepare_multipass(alignment):
     to_realign = []
@@ -35,64 +44,159 @@ def prepare_multipass(alignment):
 
     return to_realign
     
-def realign(wavfile, alignment, ms, resources, nthreads=4, progress_cb=None):
+def merge_neighbours(to_realign, alignment, durations, min_duration=MIN_DURATION, max_bridge=MAX_BRIDGE, max_duration=MAX_DURATION):
+    '''Joins gaps that are separated by only a few aligned words when
+    either of them is too short to realign on its own, so that they can
+    be decoded together as a single request.'''
+    if len(to_realign) == 0:
+        return to_realign
+
+    index = {id(wd): idx for idx, wd in enumerate(alignment)}
+
+    merged = [to_realign[0]]
+    spans = [durations[0]]
+    for chunk, (start_t, end_t) in zip(to_realign[1:], durations[1:]):
+        prev = merged[-1]
+        prev_start_t, prev_end_t = spans[-1]
+
+        bridge = alignment[index[id(prev["words"][-1])]+1:index[id(chunk["words"][0])]]
+        too_short = (prev_end_t - prev_start_t) < min_duration or (end_t - start_t) < min_duration
+        if too_short and len(bridge) <= max_bridge and end_t - prev_start_t <= max_duration:
+            merged[-1] = {
+                "start": prev["start"],
+                "end": chunk["end"],
+                "words": prev["words"] + bridge + chunk["words"]}
+            spans[-1] = (prev_start_t, end_t)
+        else:
+            merged.append(chunk)
+            spans.append((start_t, end_t))
+
+    return merged
+
+@metrics.stage('realign')
+def realign(wavfile, alignment, ms, resources, nthreads=4, progress_cb=None, pool=None, graph_cache=None, timings=None, tracer=NULL_TRACER, checkpoint=None, only=None):
+    '''Second pass: realign each run of unaligned words against the audio
+    between its aligned neighbours, using a language model of just
+    those words.
+
+    Decoding borrows warm workers from `pool` (a KaldiPool), or from a
+    temporary pool of `nthreads` workers; graphs may come from
+    `graph_cache`.  If given, `timings` is updated with the time spent
+    (summed across threads) building graphs, decoding and aligning.
+
+    `wavfile` may be a path or an AudioSource.  Each gap is a span in
+    `tracer`.  Gaps already in `checkpoint` aren't decoded again.  If
+    `only` (a collection of Words) is given, only the gaps that include
+    one of them are realigned.'''
+    with audio.opened(wavfile) as source:
+        return _realign(source, alignment, ms, resources, nthreads, progress_cb, pool, graph_cache, timings, tracer, checkpoint, only)
+
+def _realign(source, alignment, ms, resources, nthreads, progress_cb, pool, graph_cache, timings, tracer, checkpoint, only):
+    t_start = time.time()
     to_realign = prepare_multipass(alignment)
-    realignments = []
-
-    def realign(chunk):
-        wav_obj = wave.open(wavfile, 'rb')
+    if only is not None:
+        only = set(id(X) for X in only)
+        to_realign = [X for X in to_realign if any(id(W) in only for W in X["words"])]
 
+    def span(chunk):
         if chunk["start"] is None:
             start_t = 0
         else:
             start_t = chunk["start"].end
 
         if chunk["end"] is None:
-            end_t = wav_obj.getnframes() / float(wav_obj.getframerate())
+            end_t = source.duration
         else:
             end_t = chunk["end"].start
+        return start_t, end_t
+
+    n_gaps = len(to_realign)
+    to_realign = merge_neighbours(to_realign, alignment, [span(X) for X in to_realign])
+    if len(to_realign) < n_gaps:
+        logging.info("merged %d gaps into %d decode requests" % (n_gaps, len(to_realign)))
+
+    own_pool = pool is None and len(to_realign) > 0
+    if own_pool:
+        pool = kaldi_queue.KaldiPool(resources, nworkers=nthreads)
+
+    realignments = []
+    step_times = {"graph": 0, "decode": 0, "align": 0}
+    lock = threading.Lock()
+
+    def add_time(step, t0):
+        with lock:
+            step_times[step] += time.time() - t0
+
+    def realign(chunk):
+        with tracer.span('gap', words=len(chunk['words'])) as gap_span:
+            realign_gap(chunk, gap_span)
+
+    def realign_gap(chunk, gap_span):
+        start_t, end_t = span(chunk)
+        gap_span.set(start=start_t, end=end_t)
 
         duration = end_t - start_t
         # XXX: the minimum length seems bigger now (?)
-        if duration < 0.75 or duration > 60:
+        if duration < MIN_DURATION or duration > MAX_DURATION:
             logging.debug("cannot realign %d words with duration %f" % (len(chunk['words']), duration))
             return
 
         # Create a language model
+        t0 = time.time()
         offset_offset = chunk['words'][0].startOffset
         chunk_len = chunk['words'][-1].endOffset - offset_offset
-        chunk_transcript = ms.raw_sentence[offset_offset:offset_offset+chunk_len].encode("utf-8")
-        chunk_ms = metasentence.MetaSentence(chunk_transcript, resources.vocab)
+        # (Offsets in the view are those of the full transcript)
+        chunk_ms = ms.span(offset_offset, offset_offset + chunk_len)
         chunk_ks = chunk_ms.get_kaldi_sequence()
 
-        chunk_gen_hclg_filename = language_model.make_bigram_language_model(chunk_ks, resources.proto_langdir)
-        k = standard_kaldi.Kaldi(
-            resources.nnet_gpu_path,
-            chunk_gen_hclg_filename,
-            resources.proto_langdir)
-
-        wav_obj = wave.open(wavfile, 'rb')
-        wav_obj.setpos(int(start_t * wav_obj.getframerate()))
-        buf = wav_obj.readframes(int(duration * wav_obj.getframerate()))
-
-        k.push_chunk(buf)
-        ret = [transcription.Word(**wd) for wd in k.get_final()]
-        k.stop()
-
+        key = '%r-%r:%d-%d' % (start_t, end_t, offset_offset, offset_offset + chunk_len)
+        saved = checkpoint.get('gaps', key) if checkpoint is not None else None
+        if saved is not None:
+            ret = [transcription.Word(**wd) for wd in saved]
+        else:
+            with tracer.span('graph', words=len(chunk_ks)):
+                chunk_graph = language_model.make_graph(chunk_ks, resources.proto_langdir, cache=graph_cache)
+            add_time("graph", t0)
+
+            t0 = time.time()
+            with tracer.span('decode') as decode_span:
+                k = pool.get(chunk_graph)
+                decode_span.set(worker=k.pid, wait=time.time() - t0)
+
+                k.push_chunk(source.slice(start_t, duration))
+                output = k.get_final()
+                pool.put(k)
+            add_time("decode", t0)
+            if checkpoint is not None:
+                checkpoint.put('gaps', key, output)
+            ret = [transcription.Word(**wd) for wd in output]
+
+        t0 = time.time()
         word_alignment = diff_align.align(ret, chunk_ms)
 
         for wd in word_alignment:
-            wd.shift(time=start_t, offset=offset_offset)
+            wd.shift(time=start_t)
+        # Words that were aligned before (bridging two merged gaps) keep
+        # that alignment unless this decode heard them too
+        bridge = dict([(wd.startOffset, wd) for wd in chunk['words'] if wd.success()])
+        word_alignment = [bridge.get(wd.startOffset, wd) if wd.not_found_in_audio() else wd
+                          for wd in word_alignment]
+        add_time("align", t0)
 
         # "chunk" should be replaced by "words"
-        realignments.append({"chunk": chunk, "words": word_alignment})
+        with lock:
+            realignments.append({"chunk": chunk, "words": word_alignment})
 
-        if progress_cb is not None:
-            progress_cb({"percent": len(realignments) / float(len(to_realign))})
+            if progress_cb is not None:
+                progress_cb({"percent": len(realignments) / float(len(to_realign))})
 
-    pool = Pool(nthreads)
-    pool.map(realign, to_realign)
-    pool.close()
+    try:
+        threads = Pool(nthreads)
+        threads.map(realign, to_realign)
+        threads.close()
+    finally:
+        if own_pool:
+            pool.stop()
 
     # Sub in the replacements
     o_words = alignment
@@ -103,4 +207,11 @@ def realign(wavfile, alignment, ms, resources, nthreads=4, progress_cb=None):
         #logging.debug('splice out: "%s' % (str(o_words[st_idx:end_idx])))
         o_words = o_words[:st_idx] + ret["words"] + o_words[end_idx:]
 
+    step_times["total"] = time.time() - t_start
+    logging.info("realigned %d gaps in %.2fs (graph %.2fs, decode %.2fs, align %.2fs)" % (
+        len(realignments), step_times["total"],
+        step_times["graph"], step_times["decode"], step_times["align"]))
+    if timings is not None:
+        timings.update(step_times)
+
     return o_words
@@ -6,6 +6,7 @@ import tempfile
 from contextlib import contextmanager
 
 
+from . import metrics
 from .util.paths import get_binary
 
 FFMPEG = get_binary("ffmpeg")
@@ -65,6 +66,7 @@ def resample_sox(infile, outfile, offset=None, duration=None):
     ] + trim
     return subprocess.call(cmd)
 
+@metrics.stage('resample')
 def resample(infile, outfile, offset=None, duration=None):
     if not os.path.isfile(infile):
         raise IOError("Not a file: %s" % infile)
@@ -79,3 +81,40 @@ def resampled(infile, offset=None, duration=None):
         if resample(infile, fp.name, offset, duration) != 0:
             raise RuntimeError("Unable to resample/encode '%s'" % infile)
         yield fp.name
+
+def pcm_command(infile, offset=None, duration=None):
+    '''
+    The command that decodes a media file to raw 8K 16-bit mono PCM
+    on its stdout (with FFMPEG if available, otherwise SoX)
+    '''
+    if shutil.which(FFMPEG) or os.path.exists(FFMPEG):
+        cmd = [FFMPEG, '-loglevel', 'panic']
+        if offset is not None:
+            cmd += ['-ss', str(offset)]
+        cmd += ['-i', infile]
+        if duration is not None:
+            cmd += ['-t', str(duration)]
+        return cmd + [
+            '-ac', '1', '-ar', '8000',
+            '-f', 's16le', '-acodec', 'pcm_s16le',
+            '-'
+        ]
+
+    cmd = [
+        SOX,
+        '-q',
+        '-V1',
+        infile,
+        '-b', '16',
+        '-c', '1',
+        '-e', 'signed-integer',
+        '-r', '8000',
+        '-L',
+        '-t', 'raw',
+        '-'
+    ]
+    if offset is not None or duration is not None:
+        cmd += ['trim', str(offset or 0)]
+        if duration is not None:
+            cmd += [str(duration)]
+    return cmd
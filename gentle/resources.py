@@ -2,7 +2,7 @@ import logging
 import os
 
 from .util.paths import get_resource, ENV_VAR
-from . import metasentence
+from . import vocab
 
 class Resources():
 
@@ -19,7 +19,7 @@ class Resources():
         require_dir(self.proto_langdir)
         require_dir(self.nnet_gpu_path)
 
-        with open(os.path.join(self.proto_langdir, "langdir", "words.txt")) as fh:
-            self.vocab = metasentence.load_vocabulary(fh)
+        # Shared (mapped from a compiled index) between processes
+        self.vocab = vocab.load(os.path.join(self.proto_langdir, "langdir", "words.txt"))
 
 
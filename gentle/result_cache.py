@@ -0,0 +1,37 @@
+'''Stores that let a repeated submission (a retry, a refresh, the same
+clip sent twice) reuse the work done the first time: the resampled audio
+of each upload, and the alignment of each upload and transcript.'''
+import hashlib
+
+from gentle import audio
+from gentle.graph_cache import FileCache
+
+def hash_bytes(data):
+    return hashlib.sha1(data).hexdigest()
+
+class AudioCache(FileCache):
+    '''8K mono WAVs (as made by `gentle.resample`), keyed by a hash of the
+    media they were made from.'''
+
+    SUFFIX = '.wav'
+
+    def key(self, media_hash):
+        return hash_bytes(('%d %s' % (audio.SAMPLE_RATE, media_hash)).encode())
+
+class ResultCache(FileCache):
+    '''align.json files, keyed by the audio, the transcript, the options
+    and the model (`model_id`) that produced them.'''
+
+    SUFFIX = '.json'
+
+    def key(self, audio_key, transcript, model_id, **kwargs):
+        conservative = kwargs['conservative'] if 'conservative' in kwargs else False
+        disfluency = kwargs['disfluency'] if 'disfluency' in kwargs else False
+        disfluencies = kwargs['disfluencies'] if 'disfluencies' in kwargs else []
+
+        h = hashlib.sha1()
+        h.update(('%s\n%s\n' % (model_id, audio_key)).encode())
+        h.update(('conservative=%d disfluency=%d\n' % (conservative, disfluency)).encode())
+        h.update((' '.join(sorted(disfluencies)) + '\n').encode())
+        h.update(hash_bytes(transcript.encode()).encode())
+        return h.hexdigest()
@@ -1,7 +1,10 @@
 class RPCProtocol(object):
     '''RPCProtocol is the wire protocol we use to communicate with the
     standard_kaldi subprocess. It's a mixed text/binary protocol
-    because we need to send binary audio chunks, but text is simpler.'''
+    because we need to send binary audio chunks, but text is simpler.
+
+    Both pipes are binary streams; `recv_pipe` should be buffered so
+    that a reply body can be read in a single call.'''
 
     def __init__(self, send_pipe, recv_pipe):
         '''Initializes the RPCProtocol and reads from recv_pipe until the startup
@@ -22,6 +25,12 @@ class RPCProtocol(object):
         self._write_request(method, args, body)
         return self._read_reply()
 
+    def read_reply(self):
+        '''Reads the reply to a request that was sent some other way
+        (e.g. as a plain command line). Returns the body.'''
+        body, _ = self._read_reply()
+        return body
+
     def _write_request(self, method, args, body):
         '''Writes a request to the stream.
         Request format:
@@ -29,17 +38,17 @@ class RPCProtocol(object):
         METHOD <ARG1> <ARG2> ... <ARGN>\n
         BODY\n
         '''
-        data = method
+        data = method.encode()
         for arg in args:
-            data += ' ' + arg
-        data += '\n'
+            data += b' ' + arg.encode()
+        data += b'\n'
         if body:
             data += body
 
         try:
-            self.send_pipe.write('%d\n' % len(data))
+            self.send_pipe.write(b'%d\n' % len(data))
             self.send_pipe.write(data)
-            self.send_pipe.write('\n')
+            self.send_pipe.write(b'\n')
         except IOError as _:
             raise IOError("Lost connection with standard_kaldi subprocess")
 
@@ -55,9 +64,9 @@ class RPCProtocol(object):
             data = self.recv_pipe.read(msg_size)
             self.recv_pipe.read(1) # trailing newline
 
-            status_str, body = data.split('\n', 1)
+            status_str, body = data.split(b'\n', 1)
             status = int(status_str)
-        except IOError as _:
+        except (IOError, ValueError) as _:
             raise IOError("Lost connection with standard_kaldi subprocess")
 
         if status < 200 or status >= 300:
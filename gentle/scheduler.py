@@ -0,0 +1,198 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from concurrent.futures import Future
+
+# Assumed run time of a job (in seconds) until some have finished
+DEFAULT_RUNTIME = 60.0
+# Weight of the latest run time in the running average
+RUNTIME_ALPHA = 0.3
+
+class QueueFull(Exception):
+    '''Raised by `Scheduler.submit` when a job can't be queued.
+
+    `saturated` is set when the whole scheduler (rather than just the
+    job's class) is full; `retry_after` is a guess, in seconds, at when
+    there may be room.'''
+
+    def __init__(self, message, retry_after, saturated=False):
+        Exception.__init__(self, message)
+        self.retry_after = retry_after
+        self.saturated = saturated
+
+class JobClass():
+    '''A kind of job: `cost` is the number of k3 processes a running job
+    occupies, and at most `max_queued` may wait to run.'''
+
+    def __init__(self, name, cost=1, max_queued=16):
+        self.name = name
+        self.cost = cost
+        self.max_queued = max_queued
+        self.avg_runtime = DEFAULT_RUNTIME
+
+class Job():
+    def __init__(self, job_class, fn, args, kwargs, priority, status):
+        self.job_class = job_class
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.status = status
+        self.future = Future()
+        self.started = None
+
+class Scheduler():
+    '''Runs jobs on its own threads within a budget of k3 processes.
+
+    Each job class has a bounded queue; queued jobs run in order of
+    priority (highest first) and then of submission, as soon as their
+    cost fits within what's left of the budget.  While a job waits, its
+    `status` dict has its `queue_position` and an `eta` (seconds until
+    it's expected to start).
+    '''
+
+    def __init__(self, budget, classes, max_queued=None):
+        self.budget = budget
+        self.classes = {X.name: X for X in classes}
+        for job_class in classes:
+            if job_class.cost > budget:
+                raise ValueError("%s jobs cost more than the budget of %d" % (job_class.name, budget))
+        self.max_queued = max_queued if max_queued is not None else sum([X.max_queued for X in classes])
+
+        self._cond = threading.Condition()
+        self._queue = []                # heap of (-priority, seq, job)
+        self._seq = itertools.count()
+        self._n_queued = {X: 0 for X in self.classes}
+        self._running = []
+        self._used = 0
+        self._stopped = False
+
+        # No more jobs can run at once than there are k3 processes
+        self._threads = []
+        for i in range(budget):
+            t = threading.Thread(target=self._work, daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, class_name, fn, *args, priority=0, status=None, **kwargs):
+        '''Queues `fn(*args, **kwargs)`, returning its Job (whose `future`
+        has the result), or raises QueueFull.'''
+        job_class = self.classes[class_name]
+        job = Job(job_class, fn, args, kwargs, priority, status if status is not None else {})
+
+        with self._cond:
+            if self._stopped:
+                raise QueueFull("scheduler has been stopped", None, saturated=True)
+            if len(self._queue) >= self.max_queued:
+                raise QueueFull("all queues are full", self._retry_after(), saturated=True)
+            if self._n_queued[class_name] >= job_class.max_queued:
+                raise QueueFull("%s queue is full" % (class_name), self._retry_after())
+
+            self._n_queued[class_name] += 1
+            heapq.heappush(self._queue, (-priority, next(self._seq), job))
+            self._update_status()
+            self._cond.notify_all()
+        return job
+
+    def cancel(self, job):
+        '''Removes a job that hasn't started yet. Returns True if it was
+        removed.'''
+        with self._cond:
+            for idx, entry in enumerate(self._queue):
+                if entry[2] is job:
+                    self._queue.pop(idx)
+                    heapq.heapify(self._queue)
+                    self._n_queued[job.job_class.name] -= 1
+                    self._update_status()
+                    job.future.cancel()
+                    return True
+        return False
+
+    def stats(self):
+        with self._cond:
+            return {
+                'budget': self.budget,
+                'used': self._used,
+                'running': len(self._running),
+                'queued': dict(self._n_queued),
+            }
+
+    def stop(self):
+        '''Stops taking jobs, and cancels those that haven't started.'''
+        with self._cond:
+            self._stopped = True
+            queue, self._queue = self._queue, []
+            self._cond.notify_all()
+        for _, _, job in queue:
+            job.future.cancel()
+
+    def _next_job(self):
+        # The highest-priority job that fits; lower-priority jobs don't
+        # jump ahead of one that's waiting for room
+        if len(self._queue) > 0:
+            job = self._queue[0][2]
+            if self._used + job.job_class.cost <= self.budget:
+                heapq.heappop(self._queue)
+                return job
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    if self._stopped:
+                        return
+                    self._cond.wait()
+                    job = self._next_job()
+
+                self._n_queued[job.job_class.name] -= 1
+                self._used += job.job_class.cost
+                job.started = time.time()
+                self._running.append(job)
+                for key in ['queue_position', 'eta']:
+                    job.status.pop(key, None)
+                self._update_status()
+
+            if job.future.set_running_or_notify_cancel():
+                try:
+                    job.future.set_result(job.fn(*job.args, **job.kwargs))
+                except BaseException as e:
+                    logging.exception("job failed")
+                    job.future.set_exception(e)
+
+            with self._cond:
+                runtime = time.time() - job.started
+                job_class = job.job_class
+                job_class.avg_runtime += RUNTIME_ALPHA * (runtime - job_class.avg_runtime)
+                self._used -= job_class.cost
+                self._running.remove(job)
+                self._update_status()
+                self._cond.notify_all()
+
+    def _update_status(self):
+        # Estimates when each queued job will start by playing the queue
+        # forward, with every job taking its class's average run time
+        now = time.time()
+        ends = [(max(now, X.started + X.job_class.avg_runtime), X.job_class.cost) for X in self._running]
+        heapq.heapify(ends)
+        used = self._used
+        t = now
+        for position, (_, _, job) in enumerate(sorted(self._queue)):
+            while used + job.job_class.cost > self.budget:
+                t, cost = heapq.heappop(ends)
+                used -= cost
+            used += job.job_class.cost
+            heapq.heappush(ends, (t + job.job_class.avg_runtime, job.job_class.cost))
+            job.status['status'] = 'QUEUED'
+            job.status['queue_position'] = position
+            job.status['eta'] = round(t - now, 1)
+
+    def _retry_after(self):
+        # When the first running job is expected to finish
+        now = time.time()
+        ends = [X.started + X.job_class.avg_runtime - now for X in self._running]
+        return max(1, int(min(ends))) if len(ends) > 0 else 1
@@ -0,0 +1,236 @@
+import logging
+import math
+import threading
+
+from multiprocessing.pool import ThreadPool as Pool
+
+from gentle import audio
+from gentle import diff_align
+from gentle import kaldi_queue
+from gentle import language_model
+from gentle import metasentence
+from gentle import multipass
+from gentle import transcription
+from gentle.forced_aligner import AdjacencyOptimizer
+from gentle.transcriber import MultiThreadedTranscriber
+from gentle.transcription import Transcription
+from gentle.tracing import NULL_TRACER
+
+# Segments shorter than this (in seconds) are too short to decode
+MIN_DURATION = 0.5
+
+def count_occurrences(needle, haystack):
+    count = 0
+    for idx in range(len(haystack) - len(needle) + 1):
+        if haystack[idx:idx+len(needle)] == needle:
+            count += 1
+    return count
+
+class SegmentedAligner():
+    '''Long-form forced alignment by recursive segmentation.
+
+    Rather than building one graph for the whole transcript (which is
+    slow to build and to search for multi-hour recordings), the audio
+    is cut into pieces of about `segment_len` seconds, each of which is
+    aligned against the span of the transcript it's expected to
+    contain (by speaking rate, widened by `margin`).  Runs of at least
+    `anchor_len` consecutively-aligned words are taken as anchors, and
+    the audio and transcript between successive anchors are aligned
+    independently with their own small graphs -- recursively, for
+    segments that are still longer than `segment_len`.  Finally the
+    usual second pass and adjacency optimization are applied.
+
+    Work (and graph size) per segment is bounded, so the total cost is
+    roughly linear in the length of the recording.
+    '''
+
+    def __init__(self, resources, transcript, nthreads=4, pool=None, graph_cache=None,
+                 segment_len=120, anchor_len=5, margin=0.25, max_depth=3, tracer=NULL_TRACER, **kwargs):
+        self.resources = resources
+        self.tracer = tracer
+        self.transcript = transcript
+        self.nthreads = nthreads
+        self.pool = pool
+        self.graph_cache = graph_cache
+        self.segment_len = segment_len
+        self.anchor_len = anchor_len
+        self.margin = margin
+        self.max_depth = max_depth
+        self.kwargs = kwargs
+
+        self.ms = metasentence.MetaSentence(transcript, resources.vocab)
+        self.n_tokens = len(self.ms)
+
+    def transcribe(self, wavfile, progress_cb=None, logging=None):
+        # Every segment reads from the one mapping
+        with audio.opened(wavfile) as source:
+            return self._transcribe(source, progress_cb, logging)
+
+    def _transcribe(self, source, progress_cb, logging):
+        duration = source.duration
+
+        own_pool = self.pool is None
+        pool = kaldi_queue.KaldiPool(self.resources, nworkers=self.nthreads) if own_pool else self.pool
+
+        self._aligned_t = 0
+        self._progress_lock = threading.Lock()
+        try:
+            words = self._align_segment(source, pool, 0, duration, 0, self.n_tokens, 0, duration, progress_cb)
+
+            if logging is not None:
+                logging.info("%d unaligned words (of %d)" % (len([X for X in words if X.not_found_in_audio()]), len(words)))
+
+            if progress_cb is not None:
+                progress_cb({'status': 'ALIGNING'})
+
+            words = multipass.realign(source, words, self.ms, resources=self.resources, nthreads=self.nthreads, progress_cb=progress_cb, pool=pool, graph_cache=self.graph_cache, tracer=self.tracer)
+        finally:
+            if own_pool:
+                pool.stop()
+
+        if logging is not None:
+            logging.info("after 2nd pass: %d unaligned words (of %d)" % (len([X for X in words if X.not_found_in_audio()]), len(words)))
+
+        words = AdjacencyOptimizer(words, duration).optimize()
+
+        return Transcription(words=words, transcript=self.transcript)
+
+    def _align_direct(self, wavfile, pool, start_t, end_t, tok_start, tok_end):
+        '''Aligns tokens [tok_start, tok_end) to the audio between start_t
+        and end_t with a single graph.'''
+        window = self.ms.view(tok_start, tok_end)
+        if tok_start == tok_end:
+            return []
+
+        with self.tracer.span('graph', words=tok_end - tok_start):
+            graph = language_model.make_graph(window.get_kaldi_sequence(), self.resources.proto_langdir, cache=self.graph_cache, **self.kwargs)
+        mtt = MultiThreadedTranscriber(pool.lease(graph), nthreads=1)
+        words, _ = mtt.transcribe(wavfile, start_t=start_t, end_t=end_t, tracer=self.tracer)
+
+        return diff_align.align(words, window, **self.kwargs)
+
+    def _not_found(self, tok_start, tok_end):
+        display_seq = self.ms.get_display_sequence()
+        offsets = self.ms.get_text_offsets()
+        return [transcription.Word(
+                    case=transcription.Word.NOT_FOUND_IN_AUDIO,
+                    startOffset=offsets[i][0],
+                    endOffset=offsets[i][1],
+                    word=display_seq[i])
+                for i in range(tok_start, tok_end)]
+
+    def _find_anchors(self, words, tok_start):
+        '''Returns runs of consecutively-aligned words as (first token,
+        last token, words) tuples.'''
+        anchors = []
+        run = []
+        tok = tok_start
+        for word in words:
+            if word.startOffset is None:
+                # Not in the transcript; doesn't break a run
+                continue
+            if word.success():
+                if len(run) == 0:
+                    run_start = tok
+                run.append(word)
+            else:
+                if len(run) >= self.anchor_len:
+                    anchors.append((run_start, tok - 1, run))
+                run = []
+            tok += 1
+        if len(run) >= self.anchor_len:
+            anchors.append((run_start, tok - 1, run))
+        return anchors
+
+    def _align_segment(self, wavfile, pool, start_t, end_t, tok_start, tok_end, depth, total_t, progress_cb):
+        duration = end_t - start_t
+        n_tokens = tok_end - tok_start
+
+        if n_tokens == 0:
+            return []
+        if duration < MIN_DURATION:
+            return self._not_found(tok_start, tok_end)
+        if duration <= self.segment_len or depth >= self.max_depth:
+            words = self._align_direct(wavfile, pool, start_t, end_t, tok_start, tok_end)
+            self._progress(duration, total_t, progress_cb)
+            return words
+
+        # Look for anchors in each piece, against the part of the
+        # transcript we'd expect it to contain
+        kaldi_seq = self.ms.get_kaldi_sequence()
+        n_pieces = int(math.ceil(duration / self.segment_len))
+        piece_len = duration / n_pieces
+
+        def find_piece_anchors(idx):
+            p_start = start_t + idx * piece_len
+            p_end = p_start + piece_len
+            t_start = tok_start + n_tokens * (p_start - start_t) / duration
+            t_end = tok_start + n_tokens * (p_end - start_t) / duration
+            slack = self.margin * (t_end - t_start) + self.anchor_len
+            w_start = max(tok_start, int(t_start - slack))
+            w_end = min(tok_end, int(math.ceil(t_end + slack)))
+
+            words = self._align_direct(wavfile, pool, p_start, p_end, w_start, w_end)
+            # Words at the edges of the piece may have been cut off (so
+            # they're trimmed from runs), and runs that are repeated in the
+            # window may have been matched to the wrong repetition
+            window_seq = kaldi_seq[w_start:w_end]
+            candidates = []
+            for first_tok, last_tok, run in self._find_anchors(words, w_start):
+                while len(run) > 0 and run[0].start <= p_start + 1:
+                    first_tok, run = first_tok + 1, run[1:]
+                while len(run) > 0 and run[-1].end >= p_end - 1:
+                    last_tok, run = last_tok - 1, run[:-1]
+                if len(run) >= self.anchor_len and count_occurrences(kaldi_seq[first_tok:last_tok+1], window_seq) == 1:
+                    candidates.append((first_tok, last_tok, run))
+            if len(candidates) == 0:
+                return None
+            return max(candidates, key=lambda X: len(X[2]))
+
+        threads = Pool(min(n_pieces, self.nthreads))
+        piece_anchors = threads.map(find_piece_anchors, range(n_pieces))
+        threads.close()
+
+        # Anchors must be in order in both time and transcript
+        anchors = []
+        for anchor in piece_anchors:
+            if anchor is None:
+                continue
+            if len(anchors) > 0 and (anchor[0] <= anchors[-1][1] or anchor[2][0].start < anchors[-1][2][-1].end):
+                continue
+            anchors.append(anchor)
+
+        logging.debug("depth %d: %d anchors in %.1fs-%.1fs" % (depth, len(anchors), start_t, end_t))
+        if len(anchors) == 0:
+            words = self._align_direct(wavfile, pool, start_t, end_t, tok_start, tok_end)
+            self._progress(duration, total_t, progress_cb)
+            return words
+
+        # Align the segments between anchors independently
+        segments = []
+        seg_start_t, seg_tok = start_t, tok_start
+        for first_tok, last_tok, run in anchors:
+            segments.append((seg_start_t, run[0].start, seg_tok, first_tok))
+            seg_start_t, seg_tok = run[-1].end, last_tok + 1
+        segments.append((seg_start_t, end_t, seg_tok, tok_end))
+
+        def align_between(segment):
+            s_start, s_end, t_start, t_end = segment
+            return self._align_segment(wavfile, pool, s_start, s_end, t_start, t_end, depth + 1, total_t, progress_cb)
+
+        threads = Pool(min(len(segments), self.nthreads))
+        between = threads.map(align_between, segments)
+        threads.close()
+
+        words = between[0]
+        for (_, _, run), seg_words in zip(anchors, between[1:]):
+            words = words + run + seg_words
+        return words
+
+    def _progress(self, duration, total_t, progress_cb):
+        if progress_cb is None:
+            return
+        with self._progress_lock:
+            self._aligned_t += duration
+            percent = min(self._aligned_t / total_t, 1.0)
+        progress_cb({"percent": percent})
@@ -0,0 +1,215 @@
+import bisect
+
+# Regions of at most this many cells are aligned with an unconstrained DP
+FULL_DP_CELLS = 250000
+# Otherwise, the DP is confined to this many cells either side of the diagonal
+BAND_WIDTH = 100
+
+class BandedMatcher():
+    '''A drop-in replacement for the parts of difflib.SequenceMatcher
+    that diff_align uses (`get_matching_blocks` and `get_opcodes`).
+
+    Tokens are encoded as integers, then:
+
+    1. common prefixes and suffixes are matched directly;
+    2. tokens that occur exactly once in both sequences are used as
+       anchors (keeping the longest increasing subsequence of them, as in
+       "patience diff"), and the regions between anchors are aligned
+       recursively;
+    3. regions with no unique tokens (e.g. repetitive lyrics) are aligned
+       with a longest-common-subsequence DP, confined to a band around
+       the diagonal when the region is large.
+
+    The result maximizes the number of matched tokens within each region.
+    Unlike SequenceMatcher there's no "autojunk" heuristic, and memory
+    is linear in the length of the inputs.
+    '''
+
+    def __init__(self, a=None, b=None, band_width=BAND_WIDTH, full_dp_cells=FULL_DP_CELLS):
+        self.band_width = band_width
+        self.full_dp_cells = full_dp_cells
+        self.set_seqs(a or [], b or [])
+
+    def set_seqs(self, a, b):
+        self.a = a
+        self.b = b
+        self.matching_blocks = None
+        self.opcodes = None
+
+    def get_matching_blocks(self):
+        '''Returns a list of (i, j, n) triples such that a[i:i+n] == b[j:j+n],
+        increasing in i and j, terminated by (len(a), len(b), 0).'''
+        if self.matching_blocks is not None:
+            return self.matching_blocks
+
+        codes = {}
+        a = [codes.setdefault(X, len(codes)) for X in self.a]
+        b = [codes.setdefault(X, len(codes)) for X in self.b]
+
+        matches = []
+        stack = [(0, len(a), 0, len(b))]
+        while stack:
+            alo, ahi, blo, bhi = stack.pop()
+
+            # Common prefix and suffix
+            while alo < ahi and blo < bhi and a[alo] == b[blo]:
+                matches.append((alo, blo))
+                alo += 1
+                blo += 1
+            while alo < ahi and blo < bhi and a[ahi-1] == b[bhi-1]:
+                ahi -= 1
+                bhi -= 1
+                matches.append((ahi, bhi))
+            if alo == ahi or blo == bhi:
+                continue
+
+            anchors = unique_anchors(a, b, alo, ahi, blo, bhi)
+            if len(anchors) == 0:
+                matches.extend(self._lcs(a, b, alo, ahi, blo, bhi))
+                continue
+
+            prev_i, prev_j = alo, blo
+            for i, j in anchors:
+                matches.append((i, j))
+                stack.append((prev_i, i, prev_j, j))
+                prev_i, prev_j = i + 1, j + 1
+            stack.append((prev_i, ahi, prev_j, bhi))
+
+        matches.sort()
+
+        blocks = []
+        for i, j in matches:
+            if blocks and blocks[-1][0] + blocks[-1][2] == i and blocks[-1][1] + blocks[-1][2] == j:
+                blocks[-1][2] += 1
+            else:
+                blocks.append([i, j, 1])
+        self.matching_blocks = [tuple(X) for X in blocks] + [(len(a), len(b), 0)]
+        return self.matching_blocks
+
+    def get_opcodes(self):
+        '''Same format as difflib.SequenceMatcher.get_opcodes'''
+        if self.opcodes is not None:
+            return self.opcodes
+
+        i = j = 0
+        self.opcodes = answer = []
+        for ai, bj, size in self.get_matching_blocks():
+            tag = ''
+            if i < ai and j < bj:
+                tag = 'replace'
+            elif i < ai:
+                tag = 'delete'
+            elif j < bj:
+                tag = 'insert'
+            if tag:
+                answer.append((tag, i, ai, j, bj))
+            i, j = ai+size, bj+size
+            if size:
+                answer.append(('equal', ai, i, bj, j))
+        return answer
+
+    def _lcs(self, a, b, alo, ahi, blo, bhi):
+        '''Longest common subsequence of a[alo:ahi] and b[blo:bhi] by DP.
+        Returns the matched (i, j) pairs.'''
+        n = ahi - alo
+        m = bhi - blo
+
+        if n * m <= self.full_dp_cells:
+            width = m
+        else:
+            # Wide enough that the bands of successive rows overlap
+            width = max(self.band_width, m // n + 2)
+
+        def band(i):
+            center = (i * m) // n
+            return max(0, center - width), min(m, center + width)
+
+        # Scores for the previous row, over its band [prev_lo, prev_hi]
+        prev_lo, prev_hi = 0, band(0)[1]
+        prev = [0] * (prev_hi - prev_lo + 1)
+        # One traceback row per row of the DP: 1 = match, 2 = skip a, 3 = skip b
+        trace = [None]
+        los = [0]
+        # b[j-1] for column j (column 0 matches nothing)
+        b_cols = [-1] + b[blo:bhi]
+
+        for i in range(1, n + 1):
+            lo, hi = band(i)
+            # The previous row's scores for columns [lo-1, hi], with -1
+            # marking cells outside its band (which can't be reached)
+            ext = ([-1] * max(0, prev_lo - lo + 1) +
+                   prev[max(0, lo - 1 - prev_lo):hi + 1 - prev_lo] +
+                   [-1] * max(0, hi - prev_hi))
+            row = [0] * (hi - lo + 1)
+            back = bytearray(hi - lo + 1)
+            ai = a[alo + i - 1]
+            left = -1 if lo > 0 else 0
+            for k in range(hi - lo + 1):
+                diag = ext[k]
+                if ai == b_cols[lo + k] and diag >= 0:
+                    left = diag + 1
+                    back[k] = 1
+                else:
+                    up = ext[k + 1]
+                    if up >= left:
+                        left = up
+                        back[k] = 2
+                    else:
+                        back[k] = 3
+                row[k] = left
+            trace.append(back)
+            los.append(lo)
+            prev, prev_lo, prev_hi = row, lo, hi
+
+        matches = []
+        i, j = n, m
+        while i > 0 and j > 0:
+            step = trace[i][j - los[i]]
+            if step == 1:
+                matches.append((alo + i - 1, blo + j - 1))
+                i -= 1
+                j -= 1
+            elif step == 2:
+                i -= 1
+            else:
+                j -= 1
+        return matches
+
+def unique_anchors(a, b, alo, ahi, blo, bhi):
+    '''Returns the (i, j) positions of tokens that occur exactly once in
+    a[alo:ahi] and in b[blo:bhi], keeping the longest subsequence that is
+    increasing in both.'''
+    a_pos = {}
+    for i in range(alo, ahi):
+        a_pos[a[i]] = -1 if a[i] in a_pos else i
+    b_pos = {}
+    for j in range(blo, bhi):
+        b_pos[b[j]] = -1 if b[j] in b_pos else j
+
+    pairs = []
+    for token, i in a_pos.items():
+        if i >= 0 and b_pos.get(token, -1) >= 0:
+            pairs.append((i, b_pos[token]))
+    pairs.sort()
+
+    # Longest increasing subsequence (in j) by patience sorting
+    tails = []     # smallest j ending an increasing run of each length
+    tail_idx = []  # ...and the index in `pairs` of that element
+    preds = []
+    for idx, (i, j) in enumerate(pairs):
+        k = bisect.bisect_left(tails, j)
+        if k == len(tails):
+            tails.append(j)
+            tail_idx.append(idx)
+        else:
+            tails[k] = j
+            tail_idx[k] = idx
+        preds.append(tail_idx[k-1] if k > 0 else -1)
+
+    anchors = []
+    idx = tail_idx[-1] if tail_idx else -1
+    while idx >= 0:
+        anchors.append(pairs[idx])
+        idx = preds[idx]
+    anchors.reverse()
+    return anchors
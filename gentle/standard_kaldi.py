@@ -1,63 +1,209 @@
+import array
+import hashlib
+import io
 import subprocess
 import os
+import shutil
+import socket
+import sys
 import logging
+import tempfile
+import threading
+import weakref
 
+from . import metrics
+from .rpc import RPCProtocol
 from .util.paths import get_binary
 
 EXECUTABLE_PATH = get_binary("ext/k3")
+DEFAULT_NNET_DIR = "exp/tdnn_7b_chain_online"
 logger = logging.getLogger(__name__)
 
 STDERR = subprocess.DEVNULL
 
+# Decoders are sessions of one multi-session k3 process (see KaldiServer),
+# sharing its acoustic model and graphs, rather than processes of their own
+SESSIONS = False
+# Decoders are processes forked from a KaldiZygote, which start at once
+ZYGOTE = False
+
+_symbol_tables = {}
+_symbol_tables_lock = threading.Lock()
+
+def load_symbol_table(path):
+    '''Load an OpenFST SymbolTable text file as a list indexed by id.
+    Tables are loaded once per process and shared, and their symbols
+    interned.'''
+    with _symbol_tables_lock:
+        if path not in _symbol_tables:
+            symbols = []
+            with open(path, encoding='utf-8') as fh:
+                for line in fh:
+                    parts = line.split()
+                    if len(parts) != 2:
+                        continue
+                    sym, idx = sys.intern(parts[0]), int(parts[1])
+                    if idx >= len(symbols):
+                        symbols.extend([None] * (idx + 1 - len(symbols)))
+                    symbols[idx] = sym
+            _symbol_tables[path] = symbols
+        return _symbol_tables[path]
+
+def decode_final(body, word_syms, phone_syms):
+    '''Decode the body of a k3 `get-final-bin` reply (see WriteBinaryFinal
+    in ext/k3.cc) into the same word dicts that the text protocol gives.'''
+    counts = array.array('i')
+    counts.frombytes(body[:8])
+    n_words, n_phones = counts
+
+    def column(typecode, offset, count):
+        col = array.array(typecode)
+        col.frombytes(body[offset:offset + 4*count])
+        return col, offset + 4*count
+
+    word_ids, offset = column('i', 8, n_words)
+    starts, offset = column('f', offset, n_words)
+    durations, offset = column('f', offset, n_words)
+    word_phones, offset = column('i', offset, n_words)
+    phone_ids, offset = column('i', offset, n_phones)
+    phone_durations, offset = column('f', offset, n_phones)
+
+    # Times are rounded as they would have been printed by `get-final`
+    words = []
+    p_idx = 0
+    for w_idx in range(n_words):
+        p_end = p_idx + word_phones[w_idx]
+        phones = [{'phone': phone_syms[phone_ids[i]],
+                   'duration': round(phone_durations[i], 6)}
+                  for i in range(p_idx, p_end)]
+        p_idx = p_end
+        words.append({'word': word_syms[word_ids[w_idx]],
+                      'start': round(starts[w_idx], 6),
+                      'duration': round(durations[w_idx], 6),
+                      'phones': phones})
+    return words
+
+def graph_key(graph):
+    '''Identifies an HCLG given either as a path or as the bytes of the
+    FST itself (see `language_model.make_graph`).'''
+    if isinstance(graph, bytes):
+        return hashlib.sha1(graph).hexdigest()
+    return graph
+
+_instances = weakref.WeakSet()
+
+def live_processes():
+    '''The k3 processes that are currently running.'''
+    return [X for X in list(_instances) if not X.finished and X.alive()]
+
+def _total_rss():
+    return sum([metrics.process_rss(X.pid) or 0 for X in live_processes()])
+
+metrics.REGISTRY.register(metrics.Gauge(
+    'gentle_k3_processes', 'Number of running k3 processes',
+    callback=lambda: len(live_processes())))
+metrics.REGISTRY.register(metrics.Gauge(
+    'gentle_k3_rss_bytes', 'Total resident memory of the running k3 processes',
+    callback=_total_rss))
+
+def _k3_args(nnet_dir, hclg_path):
+    args = []
+    if nnet_dir is not None:
+        args.append(nnet_dir)
+        # Without a graph, k3 waits for `load_graph`
+        if hclg_path is not None:
+            args.append(hclg_path)
+    if hclg_path is not None and not os.path.exists(hclg_path):
+        logger.error('hclg_path does not exist: %s', hclg_path)
+    return args
+
 class Kaldi:
+    # (Until a process is attached, there's nothing to stop)
+    finished = True
+
     def __init__(self, nnet_dir=None, hclg_path=None, proto_langdir=None):
-        cmd = [EXECUTABLE_PATH]
-        
-        if nnet_dir is not None:
-            cmd.append(nnet_dir)
-            cmd.append(hclg_path)
-
-        if not os.path.exists(hclg_path):
-            logger.error('hclg_path does not exist: %s', hclg_path)
-        self._p = subprocess.Popen(cmd,
-                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-                                   stderr=STDERR, bufsize=0)
+        p = subprocess.Popen([EXECUTABLE_PATH] + _k3_args(nnet_dir, hclg_path),
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                             stderr=STDERR, bufsize=0)
+        self._attach(p, nnet_dir, hclg_path)
+
+    @classmethod
+    def from_zygote(cls, zygote):
+        '''A decoder forked from `zygote` (a KaldiZygote), with the model
+        (and the zygote's graph) already loaded.'''
+        k = cls.__new__(cls)
+        k._attach(_ForkedProcess(zygote.path), zygote.nnet_dir, zygote.hclg_path)
+        return k
+
+    def _attach(self, p, nnet_dir, hclg_path):
+        self._p = p
+        self.nnet_dir = nnet_dir if nnet_dir is not None else DEFAULT_NNET_DIR
+        # Replies are read through a buffer, so that framed results can be
+        # read in one go (and lines without a syscall per byte)
+        self._stdout = io.BufferedReader(self._p.stdout)
+        self._rpc = RPCProtocol(self._p.stdin, self._stdout)
+        self.graph_key = hclg_path
         self.finished = False
+        # push-chunk requests whose acknowledgement hasn't been read yet
+        self._pending = 0
+        _instances.add(self)
 
-    def _cmd(self, c):
+    def _cmd(self, c, data=None):
         self._p.stdin.write(("%s\n" % (c)).encode())
+        if data is not None:
+            self._p.stdin.write(data)
         self._p.stdin.flush()
 
+    @property
+    def pid(self):
+        return self._p.pid
+
+    def alive(self):
+        return self._p.poll() is None
+
+    def load_graph(self, graph, key=None):
+        '''Switch to decoding against a different HCLG, keeping the acoustic
+        model loaded. `graph` is either a path or the FST itself, as bytes,
+        which is piped to k3 rather than written to disk. Returns True on
+        success.'''
+        if key is None:
+            key = graph_key(graph)
+        if key == self.graph_key:
+            return True
+        self._collect_pending()
+        if isinstance(graph, bytes):
+            self._cmd("load-graph-data %d" % (len(graph)), graph)
+        else:
+            self._cmd("load-graph %s" % (graph))
+        status = self._stdout.readline().strip().decode()
+        self.graph_key = key if status == 'ok' else None
+        return status == 'ok'
+
     def push_chunk(self, buf):
-        # Wait until we're ready
-        self._cmd("push-chunk")
-        
+        '''Queue a chunk of 16-bit PCM for decoding.
+
+        This doesn't wait for k3 to acknowledge the chunk, so several may
+        be in flight while earlier ones are decoded; acknowledgements are
+        collected by the next `get_final`.'''
         cnt = int(len(buf)/2)
-        self._cmd(str(cnt))
-        self._p.stdin.write(buf) #arr.tostring())
-        status = self._p.stdout.readline().strip().decode()
-        return status == 'ok'
+        self._cmd("push-chunk\n%d" % (cnt), buf)
+        self._pending += 1
+
+    def _collect_pending(self):
+        while self._pending > 0:
+            status = self._stdout.readline().strip().decode()
+            self._pending -= 1
+            if status != 'ok':
+                logger.error('k3 rejected a chunk: %r', status)
 
     def get_final(self):
-        self._cmd("get-final")
-        words = []
-        while True:
-            line = self._p.stdout.readline().decode()
-            if line.startswith("done"):
-                break
-            parts = line.split(' / ')
-            if line.startswith('word'):
-                wd = {}
-                wd['word'] = parts[0].split(': ')[1]
-                wd['start'] = float(parts[1].split(': ')[1])
-                wd['duration'] = float(parts[2].split(': ')[1])
-                wd['phones'] = []
-                words.append(wd)
-            elif line.startswith('phone'):
-                ph = {}
-                ph['phone'] = parts[0].split(': ')[1]
-                ph['duration'] = float(parts[1].split(': ')[1])
-                words[-1]['phones'].append(ph)
+        self._collect_pending()
+        self._cmd("get-final-bin")
+        body = self._rpc.read_reply()
+
+        word_syms = load_symbol_table(os.path.join(self.nnet_dir, "graph_pp", "words.txt"))
+        phone_syms = load_symbol_table(os.path.join(self.nnet_dir, "graph_pp", "phones.txt"))
+        words = decode_final(body, word_syms, phone_syms)
 
         self._reset()
         return words
@@ -68,14 +214,336 @@ class Kaldi:
     def stop(self):
         if not self.finished:
             self.finished = True
-            self._cmd("stop")
+            try:
+                self._cmd("stop")
+            except ConnectionError:
+                pass # already exited
+            try:
+                self._p.stdin.close()
+            except ConnectionError:
+                pass # (with the command it couldn't flush)
+            self._p.stdout.close()
+            self._p.wait()
+
+    def __del__(self):
+        self.stop()
+
+class KaldiServer():
+    '''One k3 process in `--sessions` mode, which loads the acoustic model
+    (and the graph it's started with) once and decodes any number of
+    streams, each on a thread of its own, against that one copy.
+
+    Requests are sent over stdin prefixed with their session's id, and
+    a reader thread hands each reply (prefixed in the same way) to its
+    session.'''
+
+    def __init__(self, nnet_dir=None, hclg_path=None):
+        self.nnet_dir = nnet_dir if nnet_dir is not None else DEFAULT_NNET_DIR
+        self.hclg_path = hclg_path
+
+        self._p = subprocess.Popen([EXECUTABLE_PATH, '--sessions'] + _k3_args(nnet_dir, hclg_path),
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=STDERR, bufsize=0)
+        self._stdout = io.BufferedReader(self._p.stdout)
+        self._lock = threading.Lock()
+        self._replies = {}
+        self._next_id = 0
+        self.finished = False
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+        _instances.add(self)
+
+    @property
+    def pid(self):
+        return self._p.pid
+
+    def alive(self):
+        return self._p.poll() is None
+
+    def session(self):
+        '''Starts a session, returned as a KaldiSession.'''
+        with self._lock:
+            session_id = self._next_id
+            self._next_id += 1
+            replies = _Replies()
+            self._replies[session_id] = replies
+        return KaldiSession(self, session_id, replies)
+
+    def sessions(self):
+        with self._lock:
+            return len(self._replies)
+
+    def send(self, session_id, c, data=None):
+        with self._lock:
+            try:
+                self._p.stdin.write(("%d %s\n" % (session_id, c)).encode())
+                if data is not None:
+                    self._p.stdin.write(data)
+                self._p.stdin.flush()
+            except (BrokenPipeError, ValueError):
+                raise IOError("Lost connection with k3")
+
+    def close(self, session_id):
+        with self._lock:
+            replies = self._replies.pop(session_id, None)
+            last = len(self._replies) == 0
+        if replies is not None:
+            replies.close()
+            if self.alive():
+                try:
+                    self.send(session_id, "close")
+                except IOError:
+                    pass
+        return last
+
+    def _read(self):
+        try:
+            while True:
+                header = self._stdout.readline()
+                if not header:
+                    break
+                try:
+                    session_id, size = [int(X) for X in header.split()]
+                except ValueError:
+                    logger.warning("k3 wrote a line that isn't a reply: %r", header)
+                    continue
+                body = self._stdout.read(size)
+                with self._lock:
+                    replies = self._replies.get(session_id)
+                if replies is not None:
+                    replies.feed(body)
+        finally:
+            # k3 has exited (or we can't read it): wake every session
+            # waiting on a reply
+            with self._lock:
+                replies = list(self._replies.values())
+            for X in replies:
+                X.close()
+
+    def stop(self):
+        if not self.finished:
+            self.finished = True
+            try:
+                with self._lock:
+                    self._p.stdin.write(b"stop\n")
+                    self._p.stdin.flush()
+            except (BrokenPipeError, ValueError):
+                pass # already exited
             self._p.stdin.close()
+            self._p.wait()
+            self._reader.join()
             self._p.stdout.close()
+
+    def __del__(self):
+        self.stop()
+
+class _Replies():
+    '''The replies to one session, read like k3's stdout.'''
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._buf = bytearray()
+        self._closed = False
+
+    def feed(self, data):
+        with self._cond:
+            self._buf += data
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _take(self, n):
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        return data
+
+    def read(self, n):
+        with self._cond:
+            while len(self._buf) < n and not self._closed:
+                self._cond.wait()
+            return self._take(n)
+
+    def readline(self):
+        with self._cond:
+            while b'\n' not in self._buf and not self._closed:
+                self._cond.wait()
+            idx = self._buf.find(b'\n')
+            return self._take(idx + 1 if idx >= 0 else len(self._buf))
+
+class KaldiSession(Kaldi):
+    '''A decoder that's a session of a KaldiServer, used just like a
+    Kaldi process of its own.'''
+
+    def __init__(self, server, session_id, replies):
+        self.server = server
+        self.session_id = session_id
+        self.nnet_dir = server.nnet_dir
+        self._stdout = replies
+        self._rpc = RPCProtocol(None, replies)
+        self.graph_key = server.hclg_path
+        self.finished = False
+        self._pending = 0
+
+    def _cmd(self, c, data=None):
+        self.server.send(self.session_id, c, data)
+
+    @property
+    def pid(self):
+        return self.server.pid
+
+    def alive(self):
+        return not self.finished and self.server.alive()
+
+    def stop(self):
+        if not self.finished:
+            self.finished = True
+            _release_session(self)
+
+class KaldiZygote():
+    '''A k3 process (in `--zygote` mode) that loads the model, and the
+    graph it's started with, once, and forks a decoder for each
+    connection to its Unix socket.  The decoders (see `Kaldi.from_zygote`)
+    are ready in milliseconds, and share the model's pages copy-on-write.
+    It exits along with this process.'''
+
+    def __init__(self, nnet_dir=None, hclg_path=None):
+        self.nnet_dir = nnet_dir if nnet_dir is not None else DEFAULT_NNET_DIR
+        self.hclg_path = hclg_path
+        self._dir = tempfile.mkdtemp(prefix='k3-')
+        self.path = os.path.join(self._dir, 'zygote')
+
+        self._p = subprocess.Popen([EXECUTABLE_PATH, '--zygote', self.path] + _k3_args(nnet_dir, hclg_path),
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=STDERR, bufsize=0)
+        self.finished = False
+        # Once it's said so, the model is loaded
+        if self._p.stdout.readline().strip() != b'ready':
+            self.stop()
+            raise RuntimeError("k3 zygote failed to start")
+        _instances.add(self)
+
+    @property
+    def pid(self):
+        return self._p.pid
+
+    def alive(self):
+        return self._p.poll() is None
+
+    def fork(self):
+        return Kaldi.from_zygote(self)
+
+    def stop(self):
+        if not self.finished:
+            self.finished = True
+            # (Closing its stdin is what stops it)
+            self._p.stdin.close()
             self._p.wait()
+            self._p.stdout.close()
+            shutil.rmtree(self._dir, ignore_errors=True)
 
     def __del__(self):
         self.stop()
 
+class _ForkedProcess():
+    '''Stands in for the Popen of a k3 process forked by a zygote (which
+    isn't our child), talking over a connection to the zygote.'''
+
+    def __init__(self, path):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.connect(path)
+        except OSError:
+            self._sock.close()
+            raise
+        self.stdin = self._sock.makefile('wb')
+        self.stdout = self._sock.makefile('rb', buffering=0)
+        # The child's first line is `ready PID` (read a byte at a time,
+        # so that nothing after it is taken from the reader)
+        line = b''
+        while not line.endswith(b'\n'):
+            c = self.stdout.read(1)
+            if not c:
+                self.stdin.close()
+                self.stdout.close()
+                self._sock.close()
+                raise RuntimeError("k3 zygote failed to fork")
+            line += c
+        self.pid = int(line.split()[1])
+        self.returncode = None
+
+    def poll(self):
+        # The child isn't ours to wait for (and its pid may since have
+        # been reused), so it's taken to have exited once its end of the
+        # connection is closed
+        if self.returncode is None:
+            try:
+                if self._sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b'':
+                    self.returncode = 0
+            except BlockingIOError:
+                pass # running, with nothing to say
+            except (OSError, ValueError):
+                self.returncode = 0 # reset, or closed by us
+        return self.returncode
+
+    def wait(self, timeout=5):
+        if self.returncode is None:
+            try:
+                # (k3 exits at the end of its stdin)
+                self._sock.shutdown(socket.SHUT_WR)
+                self._sock.settimeout(timeout)
+                while self._sock.recv(65536):
+                    pass # replies no one is reading
+                self.returncode = 0
+            except socket.timeout:
+                pass
+            except OSError:
+                self.returncode = 0
+        self._sock.close()
+        return self.returncode
+
+_servers = {}
+_servers_lock = threading.Lock()
+_zygotes = {}
+
+def _release_session(session):
+    with _servers_lock:
+        last = session.server.close(session.session_id)
+        key = (session.server.nnet_dir, session.server.hclg_path)
+        if last and _servers.get(key) is session.server:
+            # (As with processes, nothing stays loaded once every decoder
+            # has been stopped)
+            del _servers[key]
+            session.server.stop()
+
+def new_decoder(nnet_dir=None, hclg_path=None, proto_langdir=None):
+    '''A Kaldi process; with SESSIONS, a session of the KaldiServer for
+    `nnet_dir` and `hclg_path`; or with ZYGOTE, a process forked from
+    their KaldiZygote.  (Servers and zygotes are started if need be.)'''
+    if ZYGOTE and not SESSIONS:
+        with _servers_lock:
+            key = (nnet_dir if nnet_dir is not None else DEFAULT_NNET_DIR, hclg_path)
+            zygote = _zygotes.get(key)
+            if zygote is None or not zygote.alive():
+                if zygote is not None:
+                    zygote.stop()
+                zygote = KaldiZygote(nnet_dir, hclg_path)
+                _zygotes[key] = zygote
+        return Kaldi.from_zygote(zygote)
+    if not SESSIONS:
+        return Kaldi(nnet_dir, hclg_path, proto_langdir)
+    with _servers_lock:
+        key = (nnet_dir if nnet_dir is not None else DEFAULT_NNET_DIR, hclg_path)
+        server = _servers.get(key)
+        if server is None or not server.alive():
+            if server is not None:
+                server.stop()
+            server = KaldiServer(nnet_dir, hclg_path)
+            _servers[key] = server
+        return server.session()
+
 if __name__=='__main__':
     import numm3
     import sys
@@ -0,0 +1,156 @@
+import logging
+
+from gentle import diff_align
+from gentle import kaldi_queue
+from gentle import language_model
+from gentle import metasentence
+from gentle import transcription
+
+SAMPLE_RATE = 8000
+
+class StreamingAligner():
+    '''Aligns a transcript to audio that arrives incrementally.
+
+    Feed 8K 16-bit mono PCM with `feed`, which returns the words whose
+    alignment has become final; `finish` flushes the rest.  Only the
+    audio since the last finalized word and a window of `window`
+    transcript tokens are kept, so memory doesn't grow with the length
+    of the recording.
+
+    Each step decodes up to `chunk_len` seconds against a graph built
+    from the current transcript window, diffs the result against that
+    window, and finalizes words up to the last match that ended before
+    the final `overlap_t` seconds of the chunk.  The next step starts
+    from the end of that word.
+    '''
+
+    def __init__(self, resources, transcript, pool=None, graph_cache=None, chunk_len=20, overlap_t=2, window=200, **kwargs):
+        self.resources = resources
+        self.kwargs = kwargs
+        self.chunk_len = chunk_len
+        self.overlap_t = overlap_t
+        self.window = window
+        self.graph_cache = graph_cache
+
+        self.ms = metasentence.MetaSentence(transcript, resources.vocab)
+        self.n_tokens = len(self.ms)
+
+        self.own_pool = pool is None
+        self.pool = kaldi_queue.KaldiPool(resources, nworkers=1) if pool is None else pool
+
+        self._buf = bytearray()
+        self._buf_start = 0.0 # time of the first sample in _buf
+        self._cursor = 0      # first transcript token not yet finalized
+        self._graph = None
+        self._graph_cursor = None
+
+    def feed(self, pcm):
+        '''Adds audio, returning a list of newly-finalized Words.'''
+        self._buf.extend(pcm)
+        words = []
+        while len(self._buf) >= self._chunk_bytes():
+            words.extend(self._step(final=False))
+        return words
+
+    def finish(self):
+        '''Aligns the remaining audio, returning the remaining Words
+        (including any transcript words that weren't heard).'''
+        words = []
+        while len(self._buf) > self._chunk_bytes():
+            words.extend(self._step(final=False))
+        if self._cursor < self.n_tokens and len(self._buf) > 0:
+            words.extend(self._step(final=True))
+        words.extend(self._not_found(self._cursor, self.n_tokens))
+        self._cursor = self.n_tokens
+
+        self._graph = None
+        if self.own_pool:
+            self.pool.stop()
+        return words
+
+    def stream(self, pcm_chunks):
+        '''Generator over finalized Words for an iterable of PCM buffers.'''
+        for pcm in pcm_chunks:
+            for word in self.feed(pcm):
+                yield word
+        for word in self.finish():
+            yield word
+
+    def _chunk_bytes(self):
+        return int(self.chunk_len * SAMPLE_RATE) * 2
+
+    def _not_found(self, start, end):
+        display_seq = self.ms.get_display_sequence()
+        offsets = self.ms.get_text_offsets()
+        return [transcription.Word(
+                    case=transcription.Word.NOT_FOUND_IN_AUDIO,
+                    startOffset=offsets[i][0],
+                    endOffset=offsets[i][1],
+                    word=display_seq[i])
+                for i in range(start, end)]
+
+    def _window(self):
+        if self._graph_cursor != self._cursor:
+            self._tw = self.ms.view(self._cursor, min(self._cursor + self.window, self.n_tokens))
+            self._graph = language_model.make_graph(
+                self._tw.get_kaldi_sequence(), self.resources.proto_langdir,
+                cache=self.graph_cache, **self.kwargs)
+            self._graph_cursor = self._cursor
+        return self._tw
+
+    def _advance_audio(self, t):
+        n_bytes = min(int((t - self._buf_start) * SAMPLE_RATE) * 2, len(self._buf))
+        del self._buf[:n_bytes]
+        self._buf_start += n_bytes / 2.0 / SAMPLE_RATE
+
+    def _step(self, final):
+        tw = self._window()
+        chunk_end = self._buf_start + self.chunk_len
+
+        k = self.pool.get(self._graph)
+        with memoryview(self._buf) as view:
+            k.push_chunk(view[:self._chunk_bytes()])
+        hypothesis = k.get_final()
+        self.pool.put(k)
+
+        hyp_words = [transcription.Word(**wd).shift(time=self._buf_start) for wd in hypothesis]
+        aligned = diff_align.align(hyp_words, tw, **self.kwargs)
+
+        if final:
+            self._advance_audio(chunk_end)
+            self._cursor = tw.end
+            return aligned
+
+        # Words near the end of the chunk may have been cut off, so only
+        # keep those up to the last match that ends before the overlap.
+        last = None
+        for idx, word in enumerate(aligned):
+            if word.success() and word.end <= chunk_end - self.overlap_t:
+                last = idx
+        if last is None:
+            logging.debug('no stable words in %.1fs chunk at %.1fs', self.chunk_len, self._buf_start)
+            self._advance_audio(chunk_end - self.overlap_t)
+            return []
+
+        committed = aligned[:last+1]
+        self._cursor += len([X for X in committed if X.startOffset is not None])
+        self._advance_audio(committed[-1].end)
+        return committed
+
+if __name__=='__main__':
+    import sys
+    import wave
+
+    import gentle
+
+    logging.getLogger().setLevel('INFO')
+
+    resources = gentle.Resources()
+    with open(sys.argv[2], encoding='utf-8') as fh:
+        aligner = StreamingAligner(resources, fh.read())
+
+    with gentle.resampled(sys.argv[1]) as filename:
+        wav_obj = wave.open(filename, 'rb')
+        buffers = iter(lambda: wav_obj.readframes(SAMPLE_RATE), b'')
+        for word in aligner.stream(buffers):
+            print(word)
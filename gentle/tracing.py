@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+import time
+
+class Span():
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def set(self, **kwargs):
+        '''Adds to the arguments shown with the span.'''
+        self.args.update(kwargs)
+
+class Tracer():
+    '''Records the spans of one job, as Chrome trace events (which can be
+    loaded in chrome://tracing or Perfetto).
+
+        with tracer.span('decode', chunk=3) as span:
+            ...
+            span.set(worker=pid)
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._tids = {}
+        self.start = time.time()
+
+    def span(self, name, **args):
+        return _ActiveSpan(self, Span(name, args))
+
+    def _tid(self):
+        ident = threading.get_ident()
+        if ident not in self._tids:
+            self._tids[ident] = len(self._tids) + 1
+            self._events.append({
+                'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': self._tids[ident],
+                'args': {'name': threading.current_thread().name}})
+        return self._tids[ident]
+
+    def _record(self, span, start, end):
+        with self._lock:
+            self._events.append({
+                'name': span.name,
+                'ph': 'X',
+                'ts': round((start - self.start) * 1e6),
+                'dur': round((end - start) * 1e6),
+                'pid': os.getpid(),
+                'tid': self._tid(),
+                'args': span.args,
+            })
+
+    def to_json(self):
+        with self._lock:
+            events = sorted(self._events, key=lambda X: X.get('ts', -1))
+        return json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'})
+
+    def write(self, path):
+        with open(path, 'w') as fh:
+            fh.write(self.to_json())
+
+class _ActiveSpan():
+    def __init__(self, tracer, span):
+        self.tracer = tracer
+        self.span = span
+
+    def __enter__(self):
+        self.start = time.time()
+        return self.span
+
+    def __exit__(self, *exc):
+        self.tracer._record(self.span, self.start, time.time())
+
+class _NullSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def set(self, **kwargs):
+        pass
+
+class NullTracer():
+    '''Stands in for a Tracer when tracing is off: spans cost a method
+    call and record nothing.'''
+
+    _span = _NullSpan()
+
+    def span(self, name, **args):
+        return self._span
+
+NULL_TRACER = NullTracer()
@@ -1,93 +1,194 @@
 import math
 import logging
-import wave
+import threading
+import time
 
+from gentle import audio
+from gentle import metrics
 from gentle import transcription
+from gentle import vad
+from gentle.tracing import NULL_TRACER
 
 from multiprocessing.pool import ThreadPool as Pool
 
+SKIPPED_SECONDS = metrics.REGISTRY.register(metrics.Counter(
+    'gentle_skipped_audio_seconds',
+    'Audio that was not decoded because it had no speech'))
+
+# Seconds between partial results (see `collect`)
+PARTIAL_INTERVAL = 5.0
+
+def collect(words, partial_cb=None, interval=None):
+    '''Lists the words yielded by `MultiThreadedTranscriber.iter_words`,
+    passing those so far to `partial_cb` every `interval` seconds.'''
+    if interval is None:
+        interval = PARTIAL_INTERVAL
+    ret = []
+    last = time.time()
+    for word in words:
+        ret.append(word)
+        if partial_cb is not None and time.time() - last >= interval:
+            partial_cb(list(ret))
+            last = time.time()
+    return ret
+
 class MultiThreadedTranscriber:
-    def __init__(self, kaldi_queue, chunk_len=20, overlap_t=2, nthreads=4):
+    def __init__(self, kaldi_queue, chunk_len=20, overlap_t=2, nthreads=4, vad=True):
         self.chunk_len = chunk_len
         self.overlap_t = overlap_t
         self.nthreads = nthreads
+        # Cut chunks at pauses, and skip silence, rather than every
+        # chunk_len - overlap_t seconds
+        self.vad = vad
             
         self.kaldi_queue = kaldi_queue
 
-    def transcribe(self, wavfile, progress_cb=None):
-        wav_obj = wave.open(wavfile, 'rb')
-        duration = wav_obj.getnframes() / float(wav_obj.getframerate())
-        n_chunks = int(math.ceil(duration / float(self.chunk_len - self.overlap_t)))
-
-        chunks = []
+    def transcribe(self, wavfile, progress_cb=None, start_t=0, end_t=None, tracer=NULL_TRACER, checkpoint=None):
+        '''Transcribes `wavfile` (a path or an AudioSource), or the part of
+        it between `start_t` and `end_t`.  Returns the words, with times
+        relative to the start of the file, and the duration transcribed.
+
+        With a `checkpoint` (see gentle.checkpoint), chunks decoded before
+        aren't decoded again, and new ones are saved there.'''
+        if end_t is None:
+            with audio.opened(wavfile) as source:
+                end_t = source.duration
+        words = list(self.iter_words(wavfile, progress_cb=progress_cb, start_t=start_t, end_t=end_t, tracer=tracer, checkpoint=checkpoint))
+        return words, end_t - start_t
+
+    def iter_words(self, wavfile, progress_cb=None, start_t=0, end_t=None, tracer=NULL_TRACER, checkpoint=None):
+        '''Like `transcribe`, but yields the words in order of time as
+        soon as they're settled, which is once the chunk they're in and
+        the chunk before it have been decoded.'''
+        with audio.opened(wavfile) as source:
+            for word in self._iter_words(source, progress_cb, start_t, end_t, tracer, checkpoint):
+                yield word
+
+    def plan(self, source, start_t, end_t):
+        '''Returns the chunks to decode, as (start, end, overlaps_previous,
+        overlaps_next), and the seconds of silence left out.'''
+        if not self.vad:
+            step = self.chunk_len - self.overlap_t
+            n_chunks = int(math.ceil((end_t - start_t) / float(step)))
+            return [(start_t + idx * step,
+                     min(start_t + idx * step + self.chunk_len, end_t),
+                     idx > 0,
+                     idx < n_chunks - 1) for idx in range(n_chunks)], 0
+
+        with metrics.stage('vad'):
+            silent = vad.silent_frames(source.slice(start_t, end_t - start_t), source.rate)
+            chunks, skipped = vad.plan_chunks(silent,
+                                              int(self.chunk_len / vad.FRAME_T),
+                                              int(self.overlap_t / vad.FRAME_T))
+        # The last frame may be partial
+        to_t = lambda frame: min(start_t + frame * vad.FRAME_T, end_t) if frame < len(silent) else end_t
+        return [(to_t(start), to_t(end)) + tuple(overlaps) for start, end, *overlaps in chunks], skipped * vad.FRAME_T
+
+    def _iter_words(self, source, progress_cb, start_t, end_t, tracer, checkpoint):
+        if end_t is None:
+            end_t = source.duration
+        duration = end_t - start_t
+
+        with tracer.span('plan') as span:
+            plan, skipped = self.plan(source, start_t, end_t)
+            span.set(chunks=len(plan), skipped=skipped)
+        n_chunks = len(plan)
+        if skipped > 0:
+            SKIPPED_SECONDS.inc(skipped)
+            logging.info('skipping %.1fs of silence (of %.1fs)' % (skipped, duration))
+            if progress_cb is not None:
+                progress_cb({"skipped": round(skipped, 2)})
+        if n_chunks == 0:
+            return
 
+        lock = threading.Lock()
+        n_done = [0]
 
         def transcribe_chunk(idx):
-            wav_obj = wave.open(wavfile, 'rb')
-            start_t = idx * (self.chunk_len - self.overlap_t)
-            # Seek
-            wav_obj.setpos(int(start_t * wav_obj.getframerate()))
-            # Read frames
-            buf = wav_obj.readframes(int(self.chunk_len * wav_obj.getframerate()))
+            chunk_start, chunk_end, overlaps_prev, overlaps_next = plan[idx]
+            n_frames = min(int(self.chunk_len * source.rate),
+                           int(round((chunk_end - chunk_start) * source.rate)))
+            buf = source.frames(int(chunk_start * source.rate), n_frames)
+            key = '%r-%r' % (chunk_start, chunk_end)
 
             if len(buf) < 4000:
                 logging.info('Short segment - ignored %d' % (idx))
                 ret = []
+            elif checkpoint is not None and checkpoint.get('chunks', key) is not None:
+                ret = checkpoint.get('chunks', key)
             else:
-                k = self.kaldi_queue.get()
-                k.push_chunk(buf)
-                ret = k.get_final()
-                # k.reset() (no longer needed)
-                self.kaldi_queue.put(k)
-
-            chunks.append({"start": start_t, "words": ret})
-            logging.info('%d/%d' % (len(chunks), n_chunks))
-            if progress_cb is not None:
-                progress_cb({"message": ' '.join([X['word'] for X in ret]),
-                             "percent": len(chunks) / float(n_chunks)})
-
+                with tracer.span('chunk', idx=idx, start=chunk_start) as span:
+                    t0 = time.time()
+                    k = self.kaldi_queue.get()
+                    span.set(worker=k.pid, wait=time.time() - t0)
+                    with metrics.stage('decode_chunk'):
+                        k.push_chunk(buf)
+                        ret = k.get_final()
+                    # k.reset() (no longer needed)
+                    self.kaldi_queue.put(k)
+                if checkpoint is not None:
+                    checkpoint.put('chunks', key, ret)
+
+            with lock:
+                n_done[0] += 1
+                logging.info('%d/%d' % (n_done[0], n_chunks))
+                if progress_cb is not None:
+                    progress_cb({"message": ' '.join([X['word'] for X in ret]),
+                                 "percent": n_done[0] / float(n_chunks)})
+            return ret
 
         pool = Pool(min(n_chunks, self.nthreads))
-        pool.map(transcribe_chunk, range(n_chunks))
-        pool.close()
-        
-        chunks.sort(key=lambda x: x['start'])
-
-        # Combine chunks
-        words = []
-        for c in chunks:
-            chunk_start = c['start']
-            chunk_end = chunk_start + self.chunk_len
-
-            chunk_words = [transcription.Word(**wd).shift(time=chunk_start) for wd in c['words']]
-
-            # At chunk boundary cut points the audio often contains part of a
-            # word, which can get erroneously identified as one or more different
-            # in-vocabulary words.  So discard one or more words near the cut points
-            # (they'll be covered by the ovlerap anyway).
-            #
-            trim = min(0.25 * self.overlap_t, 0.5)
-            if c is not chunks[0]:
-                while len(chunk_words) > 1:
-                    chunk_words.pop(0)
-                    if chunk_words[0].end > chunk_start + trim:
-                        break
-            if c is not chunks[-1]:
-                while len(chunk_words) > 1:
-                    chunk_words.pop()
-                    if chunk_words[-1].start < chunk_end - trim:
-                        break
-
-            words.extend(chunk_words)
-
-        # Remove overlap:  Sort by time, then filter out any Word entries in
-        # the list that are adjacent to another entry corresponding to the same
-        # word in the audio.
-        words.sort(key=lambda word: word.start)
-        words.append(transcription.Word(word="__dummy__"))
-        words = [words[i] for i in range(len(words)-1) if not words[i].corresponds(words[i+1])]
-
-        return words, duration
+        try:
+            # Chunks come back in order, each as soon as it and those
+            # before it are done
+            held = []
+            for idx, ret in enumerate(pool.imap(transcribe_chunk, range(n_chunks))):
+                held.extend(self._trim(plan[idx], ret))
+                held.sort(key=lambda word: word.start)
+
+                # Later chunks only have words from where the next one
+                # starts, so words before that are in their final order;
+                # the last of them is held back until its successor is
+                # known, to see whether it's a duplicate.
+                boundary = plan[idx + 1][0] if idx + 1 < n_chunks else None
+                n_ready = len(held) if boundary is None else len([X for X in held if X.start < boundary])
+                for word in self._dedup(held[:n_ready]):
+                    yield word
+                held = held[max(0, n_ready - 1):] if n_ready > 0 else held
+            for word in held[-1:]:
+                yield word
+        finally:
+            pool.close()
+
+    def _trim(self, chunk, ret):
+        chunk_start, chunk_end, overlaps_prev, overlaps_next = chunk
+        chunk_words = [transcription.Word(**wd).shift(time=chunk_start) for wd in ret]
+
+        # At chunk boundary cut points the audio often contains part of a
+        # word, which can get erroneously identified as one or more different
+        # in-vocabulary words.  So discard one or more words near the cut points
+        # (they'll be covered by the ovlerap anyway).  Chunks cut in a pause
+        # don't overlap, and aren't trimmed.
+        #
+        trim = min(0.25 * self.overlap_t, 0.5)
+        if overlaps_prev:
+            while len(chunk_words) > 1:
+                chunk_words.pop(0)
+                if chunk_words[0].end > chunk_start + trim:
+                    break
+        if overlaps_next:
+            while len(chunk_words) > 1:
+                chunk_words.pop()
+                if chunk_words[-1].start < chunk_end - trim:
+                    break
+        return chunk_words
+
+    @staticmethod
+    def _dedup(words):
+        # Remove overlap: drop any word that's adjacent to another
+        # corresponding to the same word in the audio (the last word is
+        # left to the caller)
+        return [words[i] for i in range(len(words) - 1) if not words[i].corresponds(words[i+1])]
 
 
 if __name__=='__main__':
@@ -1,6 +1,9 @@
+import array
 import csv
 import io
 import json
+import math
+import sys
 
 from collections import defaultdict
 
@@ -10,6 +13,10 @@ class Word:
     NOT_FOUND_IN_AUDIO = 'not-found-in-audio'
     NOT_FOUND_IN_TRANSCRIPT = 'not-found-in-transcript'
 
+    # Long jobs hold a great many words, so they have no __dict__; this is
+    # also the order of their keys in as_dict()
+    __slots__ = ('case', 'startOffset', 'endOffset', 'word', 'alignedWord', 'phones', 'start', 'duration', 'end')
+
     def __init__(self, case=None, startOffset=None, endOffset=None, word=None, alignedWord=None, phones=None, start=None, end=None, duration=None):
         self.case = case
         self.startOffset = startOffset
@@ -33,10 +40,15 @@ class Word:
         return self.case == Word.NOT_FOUND_IN_AUDIO
 
     def as_dict(self, without=None):
-        return { key:val for key, val in self.__dict__.items() if (val is not None) and (key != without)}
+        ret = {}
+        for key in Word.__slots__:
+            val = getattr(self, key)
+            if (val is not None) and (key != without):
+                ret[key] = val
+        return ret
 
     def __eq__(self, other):
-        return self.__dict__ == other.__dict__
+        return all([getattr(self, X) == getattr(other, X) for X in Word.__slots__])
 
     def __ne__(self, other):
         return not self == other
@@ -80,6 +92,17 @@ class Transcription:
 
     def to_json(self, **kwargs):
         '''Return a JSON representation of the aligned transcript'''
+        return ''.join(self.iter_json(**kwargs))
+
+    def write_json(self, fh, **kwargs):
+        '''Writes the JSON representation to a file, a word at a time.'''
+        for chunk in self.iter_json(**kwargs):
+            fh.write(chunk)
+
+    def iter_json(self, **kwargs):
+        '''Yields the JSON representation in pieces (one per word), without
+        building the whole document.  Joined, they are exactly what
+        `json.dumps` gives for the transcript and a list of word dicts.'''
         options = {
                 'sort_keys':    True,
                 'indent':       4,
@@ -87,12 +110,41 @@ class Transcription:
                 }
         options.update(kwargs)
 
-        container = {}
+        indent = options.get('indent')
+        if isinstance(indent, int):
+            indent = ' ' * indent
+        separators = options.get('separators')
+        if separators is None:
+            separators = (', ', ': ') if indent is None else (',', ': ')
+        item_sep, key_sep = separators
+
+        def newline(level):
+            return '' if indent is None else '\n' + indent * level
+
+        def dumps(value, level):
+            # Strings are escaped, so any newline is from the indentation
+            return json.dumps(value, **options).replace('\n', newline(level))
+
+        items = []
         if self.transcript:
-            container['transcript'] = self.transcript
-        if self.words: 
-            container['words'] = [word.as_dict(without="duration") for word in self.words]
-        return json.dumps(container, **options)
+            items.append('transcript')
+        if self.words:
+            items.append('words')
+        if len(items) == 0:
+            yield '{}'
+            return
+
+        yield '{'
+        for idx, key in enumerate(items):
+            yield (item_sep if idx > 0 else '') + newline(1) + json.dumps(key) + key_sep
+            if key == 'transcript':
+                yield dumps(self.transcript, 1)
+            else:
+                yield '['
+                for w_idx, word in enumerate(self.words):
+                    yield (item_sep if w_idx > 0 else '') + newline(2) + dumps(word.as_dict(without="duration"), 2)
+                yield newline(1) + ']'
+        yield newline(0) + '}'
 
     @classmethod
     def from_json(cls, json_str):
@@ -105,16 +157,21 @@ class Transcription:
 
     @classmethod
     def _from_jsondata(cls, data):
-        return cls(transcript = data['transcript'], words = [Word(**wd) for wd in data['words']])
+        return cls(transcript = data['transcript'], words = [_intern_word(Word(**wd)) for wd in data['words']])
 
     def to_csv(self):
         '''Return a CSV representation of the aligned transcript. Format:
         <word> <token> <start seconds> <end seconds>
         '''
-        if not self.words:
-            return ''
         buf = io.StringIO()
-        w = csv.writer(buf)
+        self.write_csv(buf)
+        return buf.getvalue()
+
+    def write_csv(self, fh):
+        '''Writes the CSV representation to a file, a row at a time.'''
+        if not self.words:
+            return
+        w = csv.writer(fh)
         for X in self.words:
             if X.case not in (Word.SUCCESS, Word.NOT_FOUND_IN_AUDIO):
                 continue
@@ -124,7 +181,6 @@ class Transcription:
                 X.end
             ]
             w.writerow(row)
-        return buf.getvalue()
 
     def stats(self):
         counts = defaultdict(int)
@@ -136,4 +192,137 @@ class Transcription:
             stats[key] = val
         return stats
 
+def _intern_word(word):
+    # Aligned words and phones come from small vocabularies
+    if word.alignedWord is not None:
+        word.alignedWord = sys.intern(word.alignedWord)
+    if word.phones:
+        for phone in word.phones:
+            phone['phone'] = sys.intern(phone['phone'])
+    return word
+
+CASES = (None, Word.SUCCESS, Word.NOT_FOUND_IN_AUDIO, Word.NOT_FOUND_IN_TRANSCRIPT)
+_CASE_IDS = {X: idx for idx, X in enumerate(CASES)}
+
+class ColumnarTranscription(Transcription):
+    '''A Transcription that holds its words as columns (arrays of times,
+    offsets and cases, and of phone symbols and durations) rather than
+    as a Word object and a dict per phone, for long jobs.
+
+    It's read-only: `words` is a sequence that builds each Word when it's
+    accessed.  Times are stored as floats.
+    '''
+
+    def __init__(self, transcript=None, words=None):
+        self.transcript = transcript
+        self._none = words is None
+        self._case = array.array('b')
+        self._start_offset = array.array('q')
+        self._end_offset = array.array('q')
+        self._start = array.array('d')
+        self._duration = array.array('d')
+        self._end = array.array('d')
+        # Only where the word isn't just its span of the transcript
+        self._word = []
+        self._aligned = []
+        self._phone_start = array.array('q', [0])
+        self._phone_count = array.array('q')
+        self._phone_sym = array.array('I')
+        self._phone_dur = array.array('d')
+        self._symbols = []
+        self._symbol_ids = {}
+        for word in words or []:
+            self._append(word)
+
+    @classmethod
+    def from_transcription(cls, trans):
+        return cls(trans.transcript, trans.words)
+
+    def _append(self, word):
+        self._case.append(_CASE_IDS[word.case])
+        self._start_offset.append(-1 if word.startOffset is None else word.startOffset)
+        self._end_offset.append(-1 if word.endOffset is None else word.endOffset)
+        for col, value in [(self._start, word.start), (self._duration, word.duration), (self._end, word.end)]:
+            col.append(math.nan if value is None else value)
+        if word.startOffset is not None and self.transcript is not None \
+           and word.word == self.transcript[word.startOffset:word.endOffset]:
+            self._word.append(None)
+        else:
+            self._word.append(word.word)
+        self._aligned.append(None if word.alignedWord is None else sys.intern(word.alignedWord))
+
+        phones = word.phones if word.phones is not None else []
+        self._phone_count.append(-1 if word.phones is None else len(phones))
+        for phone in phones:
+            sym = phone['phone']
+            if sym not in self._symbol_ids:
+                self._symbol_ids[sym] = len(self._symbols)
+                self._symbols.append(sys.intern(sym))
+            self._phone_sym.append(self._symbol_ids[sym])
+            self._phone_dur.append(phone['duration'])
+        self._phone_start.append(len(self._phone_sym))
+
+    @property
+    def words(self):
+        return None if self._none else _WordColumns(self)
+
+    def word(self, idx):
+        if idx < 0:
+            idx += len(self._case)
+        if not 0 <= idx < len(self._case):
+            raise IndexError("word index out of range")
+
+        def offset(col):
+            return col[idx] if col[idx] >= 0 else None
+
+        def time(col):
+            return col[idx] if not math.isnan(col[idx]) else None
+
+        start_offset = offset(self._start_offset)
+        end_offset = offset(self._end_offset)
+        word = self._word[idx]
+        if word is None:
+            word = self.transcript[start_offset:end_offset]
+        phones = None
+        if self._phone_count[idx] >= 0:
+            phones = [{'phone': self._symbols[self._phone_sym[X]], 'duration': self._phone_dur[X]}
+                      for X in range(self._phone_start[idx], self._phone_start[idx + 1])]
+        return Word(case=CASES[self._case[idx]],
+                    startOffset=start_offset,
+                    endOffset=end_offset,
+                    word=word,
+                    alignedWord=self._aligned[idx],
+                    phones=phones,
+                    start=time(self._start),
+                    end=time(self._end),
+                    duration=time(self._duration))
+
+    def stats(self):
+        stats = {'total': len(self._case)}
+        for case_id in set(self._case):
+            stats[CASES[case_id]] = self._case.count(case_id)
+        return stats
+
+class _WordColumns():
+    def __init__(self, trans):
+        self._trans = trans
+
+    def __len__(self):
+        return len(self._trans._case)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._trans.word(X) for X in range(*idx.indices(len(self)))]
+        return self._trans.word(idx)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self._trans.word(idx)
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
 Transcription.Word = Word
@@ -0,0 +1,132 @@
+'''Finds pauses and silence by frame energy, so that audio can be cut into
+chunks between words, and stretches with no speech left undecoded.
+
+Uses numpy when it's installed, and plain Python (slower, but fine for
+an hour of 8K audio) otherwise.'''
+import array
+import bisect
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FRAME_T = 0.02
+# A frame is silent at or below DIGITAL_SILENCE (in mean absolute
+# amplitude), or below both NOISE_MARGIN times the noise floor and
+# QUIET_FRACTION of the level of speech -- so that constant music
+# doesn't count as silence
+DIGITAL_SILENCE = 1.0
+NOISE_MARGIN = 2.0
+QUIET_FRACTION = 0.1
+FLOOR_PERCENTILE = 10
+LOUD_PERCENTILE = 90
+# Chunks can be cut without overlap in a pause at least this long
+MIN_PAUSE_T = 0.08
+# Silence at least this long is skipped, but for PAD_T at either end
+MIN_SKIP_T = 1.0
+PAD_T = 0.25
+
+def frame_levels(pcm, frame_n):
+    '''The mean absolute amplitude of each whole frame of `frame_n`
+    samples of 16-bit PCM.'''
+    n_frames = len(pcm) // (2 * frame_n)
+    if n_frames == 0:
+        return []
+    if numpy is not None:
+        samples = numpy.frombuffer(pcm, dtype='<i2', count=n_frames * frame_n)
+        return numpy.abs(samples.reshape(n_frames, frame_n).astype(numpy.int32)).mean(axis=1).tolist()
+    samples = array.array('h')
+    samples.frombytes(pcm[:2 * n_frames * frame_n])
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return [sum(map(abs, samples[X:X + frame_n])) / float(frame_n) for X in range(0, len(samples), frame_n)]
+
+def silent_frames(pcm, rate, frame_t=FRAME_T):
+    '''Returns a bytearray with a 1 for each silent frame.'''
+    levels = frame_levels(pcm, int(frame_t * rate))
+    if len(levels) == 0:
+        return bytearray()
+    ordered = sorted(levels)
+    floor = ordered[len(ordered) * FLOOR_PERCENTILE // 100]
+    loud = ordered[len(ordered) * LOUD_PERCENTILE // 100]
+    threshold = max(DIGITAL_SILENCE, min(NOISE_MARGIN * floor, QUIET_FRACTION * loud))
+    return bytearray([X <= threshold for X in levels])
+
+def silent_runs(silent):
+    '''(start, end) frame indices of each run of silent frames.'''
+    runs = []
+    end = 0
+    while True:
+        start = silent.find(1, end)
+        if start < 0:
+            return runs
+        end = silent.find(0, start)
+        if end < 0:
+            end = len(silent)
+        runs.append((start, end))
+
+def plan_chunks(silent, chunk_n, overlap_n, frame_t=FRAME_T):
+    '''Divides `silent` (from `silent_frames`) into chunks of at most
+    `chunk_n` frames.  Long silences are skipped; otherwise chunks are cut
+    in the longest pause in their last quarter (or else their second
+    half), or, failing one, overlap by `overlap_n`.
+
+    Returns ([(start, end, overlaps_previous, overlaps_next)], skipped),
+    in frames.'''
+    n = len(silent)
+    runs = silent_runs(silent)
+    pause_n = max(1, int(round(MIN_PAUSE_T / frame_t)))
+    skip_n = int(round(MIN_SKIP_T / frame_t))
+    pad_n = int(round(PAD_T / frame_t))
+
+    spans = []
+    skipped = 0
+    cur = 0
+    for start, end in runs:
+        # Keep a little silence next to speech, but none at the ends
+        cut_start = start + (pad_n if start > 0 else 0)
+        cut_end = end - (pad_n if end < n else 0)
+        if cut_end - cut_start >= skip_n:
+            if cut_start > cur:
+                spans.append((cur, cut_start))
+            skipped += cut_end - cut_start
+            cur = cut_end
+    if cur < n:
+        spans.append((cur, n))
+
+    starts = [X[0] for X in runs]
+    chunks = []
+    for span_start, span_end in spans:
+        cur = span_start
+        overlapped = False
+        while span_end - cur > chunk_n:
+            hi = cur + chunk_n
+            best = None
+            # Long chunks are cheaper, so look near the end first
+            for lo in [cur + 3 * chunk_n // 4, cur + chunk_n // 2]:
+                best = _longest_pause(runs, starts, lo, hi, pause_n)
+                if best is not None:
+                    break
+            if best is not None:
+                cut = (best[0] + best[1]) // 2
+                chunks.append((cur, cut, overlapped, False))
+                cur = cut
+                overlapped = False
+            else:
+                chunks.append((cur, hi, overlapped, True))
+                cur = hi - overlap_n
+                overlapped = True
+        chunks.append((cur, span_end, overlapped, False))
+    return chunks, skipped
+
+def _longest_pause(runs, starts, lo, hi, pause_n):
+    best = None
+    idx = max(0, bisect.bisect_right(starts, lo) - 1)
+    while idx < len(runs) and runs[idx][0] < hi:
+        start, end = max(runs[idx][0], lo), min(runs[idx][1], hi)
+        if end - start >= pause_n and (best is None or end - start >= best[1] - best[0]):
+            best = (start, end)
+        idx += 1
+    return best
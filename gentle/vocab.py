@@ -0,0 +1,122 @@
+'''A vocabulary compiled once into an index on disk, which processes map
+read-only and look words up in place, instead of each reading words.txt
+into a set of its own.
+
+The index is a header (magic, word count, slot count), the byte offsets
+of the words (n + 1 native uint32s), an open-addressed hash table of word
+numbers + 1 (by CRC-32, probed linearly, 0 for empty), and the UTF-8
+words themselves, sorted bytewise.'''
+import functools
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import zlib
+
+from .util.paths import get_datadir
+from . import metasentence
+
+MAGIC = b'GVX2'
+HEADER = struct.Struct('=4sII')
+UINT_SIZE = 4
+
+def index_key(words_path):
+    '''Changes whenever the words file does.'''
+    st = os.stat(words_path)
+    key = '%s %d %d %s' % (os.path.realpath(words_path), st.st_size, st.st_mtime_ns, sys.byteorder)
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def compile_index(words, path):
+    '''Writes the index of `words` (an iterable of str) to `path`.'''
+    words = sorted(set(X.encode('utf-8') for X in words))
+    offsets = [0]
+    for word in words:
+        offsets.append(offsets[-1] + len(word))
+    # At most half full
+    nslots = 1
+    while nslots < 2 * len(words):
+        nslots *= 2
+    slots = [0] * nslots
+    for idx, word in enumerate(words):
+        slot = zlib.crc32(word) & (nslots - 1)
+        while slots[slot]:
+            slot = (slot + 1) & (nslots - 1)
+        slots[slot] = idx + 1
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as fh:
+        fh.write(HEADER.pack(MAGIC, len(words), nslots))
+        fh.write(struct.pack('=%dI' % (len(offsets)), *offsets))
+        fh.write(struct.pack('=%dI' % (nslots), *slots))
+        fh.write(b''.join(words))
+    os.replace(tmp_path, path)
+
+class Vocabulary():
+    '''Supports `in` (and `len`, iteration) like the set that
+    `metasentence.load_vocabulary` returns, over a compiled index.'''
+
+    def __init__(self, path):
+        with open(path, 'rb') as fh:
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._n, nslots = HEADER.unpack_from(self._mm)
+        if magic != MAGIC:
+            raise ValueError('%s is not a vocabulary index' % (path))
+        self._mask = nslots - 1
+        view = memoryview(self._mm)
+        start = HEADER.size
+        self._offsets = view[start:start + (self._n + 1) * UINT_SIZE].cast('I')
+        start += (self._n + 1) * UINT_SIZE
+        self._slots = view[start:start + nslots * UINT_SIZE].cast('I')
+        self._base = start + nslots * UINT_SIZE
+        # Transcripts repeat most of their words
+        self._contains = functools.lru_cache(maxsize=1 << 16)(self._search)
+
+    def _word(self, i):
+        return self._mm[self._base + self._offsets[i]:self._base + self._offsets[i + 1]]
+
+    def _search(self, word):
+        key = word.encode('utf-8')
+        slot = zlib.crc32(key) & self._mask
+        while self._slots[slot]:
+            if self._word(self._slots[slot] - 1) == key:
+                return True
+            slot = (slot + 1) & self._mask
+        return False
+
+    def __contains__(self, word):
+        return self._contains(word)
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self._word(i).decode('utf-8')
+
+_loaded = {}
+_lock = threading.Lock()
+
+def load(words_path):
+    '''The vocabulary of an OpenFST symbol table file, compiling its index
+    into the data directory the first time.  Falls back to a set if the
+    index can't be written.'''
+    key = index_key(words_path)
+    with _lock:
+        if key in _loaded:
+            return _loaded[key]
+        index_dir = get_datadir('vocab')
+        path = os.path.join(index_dir, key + '.idx')
+        try:
+            if not os.path.exists(path):
+                os.makedirs(index_dir, exist_ok=True)
+                with open(words_path, encoding='utf-8') as fh:
+                    compile_index(metasentence.load_vocabulary(fh), path)
+            vocab = Vocabulary(path)
+        except (OSError, ValueError) as e:
+            logging.warning('no vocabulary index for %s (%s); reading it into memory', words_path, e)
+            with open(words_path, encoding='utf-8') as fh:
+                vocab = metasentence.load_vocabulary(fh)
+        _loaded[key] = vocab
+        return vocab
@@ -1,7 +1,7 @@
 from twisted.web.static import File
 from twisted.web.resource import Resource
 from twisted.web.server import Site, NOT_DONE_YET
-from twisted.internet import reactor, threads
+from twisted.internet import reactor, defer
 from twisted.web._responses import FOUND
 
 import json
@@ -9,14 +9,48 @@ import logging
 import multiprocessing
 import os
 import shutil
+import threading
+import time
 import uuid
-import wave
 
 from gentle.util.paths import get_resource, get_datadir
 from gentle.util.cyst import Insist
+from gentle import cluster
+from gentle import kaldi_queue
+from gentle import metrics
+from gentle import standard_kaldi
+from gentle.checkpoint import Checkpoint
+from gentle.graph_cache import GraphCache, model_identity
+from gentle.result_cache import AudioCache, ResultCache, hash_bytes
+from gentle.scheduler import Scheduler, JobClass, QueueFull
+from gentle.tracing import Tracer, NULL_TRACER
 
 import gentle
 
+# With --workers, the default number of jobs that may be out on workers
+REMOTE_JOBS = 32
+
+# The most (and, negated, least) priority a request can ask for
+MAX_PRIORITY = 10
+
+REUSED = metrics.REGISTRY.register(metrics.Counter(
+    'gentle_reused_jobs_total',
+    'Submissions answered by an earlier job: from its cached result, or by following it while it runs',
+    ['how']))
+
+# The Transcriber that serve() is serving, which these gauges report on
+_serving = None
+
+QUEUE_DEPTH = metrics.REGISTRY.register(metrics.Gauge(
+    'gentle_queue_depth', 'Jobs waiting to run', ['class'],
+    callback=lambda: _serving.scheduler.stats()['queued'] if _serving is not None else {}))
+JOBS_RUNNING = metrics.REGISTRY.register(metrics.Gauge(
+    'gentle_jobs_running', 'Jobs running',
+    callback=lambda: _serving.scheduler.stats()['running'] if _serving is not None else 0))
+WORKERS = metrics.REGISTRY.register(metrics.Gauge(
+    'gentle_workers', 'Connected worker connections (with --workers)',
+    callback=lambda: _serving.dispatcher.stats()['workers'] if _serving is not None and _serving.dispatcher is not None else 0))
+
 class TranscriptionStatus(Resource):
     def __init__(self, status_dict):
         self.status_dict = status_dict
@@ -26,18 +60,81 @@ class TranscriptionStatus(Resource):
         req.setHeader(b"Content-Type", "application/json")
         return json.dumps(self.status_dict).encode()
 
+class MetricsResource(Resource):
+    isLeaf = True
+
+    def render_GET(self, req):
+        req.setHeader(b"Content-Type", "text/plain; version=0.0.4")
+        return metrics.REGISTRY.render().encode()
+
 class Transcriber():
-    def __init__(self, data_dir, nthreads=4, ntranscriptionthreads=2):
+    def __init__(self, data_dir, nthreads=4, ntranscriptionthreads=2, graph_cache_size=2048, audio_cache_size=4096, result_cache_size=512, k3_budget=None, max_queued=16, workers=None, worker_secret=None, trace=False):
         self.data_dir = data_dir
+        # Write a trace.json (see gentle.tracing) for every job
+        self.trace = trace
         self.nthreads = nthreads
         self.ntranscriptionthreads = ntranscriptionthreads
+        self._status_dicts = {}
+
+        # Repeated uploads are resampled once, and repeated jobs run once
+        self.audio_cache = AudioCache(os.path.join(data_dir, 'audio'), max_bytes=audio_cache_size*1024*1024)
+        self.result_cache = ResultCache(os.path.join(data_dir, 'results'), max_bytes=result_cache_size*1024*1024)
+        # result key => (uid, Job) of the jobs queued or running
+        self._running = {}
+        self._running_lock = threading.Lock()
+
+        if workers is not None:
+            # Jobs run on worker processes (see worker.py), which connect
+            # to this address; no models are loaded here
+            self.dispatcher = cluster.Dispatcher(workers, secret=worker_secret)
+            # (Workers are expected to run the same version and models)
+            self.model_id = 'workers %s' % (gentle.__version__)
+            if k3_budget is None:
+                k3_budget = REMOTE_JOBS
+            self.scheduler = Scheduler(k3_budget, [
+                JobClass('align', cost=1, max_queued=max_queued),
+                JobClass('transcribe', cost=1, max_queued=max_queued),
+            ])
+            return
+        self.dispatcher = None
+
         self.resources = gentle.Resources()
+        self.model_id = '%s %s' % (gentle.__version__, model_identity(self.resources.proto_langdir))
+        # Warm k3 workers shared by every forced-alignment job
+        self.pool = kaldi_queue.shared_pool(self.resources, nworkers=nthreads)
+        # Graphs are shared between jobs that align the same transcript
+        self.graph_cache = GraphCache(os.path.join(data_dir, 'graphs'), max_bytes=graph_cache_size*1024*1024)
 
         self.full_transcriber = gentle.FullTranscriber(self.resources, nthreads=ntranscriptionthreads)
-        self._status_dicts = {}
+
+        # Jobs are admitted within a budget of k3 processes, so that a
+        # burst of uploads queues (or is turned away) rather than swapping
+        if k3_budget is None:
+            k3_budget = nthreads + ntranscriptionthreads
+        self.scheduler = Scheduler(k3_budget, [
+            JobClass('align', cost=min(nthreads, k3_budget), max_queued=max_queued),
+            JobClass('transcribe', cost=max(1, min(ntranscriptionthreads, k3_budget)), max_queued=max_queued),
+        ])
 
     def get_status(self, uid):
-        return self._status_dicts.setdefault(uid, {})
+        if uid not in self._status_dicts:
+            if not os.path.isdir(self.out_dir(uid)):
+                # No such job (so nothing to remember)
+                return {}
+            # Jobs from before a restart have their final status on disk
+            status = {}
+            status_path = os.path.join(self.out_dir(uid), 'status.json')
+            if os.path.exists(status_path):
+                with open(status_path) as fh:
+                    status = json.load(fh)
+            self._status_dicts[uid] = status
+        return self._status_dicts[uid]
+
+    def save_status(self, uid):
+        status_path = os.path.join(self.out_dir(uid), 'status.json')
+        with open(status_path + '.tmp', 'w') as fh:
+            json.dump(self.get_status(uid), fh, indent=2)
+        os.replace(status_path + '.tmp', status_path)
 
     def out_dir(self, uid):
         return os.path.join(self.data_dir, 'transcriptions', uid)
@@ -49,7 +146,141 @@ class Transcriber():
             uid = uuid.uuid4().hex[:8]
         return uid
 
-    def transcribe(self, uid, transcript, audio, async_mode, **kwargs):
+    def job_keys(self, transcript, audio, kwargs):
+        '''The (AudioCache key, ResultCache key) of an upload.'''
+        audio_key = self.audio_cache.key(hash_bytes(audio))
+        return audio_key, self.result_cache.key(audio_key, transcript, self.model_id, **kwargs)
+
+    def running_job(self, result_key):
+        '''The (uid, Job) of a queued or running job that will give the
+        result for `result_key`, or None.'''
+        with self._running_lock:
+            return self._running.get(result_key)
+
+    def reuse(self, uid, audio_key, result_key):
+        '''Fills in a new job's directory from the cached result of an
+        earlier one, if there is one. Returns the path of its align.json,
+        or None.'''
+        outdir = self.out_dir(uid)
+        align_path = os.path.join(outdir, 'align.json')
+        if not self.result_cache.copy_to(result_key, align_path):
+            return None
+        output = gentle.Transcription.from_jsonfile(align_path)
+        write_views(outdir, output)
+
+        status = self.get_status(uid)
+        wavfile = os.path.join(outdir, 'a.wav')
+        # (Only the viewer needs the audio, so a result outliving its
+        # audio in the cache is still used)
+        if self.audio_cache.copy_to(audio_key, wavfile):
+            with gentle.AudioSource.from_wav(wavfile) as source:
+                status['duration'] = source.duration
+        status['status'] = 'OK'
+        self.save_status(uid)
+        return align_path
+
+    def create_job(self, uid, transcript, audio, job_class, kwargs, audio_key=None, result_key=None, previous=None):
+        '''Writes everything a job needs to its directory, so that it can
+        be run again (see `resume`) if the server stops first.
+
+        A job with a `previous` job (whose audio it takes, in place of
+        `audio`) only realigns the edits made to that job's transcript.'''
+        outdir = self.out_dir(uid)
+        with open(os.path.join(outdir, 'transcript.txt'), 'w') as tranfile:
+            tranfile.write(transcript)
+        if previous is not None:
+            prev_dir = self.out_dir(previous)
+            shutil.copy(os.path.join(prev_dir, 'align.json'), os.path.join(outdir, 'previous.json'))
+            try:
+                os.link(os.path.join(prev_dir, 'a.wav'), os.path.join(outdir, 'a.wav'))
+            except OSError:
+                shutil.copy(os.path.join(prev_dir, 'a.wav'), os.path.join(outdir, 'a.wav'))
+        # Media that's been seen before needn't be resampled again
+        elif audio_key is None or not self.audio_cache.copy_to(audio_key, os.path.join(outdir, 'a.wav')):
+            with open(os.path.join(outdir, 'upload'), 'wb') as wavfile:
+                wavfile.write(audio)
+        job = {'class': job_class,
+               # Sets don't survive JSON
+               'kwargs': {k: sorted(v) if isinstance(v, set) else v for k, v in kwargs.items()},
+               'created': time.time(),
+               'audio_key': audio_key,
+               'result_key': result_key,
+               'previous': previous}
+        with open(os.path.join(outdir, 'job.json'), 'w') as jobfile:
+            json.dump(job, jobfile, indent=2)
+
+    def load_job(self, uid):
+        '''The job.json written by `create_job`, or {} for older jobs.'''
+        job_path = os.path.join(self.out_dir(uid), 'job.json')
+        if not os.path.exists(job_path):
+            return {}
+        with open(job_path) as fh:
+            return json.load(fh)
+
+    def submit(self, uid, job_class, transcript, priority=0, **kwargs):
+        try:
+            job = self.scheduler.submit(
+                job_class, self.transcribe, uid, transcript,
+                priority=priority, status=self.get_status(uid), **kwargs)
+        except QueueFull:
+            # (The job's directory may be about to go as well)
+            self._status_dicts.pop(uid, None)
+            raise
+
+        # Until it's done, the same submission follows this job
+        result_key = self.load_job(uid).get('result_key')
+        if result_key is not None:
+            with self._running_lock:
+                self._running[result_key] = (uid, job)
+            job.future.add_done_callback(lambda _: self._finished(result_key, uid))
+        return job
+
+    def _finished(self, result_key, uid):
+        with self._running_lock:
+            if self._running.get(result_key, (None,))[0] == uid:
+                del self._running[result_key]
+
+    def resume(self):
+        '''Queues the jobs that hadn't finished when the server stopped.
+        They carry on from their checkpoints, so only the parts of the
+        audio that weren't decoded before are decoded now.'''
+        root = os.path.join(self.data_dir, 'transcriptions')
+        if not os.path.isdir(root):
+            return
+        jobs = []
+        for uid in os.listdir(root):
+            # (Older jobs have no job.json, and can't be resumed)
+            if self.get_status(uid).get('status') not in ('OK', 'ERROR'):
+                job = self.load_job(uid)
+                if job:
+                    jobs.append((job, uid))
+
+        for job, uid in sorted(jobs, key=lambda X: X[0]['created']):
+            with open(os.path.join(self.out_dir(uid), 'transcript.txt')) as fh:
+                transcript = fh.read()
+            kwargs = job['kwargs']
+            if 'disfluencies' in kwargs:
+                kwargs['disfluencies'] = set(kwargs['disfluencies'])
+            logging.info('resuming job %s' % (uid))
+            try:
+                self.submit(uid, job['class'], transcript, **kwargs)
+            except QueueFull as e:
+                status = self.get_status(uid)
+                status['status'] = 'ERROR'
+                status['error'] = 'Not resumed after a restart: %s' % (e)
+                self.save_status(uid)
+
+    def transcribe(self, uid, transcript, **kwargs):
+        try:
+            return self._transcribe(uid, transcript, **kwargs)
+        except Exception as e:
+            status = self.get_status(uid)
+            status['status'] = 'ERROR'
+            status['error'] = str(e)
+            self.save_status(uid)
+            raise
+
+    def _transcribe(self, uid, transcript, **kwargs):
 
         status = self.get_status(uid)
 
@@ -60,62 +291,86 @@ class Transcriber():
 
         outdir = os.path.join(self.data_dir, 'transcriptions', uid)
 
-        tran_path = os.path.join(outdir, 'transcript.txt')
-        with open(tran_path, 'w') as tranfile:
-            tranfile.write(transcript)
-        audio_path = os.path.join(outdir, 'upload')
-        with open(audio_path, 'wb') as wavfile:
-            wavfile.write(audio)
-
-        status['status'] = 'ENCODING'
+        tracer = Tracer() if self.trace else NULL_TRACER
+        job = self.load_job(uid)
 
         wavfile = os.path.join(outdir, 'a.wav')
-        if gentle.resample(os.path.join(outdir, 'upload'), wavfile) != 0:
-            status['status'] = 'ERROR'
-            status['error'] = "Encoding failed. Make sure that you've uploaded a valid media file."
-            # Save the status so that errors are recovered on restart of the server
-            # XXX: This won't work, because the endpoint will override this file
-            with open(os.path.join(outdir, 'status.json'), 'w') as jsfile:
-                json.dump(status, jsfile, indent=2)
-            return
-
-        #XXX: Maybe we should pass this wave object instead of the
-        # file path to align_progress
-        wav_obj = wave.open(wavfile, 'rb')
-        status['duration'] = wav_obj.getnframes() / float(wav_obj.getframerate())
+        # Once it's been resampled, the upload is removed
+        if os.path.exists(os.path.join(outdir, 'upload')):
+            status['status'] = 'ENCODING'
+            with tracer.span('resample'):
+                resampled = gentle.resample(os.path.join(outdir, 'upload'), wavfile)
+            if resampled != 0:
+                status['status'] = 'ERROR'
+                status['error'] = "Encoding failed. Make sure that you've uploaded a valid media file."
+                # Save the status so that errors are recovered on restart of the server
+                self.save_status(uid)
+                return
+            if job.get('audio_key') is not None:
+                self.audio_cache.add(job['audio_key'], wavfile)
+
+            # a.wav is all that's needed from here on (the viewer plays it)
+            os.unlink(os.path.join(outdir, 'upload'))
+
+        # Mapped once; every chunk (in both passes) is a view into it
+        source = gentle.AudioSource.from_wav(wavfile)
+        status['duration'] = source.duration
         status['status'] = 'TRANSCRIBING'
+        t_start = time.time()
 
         def on_progress(p):
             print(p)
             for k,v in p.items():
                 status[k] = v
 
-        if len(transcript.strip()) > 0:
-            trans = gentle.ForcedAligner(self.resources, transcript, nthreads=self.nthreads, **kwargs)
+        previous_path = os.path.join(outdir, 'previous.json')
+        if self.dispatcher is not None:
+            # (Workers align edited transcripts in full)
+            job_class = 'align' if len(transcript.strip()) > 0 else 'transcribe'
+            trans = cluster.RemoteAligner(self.dispatcher, job_class, transcript, **kwargs)
+        elif len(transcript.strip()) > 0 and os.path.exists(previous_path):
+            previous = gentle.Transcription.from_jsonfile(previous_path)
+            trans = gentle.IncrementalAligner(self.resources, previous, transcript, nthreads=self.nthreads, pool=self.pool, graph_cache=self.graph_cache, tracer=tracer, **kwargs)
+        elif len(transcript.strip()) > 0:
+            trans = gentle.ForcedAligner(self.resources, transcript, nthreads=self.nthreads, pool=self.pool, graph_cache=self.graph_cache, tracer=tracer, **kwargs)
+            logging.info('graph cache: %s' % (self.graph_cache.stats()))
         elif self.full_transcriber.available:
             trans = self.full_transcriber
         else:
             status['status'] = 'ERROR'
             status['error']  = 'No transcript provided and no language model for full transcription'
+            self.save_status(uid)
+            source.close()
             return
 
-        output = trans.transcribe(wavfile, progress_cb=on_progress, logging=logging)
+        def on_partial(result):
+            # Published as it goes, so clients can show words before the
+            # job is done
+            write_json(os.path.join(outdir, 'align.json'), result, indent=2)
 
-        # ...remove the original upload
-        os.unlink(os.path.join(outdir, 'upload'))
+        # Decoding results are saved as they come, to resume from
+        checkpoint = Checkpoint(os.path.join(outdir, 'checkpoint'))
+        if checkpoint.count('chunks') > 0:
+            logging.info('resuming from %d decoded chunks' % (checkpoint.count('chunks')))
 
-        # Save
-        with open(os.path.join(outdir, 'align.json'), 'w') as jsfile:
-            jsfile.write(output.to_json(indent=2))
-        with open(os.path.join(outdir, 'align.csv'), 'w') as csvfile:
-            csvfile.write(output.to_csv())
+        with source, tracer.span('transcribe', duration=status['duration']):
+            output = trans.transcribe(source, progress_cb=on_progress, logging=logging, partial_cb=on_partial, checkpoint=checkpoint)
+        if status['duration'] > 0:
+            metrics.REALTIME_FACTOR.observe((time.time() - t_start) / status['duration'])
+        if self.trace:
+            tracer.write(os.path.join(outdir, 'trace.json'))
 
-        # Inline the alignment into the index.html file.
-        htmltxt = open(get_resource('www/view_alignment.html')).read()
-        htmltxt = htmltxt.replace("var INLINE_JSON;", "var INLINE_JSON=%s;" % (output.to_json()));
-        open(os.path.join(outdir, 'index.html'), 'w').write(htmltxt)
+        # Save
+        write_json(os.path.join(outdir, 'align.json'), output, indent=2)
+        write_views(outdir, output)
+        if job.get('result_key') is not None:
+            self.result_cache.add(job['result_key'], os.path.join(outdir, 'align.json'))
 
         status['status'] = 'OK'
+        self.save_status(uid)
+        checkpoint.clear()
+        if os.path.exists(previous_path):
+            os.unlink(previous_path)
 
         logging.info('done with transcription.')
 
@@ -134,25 +389,13 @@ class TranscriptionsController(Resource):
         # Add a Status endpoint to the file
         trans_status = TranscriptionStatus(self.transcriber.get_status(uid))
         trans_ctrl.putChild(b"status.json", trans_status)
+        trans_ctrl.putChild(b"realign", RealignController(self, uid))
 
         return trans_ctrl
 
-    def render_POST(self, req):
+    def new_job_dir(self):
         uid = self.transcriber.next_id()
 
-        tran = req.args.get(b'transcript', [b''])[0].decode()
-        audio = req.args[b'audio'][0]
-
-        disfluency = True if b'disfluency' in req.args else False
-        conservative = True if b'conservative' in req.args else False
-        kwargs = {'disfluency': disfluency,
-                  'conservative': conservative,
-                  'disfluencies': set(['uh', 'um'])}
-
-        async_mode = True
-        if b'async' in req.args and req.args[b'async'][0] == b'false':
-            async_mode = False
-
         # We need to make the transcription directory here, so that
         # when we redirect the user we are sure that there's a place
         # for them to go.
@@ -161,11 +404,30 @@ class TranscriptionsController(Resource):
 
         # Copy over the HTML
         shutil.copy(get_resource('www/view_alignment.html'), os.path.join(outdir, 'index.html'))
-
-        result_promise = threads.deferToThreadPool(
-            reactor, reactor.getThreadPool(),
-            self.transcriber.transcribe,
-            uid, tran, audio, async_mode, **kwargs)
+        return uid, outdir
+
+    def submit(self, req, uid, job_class, tran, priority, kwargs):
+        '''Queues a job whose directory is ready, returning it, or
+        (having removed the directory) the response to a full queue.'''
+        try:
+            return self.transcriber.submit(uid, job_class, tran, priority=priority, **kwargs)
+        except QueueFull as e:
+            shutil.rmtree(self.transcriber.out_dir(uid))
+            # 429 if this kind of job is backed up; 503 if everything is
+            if e.saturated:
+                req.setResponseCode(503, b'Service Unavailable')
+            else:
+                req.setResponseCode(429, b'Too Many Requests')
+            if e.retry_after is not None:
+                req.setHeader(b"Retry-After", str(e.retry_after))
+            req.setHeader(b"Content-Type", "application/json")
+            return json.dumps({'error': str(e)}).encode()
+
+    def respond(self, req, uid, job, result_promise, async_mode):
+        '''Redirects to the job, or (unless async) sends its result when
+        it's done.'''
+        job.future.add_done_callback(
+            lambda future: reactor.callFromThread(fire_deferred, result_promise, future))
 
         if not async_mode:
             def write_result(result):
@@ -184,6 +446,149 @@ class TranscriptionsController(Resource):
         req.setHeader(b"Location", "/transcriptions/%s" % (uid))
         return b''
 
+    def render_POST(self, req):
+        tran = req.args.get(b'transcript', [b''])[0].decode()
+        audio = req.args[b'audio'][0]
+
+        disfluency = True if b'disfluency' in req.args else False
+        conservative = True if b'conservative' in req.args else False
+        kwargs = {'disfluency': disfluency,
+                  'conservative': conservative,
+                  'disfluencies': set(['uh', 'um'])}
+
+        try:
+            async_mode, priority = parse_wait(req)
+        except ValueError:
+            return bad_request(req, 'priority must be a number')
+
+        audio_key, result_key = self.transcriber.job_keys(tran, audio, kwargs)
+        running = self.transcriber.running_job(result_key)
+        if running is not None:
+            # The same job is already under way: follow it (but leave it
+            # be if this client goes away)
+            uid, job = running
+            REUSED.labels(how='running').inc()
+            logging.info('repeat of job %s' % (uid))
+            result_promise = defer.Deferred()
+        else:
+            uid, outdir = self.new_job_dir()
+
+            # Done before: no need to queue anything
+            align_path = self.transcriber.reuse(uid, audio_key, result_key)
+            if align_path is not None:
+                REUSED.labels(how='result').inc()
+                logging.info('job %s reused a cached result' % (uid))
+                if not async_mode:
+                    req.setHeader("Content-Type", "application/json")
+                    with open(align_path, 'rb') as fh:
+                        return fh.read()
+                req.setResponseCode(FOUND)
+                req.setHeader(b"Location", "/transcriptions/%s" % (uid))
+                return b''
+
+            job_class = 'align' if len(tran.strip()) > 0 else 'transcribe'
+            self.transcriber.create_job(uid, tran, audio, job_class, kwargs, audio_key=audio_key, result_key=result_key)
+            job = self.submit(req, uid, job_class, tran, priority, kwargs)
+            if isinstance(job, bytes):
+                return job
+
+            result_promise = defer.Deferred(
+                lambda _: self.transcriber.scheduler.cancel(job))
+        return self.respond(req, uid, job, result_promise, async_mode)
+
+class RealignController(Resource):
+    '''POST an edited `transcript` to /transcriptions/<uid>/realign to
+    align it to that job's audio, redoing only the edited parts of its
+    alignment (see gentle.IncrementalAligner).  The new job is answered
+    like an upload.'''
+
+    def __init__(self, controller, uid):
+        Resource.__init__(self)
+        self.controller = controller
+        self.uid = uid
+
+    def render_POST(self, req):
+        transcriber = self.controller.transcriber
+        tran = req.args.get(b'transcript', [b''])[0].decode()
+        # (A result reused from the cache may have outlived its audio)
+        ready = transcriber.get_status(self.uid).get('status') == 'OK' and os.path.exists(
+            os.path.join(transcriber.out_dir(self.uid), 'a.wav'))
+        if not ready or len(tran.strip()) == 0:
+            return bad_request(req, 'Only a finished alignment, with its audio, can be realigned to a transcript')
+
+        try:
+            async_mode, priority = parse_wait(req)
+        except ValueError:
+            return bad_request(req, 'priority must be a number')
+        # Same options as before
+        previous = transcriber.load_job(self.uid)
+        kwargs = previous.get('kwargs', {'disfluency': False, 'conservative': False, 'disfluencies': ['uh', 'um']})
+        if 'disfluencies' in kwargs:
+            kwargs['disfluencies'] = set(kwargs['disfluencies'])
+
+        uid, outdir = self.controller.new_job_dir()
+        transcriber.create_job(uid, tran, None, 'align', kwargs, audio_key=previous.get('audio_key'), previous=self.uid)
+        job = self.controller.submit(req, uid, 'align', tran, priority, kwargs)
+        if isinstance(job, bytes):
+            return job
+        logging.info('job %s realigns edits to job %s' % (uid, self.uid))
+
+        result_promise = defer.Deferred(
+            lambda _: transcriber.scheduler.cancel(job))
+        return self.controller.respond(req, uid, job, result_promise, async_mode)
+
+def parse_wait(req):
+    '''(async_mode, priority) of a request.  Raises ValueError if the
+    priority isn't a number.'''
+    async_mode = True
+    if b'async' in req.args and req.args[b'async'][0] == b'false':
+        async_mode = False
+
+    # Only clients that wait for the result may jump the queue, and only
+    # by so much
+    priority = 0
+    if not async_mode and b'priority' in req.args:
+        priority = int(req.args[b'priority'][0])
+        priority = max(-MAX_PRIORITY, min(MAX_PRIORITY, priority))
+    return async_mode, priority
+
+def bad_request(req, error):
+    req.setResponseCode(400, b'Bad Request')
+    req.setHeader(b"Content-Type", "application/json")
+    return json.dumps({'error': error}).encode()
+
+def fire_deferred(d, future):
+    '''Passes the outcome of a finished Future on to a Deferred (unless
+    the Deferred has been cancelled).'''
+    if d.called or future.cancelled():
+        return
+    if future.exception() is not None:
+        d.errback(future.exception())
+    else:
+        d.callback(future.result())
+
+def write_views(outdir, output):
+    '''Writes the CSV and the viewer (with the alignment inlined) of a
+    finished job.'''
+    with open(os.path.join(outdir, 'align.csv'), 'w') as csvfile:
+        output.write_csv(csvfile)
+
+    # Inline the alignment into the index.html file.
+    htmltxt = open(get_resource('www/view_alignment.html')).read()
+    head, tail = htmltxt.split("var INLINE_JSON;", 1)
+    with open(os.path.join(outdir, 'index.html'), 'w') as htmlfile:
+        htmlfile.write(head + "var INLINE_JSON=")
+        output.write_json(htmlfile)
+        htmlfile.write(";" + tail)
+
+def write_json(path, result, **kwargs):
+    '''Writes a Transcription's JSON to `path` by renaming a temporary
+    file over it, so readers never see it half-written.'''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as fh:
+        result.write_json(fh, **kwargs)
+    os.replace(tmp_path, path)
+
 class LazyZipper(Insist):
     def __init__(self, cachedir, transcriber, uid):
         self.transcriber = transcriber
@@ -216,7 +621,7 @@ class TranscriptionZipper(Resource):
         else:
             return Resource.getChild(self, path, req)
 
-def serve(port=8765, interface='0.0.0.0', installSignalHandlers=0, nthreads=4, ntranscriptionthreads=2, data_dir=get_datadir('webdata')):
+def serve(port=8765, interface='0.0.0.0', installSignalHandlers=0, nthreads=4, ntranscriptionthreads=2, data_dir=get_datadir('webdata'), graph_cache_size=2048, audio_cache_size=4096, result_cache_size=512, k3_budget=None, max_queued=16, workers=None, worker_secret=None, trace=False):
     logging.info("SERVE %d, %s, %d", port, interface, installSignalHandlers)
 
     if not os.path.exists(data_dir):
@@ -232,13 +637,19 @@ def serve(port=8765, interface='0.0.0.0', installSignalHandlers=0, nthreads=4, n
     f.putChild(b'status.html', File(get_resource('www/status.html')))
     f.putChild(b'preloader.gif', File(get_resource('www/preloader.gif')))
 
-    trans = Transcriber(data_dir, nthreads=nthreads, ntranscriptionthreads=ntranscriptionthreads)
+    trans = Transcriber(data_dir, nthreads=nthreads, ntranscriptionthreads=ntranscriptionthreads, graph_cache_size=graph_cache_size, audio_cache_size=audio_cache_size, result_cache_size=result_cache_size, k3_budget=k3_budget, max_queued=max_queued, workers=workers, worker_secret=worker_secret, trace=trace)
+    # Pick up jobs that were cut short by the last shutdown
+    trans.resume()
     trans_ctrl = TranscriptionsController(trans)
     f.putChild(b'transcriptions', trans_ctrl)
 
     trans_zippr = TranscriptionZipper(zip_dir, trans)
     f.putChild(b'zip', trans_zippr)
 
+    global _serving
+    _serving = trans
+    f.putChild(b'metrics', MetricsResource())
+
     s = Site(f)
     logging.info("about to listen")
     reactor.listenTCP(port, s, interface=interface)
@@ -260,6 +671,26 @@ if __name__=='__main__':
                         help='number of alignment threads')
     parser.add_argument('--ntranscriptionthreads', default=2, type=int,
                         help='number of full-transcription threads (memory intensive)')
+    parser.add_argument('--graph-cache-size', default=2048, type=int,
+                        help='disk budget (in MB) for cached alignment graphs')
+    parser.add_argument('--audio-cache-size', default=4096, type=int,
+                        help='disk budget (in MB) for resampled uploads, reused when the same media is uploaded again')
+    parser.add_argument('--result-cache-size', default=512, type=int,
+                        help='disk budget (in MB) for alignments, reused when the same media and transcript are submitted again')
+    parser.add_argument('--k3-budget', default=None, type=int,
+                        help='most k3 processes that running jobs may use (default: nthreads + ntranscriptionthreads); with --workers, the most jobs out on workers (default: %d)' % (REMOTE_JOBS))
+    parser.add_argument('--max-queued', default=16, type=int,
+                        help='most jobs of each kind that may wait to run')
+    parser.add_argument('--k3-sessions', action='store_true',
+                        help='run the k3 decoders as sessions of one process, which loads the model and graphs once')
+    parser.add_argument('--k3-zygote', action='store_true',
+                        help='fork the k3 decoders from a process that has the model loaded, so that they start at once')
+    parser.add_argument('--workers', default=None,
+                        help='run jobs on worker processes (see worker.py) that connect to this address (host:port, or a Unix socket path)')
+    parser.add_argument('--worker-secret', metavar='file', default=None,
+                        help='file with a secret that workers must prove they know; needed unless --workers is a Unix socket or a loopback address')
+    parser.add_argument('--trace', action='store_true',
+                        help='write a Chrome trace (trace.json) of each job to its directory')
     parser.add_argument('--log', default="INFO",
                         help='the log level (DEBUG, INFO, WARNING, ERROR, or CRITICAL)')
 
@@ -267,8 +698,10 @@ if __name__=='__main__':
 
     log_level = args.log.upper()
     logging.getLogger().setLevel(log_level)
+    standard_kaldi.SESSIONS = args.k3_sessions
+    standard_kaldi.ZYGOTE = args.k3_zygote
 
     logging.info('gentle %s' % (gentle.__version__))
     logging.info('listening at %s:%d\n' % (args.host, args.port))
 
-    serve(args.port, args.host, nthreads=args.nthreads, ntranscriptionthreads=args.ntranscriptionthreads, installSignalHandlers=1)
+    serve(args.port, args.host, nthreads=args.nthreads, ntranscriptionthreads=args.ntranscriptionthreads, graph_cache_size=args.graph_cache_size, audio_cache_size=args.audio_cache_size, result_cache_size=args.result_cache_size, k3_budget=args.k3_budget, max_queued=args.max_queued, workers=args.workers, worker_secret=cluster.read_secret(args.worker_secret) if args.worker_secret else None, trace=args.trace, installSignalHandlers=1)
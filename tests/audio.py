@@ -0,0 +1,39 @@
+import os
+import tempfile
+import unittest
+import wave
+
+class AudioSource(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        self.pcm = bytes(range(256)) * 100
+        with wave.open(self.path, 'wb') as wav_obj:
+            wav_obj.setnchannels(1)
+            wav_obj.setsampwidth(2)
+            wav_obj.setframerate(8000)
+            wav_obj.writeframes(self.pcm)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def test_from_wav(self):
+        from gentle.audio import AudioSource
+
+        with AudioSource.from_wav(self.path) as source:
+            self.assertEqual(source.nframes, len(self.pcm) // 2)
+            self.assertEqual(source.duration, len(self.pcm) / 2 / 8000.0)
+            self.assertEqual(bytes(source.frames(100, 50)), self.pcm[200:300])
+            self.assertEqual(bytes(source.slice(1, 0.5)), self.pcm[16000:24000])
+            # Reads past the end are cut short
+            self.assertEqual(len(source.frames(source.nframes - 10, 100)), 20)
+
+    def test_header(self):
+        from gentle.audio import parse_wav_header, wav_header
+
+        with open(self.path, 'rb') as fh:
+            data = fh.read()
+        self.assertEqual(parse_wav_header(data), (8000, 44, len(self.pcm)))
+        self.assertEqual(data[:44], wav_header(len(self.pcm)))
+        self.assertRaises(ValueError, parse_wav_header, b'RIFF\0\0\0\0AVI ')
@@ -0,0 +1,43 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+class Manifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, text):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as fh:
+            fh.write(text)
+        return path
+
+    def test_formats(self):
+        from gentle.batch import read_manifest
+
+        csv_items = read_manifest(self.write('m.csv', 'audio,transcript,output\na.mp3,a.txt,out/a.json\n/b.mp3,b.txt,b.json\n'))
+        jsonl_items = read_manifest(self.write('m.jsonl', '\n'.join([
+            json.dumps({'audio': 'a.mp3', 'transcript': 'a.txt', 'output': 'out/a.json'}),
+            json.dumps({'audio': '/b.mp3', 'transcript': 'b.txt', 'output': 'b.json', 'id': 2}), ''])))
+        self.assertEqual(csv_items, jsonl_items)
+        self.assertEqual(csv_items[0]['output'], os.path.join(self.tmpdir, 'out', 'a.json'))
+        self.assertEqual(csv_items[1]['audio'], '/b.mp3')
+
+        with self.assertRaises(ValueError):
+            read_manifest(self.write('bad.csv', 'audio,output\na.mp3,a.json\n'))
+        with self.assertRaises(ValueError):
+            read_manifest(self.write('dup.csv', 'audio,transcript,output\na.mp3,a.txt,a.json\nb.mp3,b.txt,a.json\n'))
+
+    def test_results(self):
+        from gentle.batch import read_results
+
+        path = self.write('results.jsonl', json.dumps({'output': 'a.json', 'status': 'OK'}) + '\n{"output": "b.j')
+        self.assertEqual(list(read_results(path)), ['a.json'])
+        with open(path) as fh:
+            self.assertTrue(fh.read().endswith('\n'))
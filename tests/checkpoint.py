@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+class Checkpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_resume(self):
+        from gentle.checkpoint import Checkpoint
+
+        path = os.path.join(self.tmpdir, 'checkpoint')
+        checkpoint = Checkpoint(path)
+        words = [{'word': 'hello', 'start': 0.5, 'duration': 0.25, 'phones': []}]
+        checkpoint.put('chunks', '0-20', words)
+        checkpoint.put('chunks', '18-38', [])
+        checkpoint.put('gaps', '1.5-3.0:10-20', words)
+
+        # A crash part way through writing a result
+        with open(os.path.join(path, 'chunks.jsonl'), 'a') as fh:
+            fh.write('{"key": "36-5')
+
+        resumed = Checkpoint(path)
+        self.assertEqual(resumed.get('chunks', '0-20'), words)
+        self.assertEqual(resumed.get('chunks', '18-38'), [])
+        self.assertIsNone(resumed.get('chunks', '36-56'))
+        self.assertEqual(resumed.count('gaps'), 1)
+
+        resumed.put('chunks', '36-56', words)
+        self.assertEqual(Checkpoint(path).count('chunks'), 3)
+
+        resumed.clear()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(Checkpoint(path).count('chunks'), 0)
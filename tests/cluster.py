@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+class Cluster(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def handler(self, name, seen):
+        from gentle.transcription import Transcription, Word
+
+        def run(job_class, transcript, source, progress_cb, **kwargs):
+            # (Only some keys may be passed on)
+            progress_cb({'percent': 0.5, 'error': 'forged'})
+            seen.append((name, transcript, kwargs))
+            return Transcription(transcript=transcript, words=[
+                Word(case=Word.SUCCESS, word=transcript, start=0, end=source.duration)])
+        return run
+
+    def test_workers(self):
+        from gentle import audio, cluster
+
+        dispatcher = cluster.Dispatcher(os.path.join(self.tmpdir, 'workers.sock'))
+        seen = []
+        workers = [cluster.Worker(dispatcher.address, self.handler(i, seen), capacity=2)
+                   for i in range(3)]
+        for w in workers:
+            w.start()
+
+        wav = audio.wav_header(16000) + bytes(16000)
+        progress = []
+        jobs = [dispatcher.submit('align', 'job %d' % (i), wav, progress_cb=progress.append,
+                                  disfluencies=['uh'])
+                for i in range(12)]
+        results = [X.future.result(10) for X in jobs]
+
+        self.assertEqual([X.transcript for X in results], ['job %d' % (i) for i in range(12)])
+        self.assertEqual(results[0].words[0].end, 1.0)
+        self.assertEqual(len(progress), 12)
+        self.assertEqual(seen[0][2], {'disfluencies': set(['uh'])})
+        # Jobs were spread across the workers
+        self.assertTrue(len(set([X[0] for X in seen])) > 1)
+
+        for w in workers:
+            w.stop()
+        dispatcher.stop()
+
+    def test_classes(self):
+        from gentle import audio, cluster
+
+        dispatcher = cluster.Dispatcher('127.0.0.1:0')
+        address = '%s:%d' % dispatcher.address
+        seen = []
+        aligner = cluster.Worker(address, self.handler('align', seen), classes=['align'])
+        transcriber = cluster.Worker(address, self.handler('transcribe', seen), classes=['transcribe'])
+        aligner.start()
+        transcriber.start()
+
+        wav = audio.wav_header(0)
+        dispatcher.submit('transcribe', 'a', wav).future.result(10)
+        dispatcher.submit('align', 'b', wav).future.result(10)
+        self.assertEqual([X[:2] for X in seen], [('transcribe', 'a'), ('align', 'b')])
+
+        aligner.stop()
+        transcriber.stop()
+        dispatcher.stop()
+
+    def test_secret(self):
+        import socket
+        import struct
+        from gentle import audio, cluster
+
+        with self.assertRaises(ValueError):
+            cluster.Dispatcher('0.0.0.0:0')
+
+        dispatcher = cluster.Dispatcher('0.0.0.0:0', secret=b'right')
+        address = '127.0.0.1:%d' % (dispatcher.address[1])
+        seen = []
+        impostor = cluster.Worker(address, self.handler('impostor', seen), secret=b'wrong')
+        impostor.start()
+        worker = cluster.Worker(address, self.handler('worker', seen), secret=b'right')
+        worker.start()
+
+        progress = []
+        result = dispatcher.submit('align', 'a', audio.wav_header(0), progress_cb=progress.append).future.result(10)
+        self.assertEqual(result.transcript, 'a')
+        self.assertEqual([X[0] for X in seen], ['worker'])
+        self.assertEqual(progress, [{'percent': 0.5}])
+        # The impostor is never taken on
+        time.sleep(0.2)
+        self.assertEqual(dispatcher.stats()['workers'], 1)
+
+        # A bogus frame length is refused before anything is allocated
+        sock = socket.create_connection(('127.0.0.1', dispatcher.address[1]))
+        cluster.recv_frame(sock)
+        sock.sendall(struct.pack('!II', 2**31, 0))
+        self.assertEqual(sock.recv(1), b'')
+        sock.close()
+
+        impostor.stop()
+        worker.stop()
+        dispatcher.stop()
+
+    def test_lost_job(self):
+        import socket
+        from gentle import audio, cluster
+
+        dispatcher = cluster.Dispatcher(os.path.join(self.tmpdir, 'workers.sock'))
+        job = dispatcher.submit('align', 'a', audio.wav_header(0))
+
+        # Workers that take the job and go away, as if it crashed them
+        taken = 0
+        for i in range(cluster.MAX_ATTEMPTS):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(dispatcher.address)
+            cluster.recv_frame(sock)
+            cluster.send_frame(sock, {'type': 'hello'})
+            cluster.send_frame(sock, {'type': 'ready'})
+            msg, _ = cluster.recv_frame(sock)
+            taken += msg['type'] == 'job'
+            sock.close()
+
+        with self.assertRaises(RuntimeError):
+            job.future.result(10)
+        self.assertEqual(taken, cluster.MAX_ATTEMPTS)
+        self.assertEqual(dispatcher.stats()['queued'], 0)
+        dispatcher.stop()
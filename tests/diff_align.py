@@ -0,0 +1,44 @@
+import random
+import unittest
+
+class WordDiff(unittest.TestCase):
+
+    def check_ops(self, ops, a, b):
+        # Every word of both sequences is accounted for, in order
+        a_idx = [X[1] for X in ops if X[0] in ('equal', 'replace', 'delete')]
+        b_idx = [X[2] for X in ops if X[0] in ('equal', 'replace', 'insert')]
+        self.assertEqual(a_idx, list(range(len(a))))
+        self.assertEqual(b_idx, list(range(len(b))))
+        for op, i, j in ops:
+            if op == 'equal':
+                self.assertEqual(a[i], b[j])
+
+    def test_backends_agree_on_simple_input(self):
+        from gentle.diff_align import word_diff
+
+        a = "i am sitting in the room".split()
+        b = "i am sitting in a room".split()
+        for backend in ['difflib', 'banded']:
+            ops = list(word_diff(a, b, backend=backend))
+            self.check_ops(ops, a, b)
+            self.assertEqual(ops[4], ('replace', 4, 4))
+
+    def test_banded(self):
+        from gentle.diff_align import word_diff
+
+        rng = random.Random(0)
+        for _ in range(50):
+            b = [rng.choice(['really', 'want', 'to', 'go', 'i']) for _ in range(rng.randrange(300))]
+            a = [X for X in b if rng.random() > 0.1]
+            ops = list(word_diff(a, b, backend='banded'))
+            self.check_ops(ops, a, b)
+            # Deletions only, so every hypothesis word can be matched
+            self.assertEqual(len([X for X in ops if X[0] == 'equal']), len(a))
+
+    def test_repetitive(self):
+        from gentle.sequence_matcher import BandedMatcher
+
+        b = ("really " * 1000).split()
+        a = b[:900]
+        blocks = BandedMatcher(a, b, full_dp_cells=0, band_width=10).get_matching_blocks()
+        self.assertEqual(sum(X[2] for X in blocks), 900)
@@ -0,0 +1,36 @@
+import unittest
+
+class CarryOver(unittest.TestCase):
+
+    def test_edits(self):
+        from gentle.incremental_aligner import carry_over
+        from gentle.metasentence import MetaSentence
+        from gentle.transcription import Transcription, Word
+
+        old_text = 'the cat sat on a mat and then it slept'
+        vocab = set(old_text.split() + ['the', 'dog', 'sofa'])
+        ms = MetaSentence(old_text, vocab)
+        words = [Word(case=Word.SUCCESS, startOffset=start, endOffset=end, word=wd, alignedWord=wd, start=float(idx), duration=0.5)
+                 for idx, (wd, (start, end)) in enumerate(zip(ms.get_display_sequence(), ms.get_text_offsets()))]
+        # Heard, but not in the transcript
+        words.insert(9, Word(case=Word.NOT_FOUND_IN_TRANSCRIPT, word='uh', start=8.5, duration=0.2))
+        previous = Transcription(transcript=old_text, words=words)
+
+        new_text = 'The cat sat on the sofa and then it slept'
+        out, to_realign = carry_over(previous, MetaSentence(new_text, vocab), margin=1)
+
+        self.assertEqual([X.word for X in out], ['The', 'cat', 'sat', 'on', 'the', 'sofa', 'and', 'then', 'it', 'uh', 'slept'])
+        # "a mat" was changed; "on" and "and" are realigned with it
+        self.assertEqual([X.word for X in to_realign], ['on', 'the', 'sofa', 'and'])
+        self.assertTrue(all(X.not_found_in_audio() for X in to_realign))
+        for wd in out:
+            if wd.startOffset is not None:
+                self.assertEqual(new_text[wd.startOffset:wd.endOffset], wd.word)
+        # A change of case only keeps the alignment
+        self.assertEqual((out[0].case, out[0].start), (Word.SUCCESS, 0.0))
+        self.assertEqual((out[-1].case, out[-1].start), (Word.SUCCESS, 9.0))
+
+        # Unchanged, everything is kept
+        out, to_realign = carry_over(previous, MetaSentence(old_text, vocab))
+        self.assertEqual(to_realign, [])
+        self.assertEqual([X.as_dict() for X in out], [X.as_dict() for X in words])
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+FAKE_K3 = os.path.join(os.path.dirname(__file__), os.pardir, 'benchmarks', 'fake', 'k3')
+
+def make_resources(root, words):
+    '''Enough of a resource tree for benchmarks/fake/k3 and m3 (and, with
+    GENTLE_RESOURCES_ROOT set to `root`, for gentle.Resources).'''
+    graph_dir = os.path.join(root, 'exp', 'tdnn_7b_chain_online', 'graph_pp')
+    lang_dir = os.path.join(root, 'exp', 'langdir')
+    os.makedirs(graph_dir)
+    os.makedirs(lang_dir)
+    symbols = ''.join(['%s %d\n' % (X, idx) for idx, X in enumerate(['<eps>', '<unk>'] + words)])
+    for path in [os.path.join(graph_dir, 'words.txt'), os.path.join(lang_dir, 'words.txt')]:
+        with open(path, 'w') as fh:
+            fh.write(symbols)
+    with open(os.path.join(graph_dir, 'phones.txt'), 'w') as fh:
+        fh.write('<eps> 0\nsil 1\n')
+    with open(os.path.join(graph_dir, 'HCLG.fst'), 'w') as fh:
+        fh.write('*\n')
+    return types.SimpleNamespace(
+        nnet_gpu_path=os.path.join(root, 'exp', 'tdnn_7b_chain_online'),
+        proto_langdir=os.path.join(root, 'exp'))
+
+class KaldiPool(unittest.TestCase):
+
+    def setUp(self):
+        from gentle import standard_kaldi
+        self.tmpdir = tempfile.mkdtemp()
+        self.executable = standard_kaldi.EXECUTABLE_PATH
+        standard_kaldi.EXECUTABLE_PATH = FAKE_K3
+
+    def tearDown(self):
+        from gentle import standard_kaldi
+        standard_kaldi.EXECUTABLE_PATH = self.executable
+        shutil.rmtree(self.tmpdir)
+
+    def test_lease_outlives_eviction(self):
+        from gentle import kaldi_queue
+        from gentle.graph_cache import GraphCache
+
+        resources = make_resources(self.tmpdir, ['hello', 'world'])
+        cache = GraphCache(os.path.join(self.tmpdir, 'graphs'), max_bytes=1)
+        paths = []
+        for key in ['a', 'b']:
+            tmp_path = cache.mkstemp()
+            with open(tmp_path, 'w') as fh:
+                fh.write('2\n3\n') # (word ids, as the fake m3 writes them)
+            paths.append(cache.publish(key, tmp_path))
+            if key == 'a':
+                os.utime(paths[0], (0, 0))
+                lease = kaldi_queue.KaldiPool(resources, nworkers=1).lease(paths[0])
+
+        # Another job's graph pushed this one out before a worker loaded it
+        self.assertFalse(os.path.exists(paths[0]))
+        k = lease.get()
+        k.push_chunk(b'\x02\x00' * 4000)
+        self.assertEqual([X['word'] for X in k.get_final()], ['hello'])
+        lease.put(k)
+        lease.pool.stop()
+
+    def test_loaded_graph_not_reread(self):
+        from gentle import kaldi_queue
+
+        resources = make_resources(self.tmpdir, ['hello', 'world'])
+        path = os.path.join(self.tmpdir, 'graph')
+        with open(path, 'w') as fh:
+            fh.write('2\n')
+        pool = kaldi_queue.KaldiPool(resources, nworkers=2)
+        k = pool.get(path)
+        pool.put(k)
+
+        # A worker has it loaded, so it doesn't matter that it's gone
+        os.unlink(path)
+        self.assertIs(pool.get(path), k)
+        k.push_chunk(b'\x02\x00' * 4000)
+        self.assertEqual([X['word'] for X in k.get_final()], ['hello'])
+        pool.put(k)
+        pool.stop()
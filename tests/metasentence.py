@@ -0,0 +1,39 @@
+import unittest
+
+class MetaSentence(unittest.TestCase):
+
+    def test_tokenize(self):
+        from gentle.metasentence import MetaSentence, OOV_TERM
+
+        text = 'Don’t go, DON\'T go; zebra!  Go.'
+        ms = MetaSentence(text.encode('utf-8'), set(["don't", 'go']))
+
+        self.assertEqual(len(ms), 6)
+        self.assertEqual(ms.get_kaldi_sequence(), ["don't", 'go', "don't", 'go', OOV_TERM, 'go'])
+        self.assertEqual(list(ms.get_display_sequence()), ['Don’t', 'go', "DON'T", 'go', 'zebra', 'Go'])
+        self.assertEqual(ms.get_text_offsets()[-1], (28, 30))
+        self.assertEqual(ms.get_display_sequence()[-2:], ['zebra', 'Go'])
+        # One entry per normalized word
+        self.assertEqual(sorted(ms.kaldi_words), sorted(["don't", 'go', OOV_TERM]))
+
+    def test_views(self):
+        from gentle.metasentence import MetaSentence
+
+        text = 'the cat sat on the mat'
+        ms = MetaSentence(text, set(text.split()))
+
+        view = ms.view(1, 4)
+        self.assertEqual(len(view), 3)
+        self.assertEqual(view.get_kaldi_sequence(), ['cat', 'sat', 'on'])
+        self.assertEqual(list(view.get_text_offsets()), [(4, 7), (8, 11), (12, 14)])
+        self.assertEqual(view.view(1, 10).get_kaldi_sequence(), ['sat', 'on'])
+        with self.assertRaises(IndexError):
+            view.get_display_sequence()[3]
+
+        # Tokens within a range of the text (from and to word boundaries),
+        # as if it were tokenized alone
+        for start, end in [(4, 14), (3, 15), (0, len(text)), (19, 19)]:
+            span = ms.span(start, end)
+            alone = MetaSentence(text[start:end], set(text.split()))
+            self.assertEqual(span.get_kaldi_sequence(), alone.get_kaldi_sequence())
+            self.assertEqual([(X - start, Y - start) for X, Y in span.get_text_offsets()], list(alone.get_text_offsets()))
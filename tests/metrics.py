@@ -0,0 +1,44 @@
+import unittest
+
+class Metrics(unittest.TestCase):
+
+    def test_render(self):
+        from gentle import metrics
+
+        registry = metrics.Registry()
+        hist = registry.register(metrics.Histogram('t_seconds', 'Time', ['stage'], buckets=[1, 5]))
+        counter = registry.register(metrics.Counter('t_total', 'Count'))
+        registry.register(metrics.Gauge('t_depth', 'Depth', ['class'], callback=lambda: {'align': 2}))
+
+        hist.labels(stage='a').observe(0.5)
+        hist.labels(stage='a').observe(3)
+        counter.inc()
+
+        self.assertEqual(registry.render().split('\n'), [
+            '# HELP t_depth Depth',
+            '# TYPE t_depth gauge',
+            't_depth{class="align"} 2',
+            '# HELP t_seconds Time',
+            '# TYPE t_seconds histogram',
+            't_seconds_bucket{stage="a",le="1"} 1',
+            't_seconds_bucket{stage="a",le="5"} 2',
+            't_seconds_bucket{stage="a",le="+Inf"} 2',
+            't_seconds_sum{stage="a"} 3.5',
+            't_seconds_count{stage="a"} 2',
+            '# HELP t_total Count',
+            '# TYPE t_total counter',
+            't_total 1',
+            '',
+        ])
+        self.assertRaises(ValueError, registry.register, metrics.Counter('t_total', 'Again'))
+
+    def test_stage(self):
+        from gentle import metrics
+
+        @metrics.stage('test')
+        def work():
+            return 1
+
+        work()
+        work()
+        self.assertTrue('gentle_stage_seconds_count{stage="test"} 2' in metrics.REGISTRY.render())
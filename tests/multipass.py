@@ -0,0 +1,37 @@
+from tests.streaming_aligner import FakeBinaries, VOCAB
+
+class Realign(FakeBinaries):
+
+    def test_bridge_kept(self):
+        from gentle import audio, metasentence, multipass
+        from gentle.transcription import Word
+
+        # Two short gaps either side of an aligned word, "w2", which
+        # isn't heard when they're decoded together
+        transcript = 'w0 w1 w2 w3 w4'
+        times = [(0.0, 0.3, True), (0.4, 0.6, False), (0.7, 0.9, True), (1.0, 1.2, False), (1.3, 1.6, True)]
+        pcm = bytearray(2 * 16000)
+        for idx, (start, end, aligned) in enumerate(times):
+            if idx != 2:
+                value = (VOCAB.index('w%d' % (idx)) + 2).to_bytes(2, 'little')
+                pcm[int(start * 8000) * 2:int(end * 8000) * 2] = value * int(round((end - start) * 8000))
+
+        ms = metasentence.MetaSentence(transcript, self.resources.vocab)
+        alignment = []
+        for (start_off, end_off), word, (start, end, aligned) in zip(ms.get_text_offsets(), ms.get_display_sequence(), times):
+            if aligned:
+                alignment.append(Word(case=Word.SUCCESS, startOffset=start_off, endOffset=end_off, word=word,
+                                      alignedWord=word, phones=[], start=start, end=end))
+            else:
+                alignment.append(Word(case=Word.NOT_FOUND_IN_AUDIO, startOffset=start_off, endOffset=end_off, word=word))
+
+        gaps = multipass.prepare_multipass(alignment)
+        self.assertEqual(len(gaps), 2)
+        words = multipass.realign(audio.AudioSource(bytes(pcm)), alignment, ms, self.resources, nthreads=1)
+
+        self.assertEqual([X.case for X in words], [Word.SUCCESS] * 5)
+        for wd, (start, end, aligned) in zip(words[1:4:2], times[1:4:2]):
+            self.assertAlmostEqual(wd.start, start, delta=0.001)
+            self.assertAlmostEqual(wd.end, end, delta=0.001)
+        # The first pass's alignment of w2 stands
+        self.assertIs(words[2], alignment[2])
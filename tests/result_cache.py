@@ -0,0 +1,49 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+class ResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_reuse(self):
+        from gentle.result_cache import AudioCache, ResultCache, hash_bytes
+
+        audio_cache = AudioCache(os.path.join(self.tmpdir, 'audio'))
+        result_cache = ResultCache(os.path.join(self.tmpdir, 'results'), max_bytes=10)
+        audio_key = audio_cache.key(hash_bytes(b'media'))
+        kwargs = {'conservative': False, 'disfluency': False, 'disfluencies': set(['uh', 'um'])}
+        key = result_cache.key(audio_key, 'hello world', 'model', **kwargs)
+
+        self.assertEqual(key, result_cache.key(audio_key, 'hello world', 'model', **dict(kwargs, disfluencies=set(['um', 'uh']))))
+        for other in [result_cache.key(audio_key, 'hello world.', 'model', **kwargs),
+                      result_cache.key(audio_key, 'hello world', 'model2', **kwargs),
+                      result_cache.key(audio_key, 'hello world', 'model', **dict(kwargs, conservative=True)),
+                      result_cache.key(audio_cache.key(hash_bytes(b'media2')), 'hello world', 'model', **kwargs)]:
+            self.assertNotEqual(key, other)
+
+        src = os.path.join(self.tmpdir, 'align.json')
+        with open(src, 'w') as fh:
+            fh.write('{"words": []}')
+        dst = os.path.join(self.tmpdir, 'copy.json')
+        self.assertFalse(result_cache.copy_to(key, dst))
+        result_cache.add(key, src)
+        # The job's own copy going away doesn't affect the cache
+        os.unlink(src)
+        self.assertTrue(result_cache.copy_to(key, dst))
+        with open(dst) as fh:
+            self.assertEqual(fh.read(), '{"words": []}')
+
+        # Over budget, only the newest entry is kept
+        with open(src, 'w') as fh:
+            fh.write('{"words": [1]}')
+        os.utime(result_cache.path(key), (0, 0))
+        result_cache.add('newer', src)
+        self.assertIsNone(result_cache.get(key))
+        self.assertIsNotNone(result_cache.get('newer'))
+        self.assertEqual(result_cache.stats(), {'hits': 2, 'misses': 2})
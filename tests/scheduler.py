@@ -0,0 +1,81 @@
+import threading
+import unittest
+
+class Scheduler(unittest.TestCase):
+
+    def block(self, sched, release):
+        # Submits a job that holds the whole budget until `release` is set
+        started = threading.Event()
+        def job():
+            started.set()
+            release.wait(5)
+        sched.submit('align', job)
+        started.wait(5)
+
+    def make(self, budget=2, **kwargs):
+        from gentle.scheduler import Scheduler, JobClass
+        return Scheduler(budget, [JobClass('align', cost=2, **kwargs),
+                                  JobClass('transcribe', cost=1, **kwargs)])
+
+    def test_budget(self):
+        sched = self.make(budget=3)
+        lock = threading.Lock()
+        running = []
+        peak = []
+        release = threading.Event()
+
+        def job():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            release.wait(5)
+            with lock:
+                running.pop()
+
+        jobs = [sched.submit('align', job) for i in range(3)]
+        release.set()
+        for j in jobs:
+            j.future.result(5)
+        # Only one align job (cost 2) fits in a budget of 3
+        self.assertEqual(max(peak), 1)
+        sched.stop()
+
+    def test_priority_and_status(self):
+        sched = self.make()
+        release = threading.Event()
+        order = []
+
+        self.block(sched, release)
+        status = [{}, {}, {}]
+        jobs = [sched.submit('transcribe', order.append, i, priority=p, status=status[i])
+                for i, p in enumerate([0, 0, 1])]
+
+        self.assertEqual([X['queue_position'] for X in status], [1, 2, 0])
+        self.assertEqual(status[0]['status'], 'QUEUED')
+        self.assertTrue(status[2]['eta'] > 0)
+
+        release.set()
+        for j in jobs:
+            j.future.result(5)
+        self.assertEqual(order, [2, 0, 1])
+        self.assertTrue('queue_position' not in status[0])
+        sched.stop()
+
+    def test_queue_full(self):
+        from gentle.scheduler import QueueFull
+        sched = self.make(max_queued=1)
+        release = threading.Event()
+
+        self.block(sched, release)
+        queued = sched.submit('align', release.wait, 5)
+        with self.assertRaises(QueueFull) as cm:
+            sched.submit('align', release.wait, 5)
+        self.assertFalse(cm.exception.saturated)
+        self.assertTrue(cm.exception.retry_after >= 1)
+
+        self.assertTrue(sched.cancel(queued))
+        self.assertTrue(queued.future.cancelled())
+        sched.submit('align', release.wait, 5)
+
+        release.set()
+        sched.stop()
@@ -0,0 +1,28 @@
+from tests.streaming_aligner import FakeBinaries, make_input
+
+class SegmentedAligner(FakeBinaries):
+
+    def test_segments(self):
+        from gentle import audio, language_model
+        from gentle.segmented_aligner import SegmentedAligner
+
+        graph_words = []
+        make_graph = language_model.make_graph
+        def recording(kaldi_seq, *args, **kwargs):
+            graph_words.append(len(kaldi_seq))
+            return make_graph(kaldi_seq, *args, **kwargs)
+
+        # A minute of audio, cut into 10s pieces
+        transcript, pcm = make_input(150, seed=1, dropped=(40, 41, 100))
+        aligner = SegmentedAligner(self.resources, transcript, nthreads=2, segment_len=10, anchor_len=3)
+        language_model.make_graph = recording
+        try:
+            words = aligner.transcribe(audio.AudioSource(pcm)).words
+        finally:
+            language_model.make_graph = make_graph
+
+        # Anchored in every piece, so that no graph covers the transcript
+        self.assertLess(max(graph_words), 50)
+        self.assertEqual(len(words), 150)
+        self.assertEqual([idx for idx, X in enumerate(words) if not X.success()], [40, 41, 100])
+        self.assertSameAlignment(words, self.forced_alignment(transcript, pcm))
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from tests.kaldi_queue import FAKE_K3, make_resources
+
+WORDS = ['hello', 'world', 'foo', 'bar']
+
+def speak(word_ids):
+    # Each sample of the fake's audio is the id of the word being spoken
+    return b''.join([int(X).to_bytes(2, 'little') * 1600 + b'\x00\x00' * 800 for X in word_ids])
+
+class FakeK3(unittest.TestCase):
+
+    def setUp(self):
+        from gentle import standard_kaldi
+        self.tmpdir = tempfile.mkdtemp()
+        self.resources = make_resources(self.tmpdir, WORDS)
+        self.graph = os.path.join(self.tmpdir, 'HCLG.fst')
+        with open(self.graph, 'w') as fh:
+            fh.write('*\n')
+        self.executable = standard_kaldi.EXECUTABLE_PATH
+        standard_kaldi.EXECUTABLE_PATH = FAKE_K3
+
+    def tearDown(self):
+        from gentle import standard_kaldi
+        standard_kaldi.EXECUTABLE_PATH = self.executable
+        shutil.rmtree(self.tmpdir)
+
+class KaldiServer(FakeK3):
+
+    def test_sessions(self):
+        from gentle import standard_kaldi
+
+        server = standard_kaldi.KaldiServer(self.resources.nnet_gpu_path, self.graph)
+        sessions = [server.session() for i in range(4)]
+        self.assertEqual(server.sessions(), 4)
+
+        # Each session hears different words, pushed in small chunks from
+        # threads of their own, so that replies are interleaved
+        results = {}
+        def run(idx, k):
+            ids = [2 + (idx + X) % len(WORDS) for X in range(6)]
+            buf = speak(ids)
+            for start in range(0, len(buf), 1000):
+                k.push_chunk(buf[start:start + 1000])
+            results[idx] = ([WORDS[X - 2] for X in ids], [X['word'] for X in k.get_final()])
+        threads = [threading.Thread(target=run, args=(idx, k)) for idx, k in enumerate(sessions)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for idx in range(len(sessions)):
+            expected, words = results[idx]
+            self.assertEqual(words, expected)
+
+        # A session's graph is its own
+        self.assertTrue(sessions[0].load_graph(b'2\n'))
+        sessions[0].push_chunk(speak([2, 3]))
+        sessions[1].push_chunk(speak([2, 3]))
+        self.assertEqual([X['word'] for X in sessions[0].get_final()], ['hello', '<unk>'])
+        self.assertEqual([X['word'] for X in sessions[1].get_final()], ['hello', 'world'])
+
+        for k in sessions:
+            self.assertEqual(server.close(k.session_id), k is sessions[-1])
+        server.stop()
+
+    def test_exit(self):
+        from gentle import standard_kaldi
+
+        # Stray output is skipped
+        executable = os.path.join(self.tmpdir, 'k3')
+        with open(executable, 'w') as fh:
+            fh.write('#!/bin/sh\necho "Cuda enabled"\nexec %s "$@"\n' % (os.path.abspath(FAKE_K3)))
+        os.chmod(executable, 0o755)
+        standard_kaldi.EXECUTABLE_PATH = executable
+
+        with self.assertLogs('gentle.standard_kaldi', 'WARNING'):
+            server = standard_kaldi.KaldiServer(self.resources.nnet_gpu_path, self.graph)
+            k = server.session()
+            k.push_chunk(speak([4]))
+            self.assertEqual([X['word'] for X in k.get_final()], ['foo'])
+
+        # When k3 goes away, a session waiting on it is woken
+        waiting = server.session()
+        server._p.kill()
+        self.assertEqual(waiting._stdout.readline(), b'')
+        with self.assertRaises(IOError):
+            waiting.get_final()
+        server.stop()
+
+class KaldiZygote(FakeK3):
+
+    def test_fork(self):
+        from gentle import standard_kaldi
+
+        zygote = standard_kaldi.KaldiZygote(self.resources.nnet_gpu_path, self.graph)
+        decoders = [standard_kaldi.Kaldi.from_zygote(zygote) for i in range(3)]
+        self.assertEqual(len(set([X.pid for X in decoders] + [zygote.pid])), 4)
+        for idx, k in enumerate(decoders):
+            k.push_chunk(speak([2 + idx, 5]))
+        for idx, k in enumerate(decoders):
+            self.assertTrue(k.alive())
+            self.assertEqual([X['word'] for X in k.get_final()], [WORDS[idx], 'bar'])
+
+        # A decoder that exits is noticed by its connection closing
+        k = decoders.pop()
+        k._cmd('stop')
+        for i in range(1000):
+            if not k.alive():
+                break
+            time.sleep(0.01)
+        self.assertFalse(k.alive())
+        k.stop()
+
+        for k in decoders:
+            k.stop()
+            self.assertEqual(k._p.returncode, 0)
+        zygote.stop()
+        with self.assertRaises(OSError):
+            standard_kaldi.Kaldi.from_zygote(zygote)
@@ -0,0 +1,76 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from tests.kaldi_queue import FAKE_K3, make_resources
+
+FAKE_M3 = os.path.join(os.path.dirname(FAKE_K3), 'm3')
+
+VOCAB = ['w%d' % (i) for i in range(20)]
+
+def make_input(n_words, seed=0, dropped=()):
+    '''A transcript of `n_words` words, and audio for benchmarks/fake/k3
+    in which each is "spoken" for 0.3s, after 0.1s of silence (save for
+    the words numbered in `dropped`, which aren't heard).'''
+    rng = random.Random(seed)
+    tokens = [rng.choice(VOCAB) for i in range(n_words)]
+    pcm = bytearray()
+    for idx, token in enumerate(tokens):
+        value = 0 if idx in dropped else VOCAB.index(token) + 2
+        pcm += b'\x00\x00' * 800 + value.to_bytes(2, 'little') * 2400
+    return ' '.join(tokens), bytes(pcm)
+
+class FakeBinaries(unittest.TestCase):
+    '''Aligns with benchmarks/fake/k3 and m3, on resources made up in a
+    temporary directory.'''
+
+    def setUp(self):
+        import gentle
+        from gentle import language_model, standard_kaldi
+        self.tmpdir = tempfile.mkdtemp()
+        make_resources(self.tmpdir, VOCAB)
+        self.env = os.environ.get('GENTLE_RESOURCES_ROOT')
+        os.environ['GENTLE_RESOURCES_ROOT'] = self.tmpdir
+        self.paths = (standard_kaldi.EXECUTABLE_PATH, language_model.MKGRAPH_PATH)
+        standard_kaldi.EXECUTABLE_PATH = FAKE_K3
+        language_model.MKGRAPH_PATH = FAKE_M3
+        self.resources = gentle.Resources()
+
+    def tearDown(self):
+        from gentle import language_model, standard_kaldi
+        standard_kaldi.EXECUTABLE_PATH, language_model.MKGRAPH_PATH = self.paths
+        if self.env is None:
+            del os.environ['GENTLE_RESOURCES_ROOT']
+        else:
+            os.environ['GENTLE_RESOURCES_ROOT'] = self.env
+        shutil.rmtree(self.tmpdir)
+
+    def forced_alignment(self, transcript, pcm):
+        import gentle
+        from gentle import audio
+        return gentle.ForcedAligner(self.resources, transcript, nthreads=2).transcribe(audio.AudioSource(pcm)).words
+
+    def assertSameAlignment(self, words, expected):
+        self.assertEqual([(X.word, X.case, X.startOffset) for X in words],
+                         [(X.word, X.case, X.startOffset) for X in expected])
+        for wd, ex in zip(words, expected):
+            if ex.success():
+                self.assertAlmostEqual(wd.start, ex.start, delta=0.001)
+                self.assertAlmostEqual(wd.end, ex.end, delta=0.001)
+
+class StreamingAligner(FakeBinaries):
+
+    def test_stream(self):
+        from gentle.streaming_aligner import StreamingAligner
+
+        transcript, pcm = make_input(60, dropped=(10,))
+        aligner = StreamingAligner(self.resources, transcript, chunk_len=5, overlap_t=1, window=20)
+        # Fed a second at a time, as if it were live
+        words = list(aligner.stream([pcm[X:X + 16000] for X in range(0, len(pcm), 16000)]))
+
+        self.assertEqual(len(words), 60)
+        self.assertTrue(words[10].not_found_in_audio())
+        self.assertEqual(len([X for X in words if X.success()]), 59)
+        self.assertSameAlignment(words, self.forced_alignment(transcript, pcm))
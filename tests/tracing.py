@@ -0,0 +1,52 @@
+import json
+import os
+import threading
+import unittest
+
+class Tracing(unittest.TestCase):
+
+    def test_spans(self):
+        from gentle.tracing import Tracer
+
+        tracer = Tracer()
+        with tracer.span('job', words=3) as job:
+            with tracer.span('decode', chunk=0) as span:
+                span.set(worker=42)
+            job.set(aligned=2)
+        def gap():
+            with tracer.span('gap'):
+                pass
+        t = threading.Thread(target=gap, name='aligner')
+        t.start()
+        t.join()
+
+        trace = json.loads(tracer.to_json())
+        self.assertEqual(trace['displayTimeUnit'], 'ms')
+        events = trace['traceEvents']
+        # Threads are named once, by their first span
+        self.assertEqual([(X['tid'], X['args']['name']) for X in events if X['ph'] == 'M'],
+                         [(1, threading.current_thread().name), (2, 'aligner')])
+        spans = dict([(X['name'], X) for X in events if X['ph'] == 'X'])
+        self.assertEqual(sorted(spans), ['decode', 'gap', 'job'])
+        self.assertEqual([spans[X]['tid'] for X in ['job', 'decode', 'gap']], [1, 1, 2])
+        for X in events:
+            self.assertEqual(X['pid'], os.getpid())
+
+        job, decode = spans['job'], spans['decode']
+        self.assertEqual(job['args'], {'words': 3, 'aligned': 2})
+        self.assertEqual(decode['args'], {'chunk': 0, 'worker': 42})
+        # The inner span lies within the outer one (give or take rounding
+        # to microseconds), and events are in order
+        self.assertLessEqual(job['ts'], decode['ts'])
+        self.assertLessEqual(decode['ts'] + decode['dur'], job['ts'] + job['dur'] + 1)
+        self.assertLessEqual(job['ts'] + job['dur'], spans['gap']['ts'] + 1)
+        starts = [X['ts'] for X in events if X['ph'] == 'X']
+        self.assertEqual(starts, sorted(starts))
+
+    def test_null_tracer(self):
+        from gentle.tracing import NULL_TRACER
+
+        with NULL_TRACER.span('job', words=3) as span:
+            span.set(worker=42)
+        # (Every span is the same do-nothing object)
+        self.assertIs(NULL_TRACER.span('decode'), span)
@@ -34,3 +34,66 @@ class Aligner(unittest.TestCase):
         self.assertEqual(words[0].word, "i")
         self.assertEqual(words[1].word, "am")
         self.assertEqual(words[1].case, Word.SUCCESS)        
+
+class FakeKaldi():
+    '''Decodes PCM in which each word is a run of samples equal to its
+    index in `vocab`, with silence as 0.'''
+
+    pid = 0
+
+    def __init__(self, vocab, hold=None):
+        self.vocab = vocab
+        self.hold = hold
+
+    def push_chunk(self, buf):
+        import array
+        self.samples = array.array('h')
+        self.samples.frombytes(buf)
+
+    def get_final(self):
+        if self.hold is not None and self.samples[-1] == -1:
+            self.hold.wait()
+        words = []
+        start = 0
+        for idx in range(1, len(self.samples) + 1):
+            if idx == len(self.samples) or self.samples[idx] != self.samples[start]:
+                if self.samples[start] > 0 and idx - start >= 800:
+                    words.append({'word': self.vocab[self.samples[start]], 'start': start / 8000.0,
+                                  'duration': (idx - start) / 8000.0, 'phones': []})
+                start = idx
+        return words
+
+class ChunkMerge(unittest.TestCase):
+
+    def test_iter_words(self):
+        import array
+        import queue
+        import threading
+        from gentle.audio import AudioSource
+        from gentle.transcriber import MultiThreadedTranscriber
+
+        vocab = [None] + ['w%d' % (i) for i in range(1, 40)]
+        samples = array.array('h')
+        for i in range(1, 40):
+            samples.extend([i] * 2400 + [0] * 800)
+        # Marks the last chunk, which waits until it's released
+        samples.extend([-1] * 4000)
+        source = AudioSource(samples.tobytes())
+
+        hold = threading.Event()
+        kaldi_queue = queue.Queue()
+        for i in range(2):
+            kaldi_queue.put(FakeKaldi(vocab, hold))
+        mtt = MultiThreadedTranscriber(kaldi_queue, chunk_len=3, overlap_t=1, nthreads=2, vad=False)
+
+        words = mtt.iter_words(source)
+        # Words come before the last chunk is decoded
+        first = next(words)
+        self.assertEqual(first.word, 'w1')
+        hold.set()
+        words = [first] + list(words)
+        # In order, with the overlaps removed
+        self.assertEqual([X.start for X in words], sorted([X.start for X in words]))
+        self.assertEqual(len(set([X.word for X in words])), len(words))
+        self.assertTrue(len(words) > 30)
+        self.assertEqual(words, mtt.transcribe(source)[0])
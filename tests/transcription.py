@@ -0,0 +1,50 @@
+import io
+import json
+import unittest
+
+class Transcription(unittest.TestCase):
+
+    def setUp(self):
+        from gentle.transcription import Transcription, Word
+
+        transcript = 'Hello "world", again'
+        self.trans = Transcription(transcript, [
+            Word(case=Word.SUCCESS, startOffset=0, endOffset=5, word='Hello', alignedWord='hello',
+                 start=0.5, duration=0.25, phones=[{'phone': 'hh_B', 'duration': 0.1}, {'phone': 'ow_E', 'duration': 0.15}]),
+            Word(case=Word.NOT_FOUND_IN_AUDIO, startOffset=7, endOffset=12, word='world'),
+            Word(case=Word.NOT_FOUND_IN_TRANSCRIPT, word='uh', alignedWord='uh', start=1.0, end=1.2, phones=[]),
+            Word(case=Word.SUCCESS, startOffset=15, endOffset=20, word='again', alignedWord='again',
+                 start=1.5, duration=0.5, phones=[{'phone': 'ah_B', 'duration': 0.5}]),
+        ])
+
+    def dumps(self, trans, **kwargs):
+        # What to_json used to do
+        options = {'sort_keys': True, 'indent': 4, 'separators': (',', ': ')}
+        options.update(kwargs)
+        container = {}
+        if trans.transcript:
+            container['transcript'] = trans.transcript
+        if trans.words:
+            container['words'] = [word.as_dict(without="duration") for word in trans.words]
+        return json.dumps(container, **options)
+
+    def test_json_unchanged(self):
+        from gentle.transcription import Transcription
+
+        for trans in [self.trans, Transcription(), Transcription('text only')]:
+            for kwargs in [{}, {'indent': 2}, {'indent': None}, {'sort_keys': False}, {'indent': None, 'separators': (',', ':')}]:
+                self.assertEqual(trans.to_json(**kwargs), self.dumps(trans, **kwargs))
+                buf = io.StringIO()
+                trans.write_json(buf, **kwargs)
+                self.assertEqual(buf.getvalue(), self.dumps(trans, **kwargs))
+
+    def test_columnar(self):
+        from gentle.transcription import ColumnarTranscription, Transcription
+
+        columnar = ColumnarTranscription.from_transcription(self.trans)
+        self.assertEqual(columnar, self.trans)
+        self.assertEqual(columnar.words[-1], self.trans.words[-1])
+        self.assertEqual(columnar.to_json(indent=2), self.trans.to_json(indent=2))
+        self.assertEqual(columnar.to_csv(), self.trans.to_csv())
+        self.assertEqual(columnar.stats(), self.trans.stats())
+        self.assertEqual(ColumnarTranscription.from_json(self.trans.to_json()), Transcription.from_json(self.trans.to_json()))
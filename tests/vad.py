@@ -0,0 +1,39 @@
+import array
+import unittest
+
+def pcm(*parts):
+    '''PCM from (seconds, amplitude) pairs, as a square wave.'''
+    samples = array.array('h')
+    for seconds, amplitude in parts:
+        samples.extend([amplitude, -amplitude] * int(seconds * 4000))
+    return samples.tobytes()
+
+class VAD(unittest.TestCase):
+
+    def test_silent_frames(self):
+        from gentle import vad
+
+        silent = vad.silent_frames(pcm((1, 3000), (0.5, 0), (1, 3000)), 8000)
+        self.assertEqual(len(silent), 125)
+        self.assertEqual(list(silent), [0] * 50 + [1] * 25 + [0] * 50)
+
+    def test_cut_in_pauses(self):
+        from gentle import vad
+
+        # Speech with a pause every 4s, then a long silence
+        audio = pcm(*([(3.8, 3000), (0.2, 0)] * 10 + [(10, 0), (5, 3000)]))
+        chunks, skipped = vad.plan_chunks(vad.silent_frames(audio, 8000), chunk_n=500, overlap_n=100)
+
+        self.assertAlmostEqual(skipped * vad.FRAME_T, 10.2 - 2 * vad.PAD_T, delta=2 * vad.FRAME_T)
+        self.assertTrue(all([end - start <= 500 for start, end, _, _ in chunks]))
+        # Nothing overlaps
+        self.assertFalse(any([X[2] or X[3] for X in chunks]))
+        for prev, chunk in zip(chunks, chunks[1:]):
+            self.assertGreaterEqual(chunk[0], prev[1])
+
+    def test_overlap_without_pauses(self):
+        from gentle import vad
+
+        chunks, skipped = vad.plan_chunks(vad.silent_frames(pcm((25, 3000)), 8000), chunk_n=500, overlap_n=100)
+        self.assertEqual(skipped, 0)
+        self.assertEqual(chunks, [(0, 500, False, True), (400, 900, True, True), (800, 1250, True, False)])
@@ -0,0 +1,31 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+class Vocabulary(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_lookup(self):
+        from gentle import metasentence, vocab
+
+        words = ['<eps>', '<unk>', 'a', 'ab', 'b', "don't", 'naïve'] + ['w%d' % (i) for i in range(1000)]
+        path = os.path.join(self.tmpdir, 'words.idx')
+        vocab.compile_index(words, path)
+        v = vocab.Vocabulary(path)
+
+        self.assertEqual(len(v), len(words))
+        self.assertEqual(set(v), set(words))
+        for word in words:
+            self.assertIn(word, v)
+        for word in ['', 'abc', 'c', 'w1000', 'naive', 'W1']:
+            self.assertNotIn(word, v)
+
+        self.assertEqual(metasentence.kaldi_normalize('Don’t', v), "don't")
+        self.assertEqual(metasentence.kaldi_normalize('Naïve', v), 'naïve')
+        self.assertEqual(metasentence.kaldi_normalize('zebra', v), metasentence.OOV_TERM)
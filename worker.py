@@ -0,0 +1,62 @@
+import argparse
+import logging
+import multiprocessing
+import socket
+
+import gentle
+from gentle import cluster
+from gentle import standard_kaldi
+from gentle.graph_cache import GraphCache
+
+parser = argparse.ArgumentParser(
+        description='Run alignment jobs for a gentle server started with --workers.')
+parser.add_argument(
+        'address', type=str,
+        help='the server\'s worker address (host:port, or the path of a Unix socket)')
+parser.add_argument(
+        '--nthreads', default=multiprocessing.cpu_count(), type=int,
+        help='number of alignment threads (k3 processes)')
+parser.add_argument(
+        '--ntranscriptionthreads', default=0, type=int,
+        help='number of full-transcription threads (memory intensive); 0 takes alignment jobs only')
+parser.add_argument(
+        '--capacity', default=1, type=int,
+        help='number of jobs to run at once')
+parser.add_argument(
+        '--graph-cache', metavar='dir', type=str,
+        help='reuse alignment graphs stored in (and save new ones to) this directory')
+parser.add_argument(
+        '--k3-sessions', dest='k3_sessions', action='store_true',
+        help='run the k3 decoders as sessions of one process, which loads the model and graphs once')
+parser.add_argument(
+        '--k3-zygote', dest='k3_zygote', action='store_true',
+        help='fork the k3 decoders from a process that has the model loaded, so that they start at once')
+parser.add_argument(
+        '--secret', metavar='file', type=str,
+        help='file with the secret given to the server with --worker-secret')
+parser.add_argument(
+        '--name', default=socket.gethostname(),
+        help='name to report to the server')
+parser.add_argument(
+        '--log', default="INFO",
+        help='the log level (DEBUG, INFO, WARNING, ERROR, or CRITICAL)')
+args = parser.parse_args()
+
+logging.getLogger().setLevel(args.log.upper())
+standard_kaldi.SESSIONS = args.k3_sessions
+standard_kaldi.ZYGOTE = args.k3_zygote
+
+resources = gentle.Resources()
+graph_cache = GraphCache(args.graph_cache) if args.graph_cache else None
+handler = cluster.AlignmentHandler(resources, nthreads=args.nthreads, ntranscriptionthreads=args.ntranscriptionthreads, graph_cache=graph_cache)
+
+secret = cluster.read_secret(args.secret) if args.secret else None
+worker = cluster.Worker(args.address, handler, capacity=args.capacity, name=args.name, secret=secret)
+logging.info("working for %s" % (args.address))
+worker.start()
+try:
+    worker.join()
+except KeyboardInterrupt:
+    worker.stop()
+finally:
+    handler.stop()